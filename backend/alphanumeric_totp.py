@@ -5,6 +5,113 @@ import hashlib
 import time
 import base64
 import os
+import struct
+
+ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+
+_unpack_word = struct.Struct('>I').unpack_from
+_pack_counter = struct.Struct('>Q').pack
+
+# Every two-character base-36 string, so a 6-character code is three lookups
+_PAIRS = [a + b for a in ALPHABET for b in ALPHABET]
+_PAIR_BASE = len(_PAIRS)
+
+_IPAD = bytes(x ^ 0x36 for x in range(256))
+_OPAD = bytes(x ^ 0x5c for x in range(256))
+
+
+# RFC 4648 base32 letters as int(..., 32) digits; anything else becomes '!' so int() rejects it
+_B32_DIGITS = {ord(c): '0123456789abcdefghijklmnopqrstuv'[i] for i, c in enumerate('ABCDEFGHIJKLMNOPQRSTUVWXYZ234567')}
+_B32_TABLE = {i: _B32_DIGITS.get(i, '!') for i in range(128)}
+# Unpadded lengths base32 can produce (len % 8); the rest are invalid and left to b32decode to reject
+_B32_LENGTHS = frozenset((0, 2, 4, 5, 7))
+
+
+def decode_secret(secret):
+    """
+    Decode a base32 secret, adding the padding authenticator URLs usually omit
+
+    The same bytes as base64.b32decode(), which is pure Python on 3.11 and
+    dominated the cost of keying a secret; the string is read as one base-32
+    integer instead. Malformed input, including surplus '=' padding, still
+    goes to b32decode() so it raises the same binascii.Error.
+    """
+    chars = secret.upper().rstrip('=')
+    # More '=' than the unpadded length calls for is an error for b32decode() too
+    padding = len(secret) - len(chars)
+    if chars.isascii() and len(chars) % 8 in _B32_LENGTHS and padding <= -len(chars) % 8:
+        try:
+            value = int(chars.translate(_B32_TABLE), 32) if chars else 0
+        except ValueError:
+            pass
+        else:
+            size = len(chars) * 5 // 8
+            # Trailing bits that do not fill a byte are dropped, as b32decode() does
+            return (value >> (len(chars) * 5 - size * 8)).to_bytes(size, 'big')
+    return base64.b32decode(secret.upper() + '=' * (-len(secret) % 8))
+
+
+def prepare_key(secret, digest=hashlib.sha1):
+    """
+    Decode a secret and run the HMAC key schedule once
+
+    Returns:
+        tuple: (inner, outer) hash states already keyed with ipad/opad; copy them
+            per counter instead of re-running hmac.new()
+    """
+    key = decode_secret(secret)
+    block_size = digest().block_size
+    if len(key) > block_size:
+        key = digest(key).digest()
+    key = key.ljust(block_size, b'\0')
+    return digest(key.translate(_IPAD)), digest(key.translate(_OPAD))
+
+
+def _to_alphanumeric(mac, digits):
+    # Dynamic truncation followed by base-36 conversion, identical to generate_otp()
+    code = _unpack_word(mac, mac[-1] & 0xf)[0] & 0x7fffffff
+    if digits == 6:
+        high, rest = divmod(code, _PAIR_BASE * _PAIR_BASE)
+        middle, low = divmod(rest, _PAIR_BASE)
+        return _PAIRS[high] + _PAIRS[middle] + _PAIRS[low]
+    chars = [ALPHABET[0]] * digits
+    for i in range(digits - 1, -1, -1):
+        code, remainder = divmod(code, len(ALPHABET))
+        chars[i] = ALPHABET[remainder]
+    return ''.join(chars)
+
+
+def generate_batch(pairs, digits=6, digest=hashlib.sha1, keys=None):
+    """
+    Generate OTPs for many (secret, counter) pairs in one call
+
+    Each distinct secret is decoded and keyed once; every counter for it then
+    starts from a copy of the pre-keyed inner/outer hash states.
+
+    Args:
+        pairs (iterable): (secret, counter) tuples, counter being an int
+        digits (int): Number of characters in each OTP
+        digest: Hash function to use (default: SHA1)
+        keys: Optional secret -> prepare_key() mapping reused across calls,
+            either a dict or a key_cache.KeyCache
+
+    Returns:
+        list: OTP strings in the same order as pairs, bit-identical to generate_otp()
+    """
+    if keys is None:
+        keys = {}
+    codes = []
+    append = codes.append
+    for secret, counter in pairs:
+        prepared = keys.get(secret)
+        if prepared is None:
+            prepared = keys[secret] = prepare_key(secret, digest)
+        inner = prepared[0].copy()
+        inner.update(_pack_counter(counter))
+        outer = prepared[1].copy()
+        outer.update(inner.digest())
+        append(_to_alphanumeric(outer.digest(), digits))
+    return codes
 
 
 class AlphanumericTOTP(pyotp.TOTP):
@@ -19,7 +126,7 @@ class AlphanumericTOTP(pyotp.TOTP):
             interval (int): The time interval in seconds for OTP
         """
         super().__init__(secret, digits=digits, digest=digest, interval=interval)
-        self.alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+        self.alphabet = ALPHABET
         self.base = len(self.alphabet)
 
     def generate_otp(self, input):
@@ -56,6 +163,11 @@ class AlphanumericTOTP(pyotp.TOTP):
 
         return otp.rjust(self.digits, self.alphabet[0])
 
+    def generate_batch(self, counters):
+        """Generate OTPs for many counters of this secret with one pre-keyed HMAC"""
+        return generate_batch(((self.secret, counter) for counter in counters),
+                              digits=self.digits, digest=self.digest)
+
     def now(self):
         """Generate current time OTP"""
         return self.generate_otp(time.time())
@@ -81,13 +193,15 @@ class AlphanumericTOTP(pyotp.TOTP):
         if for_time is None:
             for_time = time.time()
 
-        if valid_window:
-            for i in range(-valid_window, valid_window + 1):
-                if self.generate_otp(for_time + i * self.interval) == str(otp):
-                    return True
-            return False
-
-        return str(otp) == self.generate_otp(for_time)
+        # Every offset starts from the same pre-keyed HMAC instead of re-keying per
+        # offset; inputs become counters exactly as generate_otp() converts them
+        inputs = [for_time + i * self.interval for i in range(-valid_window, valid_window + 1)]
+        counters = [int(value / self.interval) if isinstance(value, float) else int(value) for value in inputs]
+        submitted = str(otp).encode("utf-8")
+        return any([
+            hmac.compare_digest(code.encode("utf-8"), submitted)
+            for code in self.generate_batch(counters)
+        ])
 
     @staticmethod
     def random_base32(length=16):
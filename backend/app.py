@@ -1,17 +1,12 @@
 from flask import Flask, jsonify
-import requests
-import cv2
 import logging
 import time
-from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.hazmat.primitives import serialization, hashes
 from flask_cors import CORS
-import mysql.connector
-from mysql.connector import Error
-from pyzbar.pyzbar import decode
 from alphanumeric_totp import AlphanumericTOTP  # Import your custom TOTP class
+from db_pool import create_pool
+from decrypt_client import DecryptClient
 import json
-from apscheduler.schedulers.background import BackgroundScheduler
+from totp_scheduler import TotpScheduler
 
 app = Flask(__name__)
 CORS(app, origins="*", supports_credentials=True)
@@ -28,14 +23,18 @@ db_config = {
 }
 
 
-# Helper function to connect to the database
+# Keep-alive, timeout-bounded client for the QR decrypt service
+decrypt_client = DecryptClient("http://13.61.95.75:6000")
+
+# Shared, bounded connection pool instead of a new connection per request
+db_pool = create_pool(db_config)
+
+
+# Helper function to borrow a database connection from the pool
 def get_db_connection():
     try:
-        connection = mysql.connector.connect(**db_config)
-        if connection.is_connected():
-            logging.info("Database connected successfully!")
-        return connection
-    except Error as e:
+        return db_pool.connection()
+    except Exception as e:
         logging.error(f"Error connecting to database: {e}")
         return None
 
@@ -59,18 +58,14 @@ def generate_totp(totp_secret):
         return None, None
 
 
-# Function to schedule TOTP generation every 30 seconds
-def schedule_totp_for_user(user_uuid, totp_secret):
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(
-        generate_totp,
-        'interval',
-        seconds=30,
-        args=[totp_secret],
-        id=f"totp_job_{user_uuid}",
-    )
-    scheduler.start()
-    logging.info(f"Scheduled TOTP generation job for user: {user_uuid}")
+# Batched tick: advance every scheduled secret on the shared 30-second boundary
+def generate_totp_batch(batch):
+    for user_uuid, totp_secret in batch:
+        generate_totp(totp_secret)
+
+
+# Single shared scheduler instead of one BackgroundScheduler per scanned account
+totp_scheduler = TotpScheduler(generate_totp_batch, interval=30)
 
 
 # Endpoint to scan QR code and decrypt URL
@@ -96,13 +91,7 @@ def scan_qr():
                 return jsonify({"error": "Error parsing QR code payload."}), 400
 
             # Send API request to decrypt URL
-            response = requests.post(
-                "http://13.61.95.75:6000/decrypt-url",
-                json={
-                    "uuid": payload["uuid"],
-                    "encrypted_url": payload["encrypted_url"]
-                },
-            )
+            response = decrypt_client.decrypt_url(payload["uuid"], payload["encrypted_url"])
 
             if response.status_code == 200:
                 decrypted_url = response.json()["decrypted_url"]
@@ -116,20 +105,24 @@ def scan_qr():
 
                 # Save or update the TOTP secret in the database with the user_uid
                 connection = get_db_connection()
-                cursor = connection.cursor()
-                cursor.execute(
-                    """
-                    INSERT INTO user_totp (user_uuid, totp_secret, uid)
-                    VALUES (%s, %s, %s)
-                    ON DUPLICATE KEY UPDATE totp_secret = VALUES(totp_secret), uid = VALUES(uid)
-                    """,
-                    (payload["uuid"], totp_secret, user_uid_from_session)
-                )
-                connection.commit()
-                connection.close()
+                try:
+                    cursor = connection.cursor()
+                    cursor.execute(
+                        """
+                        INSERT INTO user_totp (user_uuid, totp_secret, uid)
+                        VALUES (%s, %s, %s)
+                        ON DUPLICATE KEY UPDATE totp_secret = VALUES(totp_secret), uid = VALUES(uid)
+                        """,
+                        (payload["uuid"], totp_secret, user_uid_from_session)
+                    )
+                    connection.commit()
+                    cursor.close()
+                finally:
+                    connection.close()
 
                 # Start scheduling TOTP generation for this user
-                schedule_totp_for_user(payload["uuid"], totp_secret)
+                totp_scheduler.add(payload["uuid"], totp_secret)
+                totp_scheduler.start()
 
                 return jsonify({
                     "message": "QR code scanned successfully and TOTP secret stored."
@@ -0,0 +1,489 @@
+"""
+ASGI entry point for the AuthShield backend.
+
+Serves the same session routes as authshield_server.py on Quart, with aiomysql
+for the database and aiohttp for the decrypt service, so one worker can hold
+thousands of concurrent requests instead of one per thread. Session cookies are
+signed the same way Flask signs them, so with the same SESSION_SECRET_KEY a
+cookie issued by either server is accepted by the other.
+
+Run a single worker. Each worker starts its own TOTP scheduler and there are
+no shard leases here, so every extra worker would run the full 45-second tick
+again and write the same codes. One worker already holds thousands of
+requests; for several processes or nodes, run authshield_server with
+SCHEDULER_SHARDS instead.
+
+    hypercorn asgi_server:app --bind 0.0.0.0:5000 --workers 1
+"""
+import asyncio
+import atexit
+import logging
+import os
+from functools import wraps
+
+from dotenv import load_dotenv
+from quart import Quart, jsonify, request, session
+from quart_cors import cors
+
+from async_db import create_async_pool
+from db_pool import is_duplicate_entry
+from code_cache import AccountCache, SharedCodeStore, WindowCodeCache
+from decrypt_client import AsyncDecryptClient, CircuitOpenError, DecryptServiceError
+from log_config import configure_logging
+from migrations import UNIQUE_EMAIL_VERSION
+from password_hasher import PasswordHasher, PoolBusy
+from rate_limit import DEFAULT_ROUTE_LIMITS, client_key, route_limiters
+from totp_codes import WINDOW_SECONDS, codes_for_tick, codes_for_window, key_cache, window_bounds
+from totp_scheduler import TotpScheduler
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+app = cors(Quart(__name__), allow_origin="*", allow_headers=["Content-Type", "Authorization"])
+app.secret_key = os.getenv('SESSION_SECRET_KEY', 'supersecretkey')
+
+TOTP_STATELESS = os.getenv('TOTP_STATELESS', 'false').lower() == 'true'
+
+# Same database as authshield_server.py
+db_config = {
+    "host": "13.203.127.173",
+    "user": "admin",
+    "password": "admin123",
+    "database": "authshieldUsers"
+}
+
+# Created on startup, inside the server's event loop
+db_pool = None
+decrypt_client = None
+event_loop = None
+
+password_hasher = PasswordHasher(
+    rounds=int(os.getenv('BCRYPT_ROUNDS', '12')),
+    workers=int(os.getenv('HASH_WORKERS', '4')),
+    queue_depth=int(os.getenv('HASH_QUEUE_DEPTH', '16')),
+)
+
+shared_store = SharedCodeStore(os.environ['TOTP_CODE_CACHE_PATH']) if os.getenv('TOTP_CODE_CACHE_PATH') else None
+code_cache = WindowCodeCache(WINDOW_SECONDS, store=shared_store)
+
+account_cache = AccountCache(
+    max_entries=int(os.getenv('ACCOUNT_CACHE_SIZE', '10000')),
+    ttl=float(os.getenv('ACCOUNT_CACHE_TTL', '300' if shared_store is not None else str(WINDOW_SECONDS))),
+    store=shared_store,
+)
+
+
+def busy_response(e):
+    response = jsonify({"error": "Server busy, please retry"})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, 503
+
+
+# Same per-route token buckets as authshield_server.py
+limiters = route_limiters(os.getenv('RATE_LIMITS', DEFAULT_ROUTE_LIMITS), os.getenv('RATE_LIMIT_STORE_PATH'))
+
+
+@app.before_request
+async def admission_control():
+    # Rejects over-limit requests before the view reads the body or touches the database
+    if request.method == "OPTIONS" or request.url_rule is None:
+        return None
+    limiter = limiters.get(request.url_rule.rule)
+    if limiter is None:
+        return None
+    allowed, retry_after = limiter.allow(client_key(request.url_rule.rule, session.get('uid'), request.remote_addr))
+    if not allowed:
+        response = jsonify({"error": "Too many requests"})
+        response.headers["Retry-After"] = str(retry_after)
+        return response, 429
+    return None
+
+
+async def fetch_one(query, params):
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(query, params)
+            return await cursor.fetchone()
+
+
+async def fetch_all(query, params):
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(query, params)
+            return await cursor.fetchall()
+
+
+async def execute(query, params, many=False):
+    async with db_pool.acquire() as conn:
+        # The pool is in autocommit mode; a batch still lands in one transaction
+        await conn.begin()
+        try:
+            async with conn.cursor() as cursor:
+                if many:
+                    await cursor.executemany(query, params)
+                else:
+                    await cursor.execute(query, params)
+                await conn.commit()
+                return cursor.lastrowid
+        except BaseException:
+            await conn.rollback()
+            raise
+
+
+# Same cached (account, user_uuid, 2faenabled, totp_secret) rows as the WSGI server
+async def enrolled_accounts(uid):
+    rows, generation = account_cache.lookup(uid)
+    if rows is not None:
+        return rows
+
+    rows = [tuple(row) for row in await fetch_all(
+        "SELECT account, user_uuid, 2faenabled, totp_secret FROM user_totp WHERE uid = %s AND 2faenabled = 1",
+        (uid,)
+    )]
+    account_cache.set(uid, generation, rows)
+    return rows
+
+
+async def window_code(endpoint, account):
+    window_start, time_until_next = window_bounds()
+    cached = code_cache.get(endpoint, session['uid'], account, window_start)
+    if cached is not None:
+        return cached, time_until_next
+
+    # Scoped to the session's user: the memo below is keyed by it, and account names are not unique
+    result = await fetch_one(
+        "SELECT totp_secret, uid FROM user_totp WHERE account = %s AND uid = %s", (account, session['uid'])
+    )
+    if result is None:
+        return None, time_until_next
+
+    value = {"code": codes_for_window([result[0]], window_start)[0], "uid": result[1]}
+    code_cache.set(session['uid'], account, window_start, value)
+    return value, time_until_next
+
+
+async def generate_totp_batch_async(batch):
+    window_start, _ = window_bounds()
+    codes = codes_for_tick([totp_secret for _, totp_secret in batch], window_start)
+    updates = [(code, user_uuid) for (user_uuid, _), code in zip(batch, codes)]
+    await execute("UPDATE user_totp SET next_code = %s WHERE user_uuid = %s", updates, many=True)
+    logger.info("Advanced %s TOTP codes for window %s", len(updates), window_start)
+
+
+# The scheduler ticks on its own thread; the write-back runs on the server's loop.
+# It covers every enrolled secret, which is why this app runs as one worker.
+def generate_totp_batch(batch):
+    asyncio.run_coroutine_threadsafe(generate_totp_batch_async(batch), event_loop).result()
+
+
+totp_scheduler = TotpScheduler(generate_totp_batch, interval=WINDOW_SECONDS)
+atexit.register(totp_scheduler.shutdown)
+
+
+@app.before_serving
+async def startup():
+    global db_pool, decrypt_client, event_loop
+    event_loop = asyncio.get_running_loop()
+    db_pool = await create_async_pool(db_config)
+    decrypt_client = AsyncDecryptClient(
+        os.getenv('DECRYPT_SERVICE_URL', 'http://13.203.127.173:5001'),
+        connect_timeout=float(os.getenv('DECRYPT_CONNECT_TIMEOUT', '2')),
+        read_timeout=float(os.getenv('DECRYPT_READ_TIMEOUT', '5')),
+        retries=int(os.getenv('DECRYPT_RETRIES', '2')),
+    )
+    if TOTP_STATELESS:
+        totp_scheduler.start()
+    else:
+        rows = await fetch_all("SELECT user_uuid, totp_secret FROM user_totp WHERE 2faenabled = 1", ())
+        totp_scheduler.start(lambda: rows)
+
+
+@app.after_serving
+async def shutdown():
+    totp_scheduler.shutdown()
+    await decrypt_client.close()
+    db_pool.close()
+    await db_pool.wait_closed()
+
+
+def login_required(f):
+    @wraps(f)
+    async def decorated(*args, **kwargs):
+        if 'uid' not in session:
+            logger.warning("User not logged in")
+            return jsonify({"error": "Unauthorized access"}), 401
+        return await f(*args, **kwargs)
+    return decorated
+
+
+@app.route("/")
+async def home():
+    return "AuthShield app backend running (ASGI)"
+
+
+# Same fallback as authshield_server.email_taken(): a SELECT before the INSERT
+# until schema_migrations shows the unique email index exists
+unique_email_enforced = False
+
+
+async def email_taken(email):
+    global unique_email_enforced
+    if not unique_email_enforced:
+        try:
+            unique_email_enforced = await fetch_one(
+                "SELECT 1 FROM schema_migrations WHERE version = %s", (UNIQUE_EMAIL_VERSION,)
+            ) is not None
+        except Exception as e:
+            logger.debug("Could not read schema_migrations: %s", e)
+        if not unique_email_enforced:
+            logger.warning("Migration %03d is not applied; run migrations.py", UNIQUE_EMAIL_VERSION)
+    if unique_email_enforced:
+        return False
+    return await fetch_one("SELECT 1 FROM AppUsers WHERE email = %s LIMIT 1", (email,)) is not None
+
+
+@app.route("/signup", methods=["POST"])
+async def signup():
+    try:
+        data = await request.get_json()
+        email = data.get("email")
+        password = data.get("password")
+        confirm_password = data.get("confirm_password")
+
+        if not all([email, password, confirm_password]):
+            return jsonify({"error": "Please fill in all the fields"}), 400
+        if password != confirm_password:
+            return jsonify({"error": "Passwords do not match"}), 400
+
+        hashed_password = await password_hasher.hash_async(password)
+        if await email_taken(email):
+            return jsonify({"error": "Email already exists"}), 400
+        try:
+            uid = await execute("INSERT INTO AppUsers(email, password) VALUES (%s, %s)", (email, hashed_password))
+        except Exception as e:
+            if is_duplicate_entry(e):
+                return jsonify({"error": "Email already exists"}), 400
+            raise
+        if not uid:
+            raise Exception("User creation failed")
+
+        session['uid'] = uid
+        session['email'] = email
+        return jsonify({"message": "Signup successful", "uid": uid}), 200
+
+    except PoolBusy as e:
+        return busy_response(e)
+    except Exception as e:
+        logger.error("Signup error: %s", e)
+        return jsonify({"error": "Signup failed"}), 500
+
+
+@app.route("/login", methods=["POST"])
+async def login():
+    try:
+        data = await request.get_json()
+        email = data.get("email")
+        password = data.get("password")
+
+        if not all([email, password]):
+            return jsonify({"error": "Please fill in all fields"}), 400
+
+        user = await fetch_one("SELECT uid, password FROM AppUsers WHERE email = %s", (email,))
+        if not user or not await password_hasher.check_async(password, user[1]):
+            return jsonify({"error": "Invalid email or password"}), 401
+
+        uid = user[0]
+        if password_hasher.needs_rehash(user[1]):
+            password_hasher.rehash_in_background(password, lambda new_hash: asyncio.run_coroutine_threadsafe(
+                execute("UPDATE AppUsers SET password = %s WHERE uid = %s", (new_hash, uid)), event_loop
+            ).result())
+        session['uid'] = uid
+        session['email'] = email
+        return jsonify({"message": "Login successful", "uid": uid}), 200
+
+    except PoolBusy as e:
+        return busy_response(e)
+    except Exception as e:
+        logger.error("Login error: %s", e)
+        return jsonify({"error": "Login failed"}), 500
+
+
+@app.route("/logout", methods=["POST"])
+async def logout():
+    session.clear()
+    return jsonify({"message": "Logged out successfully"}), 200
+
+
+@app.route("/get-totp-data", methods=["GET"])
+@login_required
+async def get_totp_data():
+    try:
+        uid = session['uid']
+        totp_records = await enrolled_accounts(uid)
+        window_start, _ = window_bounds()
+        codes = codes_for_window([record[3] for record in totp_records], window_start)
+
+        totp_data = [
+            {
+                "id": uid,
+                "account": record[0],
+                "code": code,
+                "timeRemaining": 30
+            }
+            for record, code in zip(totp_records, codes)
+        ]
+        return jsonify({"totp_enabled": len(totp_data) > 0, "totp_data": totp_data}), 200
+
+    except Exception as e:
+        logger.error("Error fetching TOTP data: %s", e)
+        return jsonify({"error": "Failed to fetch TOTP data"}), 500
+
+
+@app.route("/scan", methods=["POST"])
+@login_required
+async def scan_qr():
+    try:
+        request_data = await request.get_json()
+        qr_code_data = request_data.get("qr_code_data")
+        if not qr_code_data:
+            return jsonify({"error": "Invalid request structure, 'qr_code_data' missing"}), 400
+
+        user_uuid_from_qr = qr_code_data.get("uuid")
+        encrypted_url = qr_code_data.get("encrypted_url")
+        if not user_uuid_from_qr:
+            return jsonify({"error": "UUID not found in QR code payload"}), 400
+        if not encrypted_url:
+            return jsonify({"error": "'encrypted_url' missing in QR code payload"}), 400
+
+        decrypt_response = await decrypt_client.decrypt_url(user_uuid_from_qr, encrypted_url)
+        if decrypt_response.status_code != 200:
+            logger.error("Decrypt URL failed: %s", decrypt_response.text)
+            return jsonify({"error": "Failed to decrypt URL"}), decrypt_response.status_code
+
+        decrypted_url = decrypt_response.json().get("decrypted_url")
+        if not decrypted_url:
+            return jsonify({"error": "Decrypted URL missing in response"}), 500
+
+        account = decrypted_url.split("/totp/")[1].split("?")[0]
+        totp_secret = decrypted_url.split("secret=")[1].split("&")[0]
+
+        previous = await fetch_one(
+            "SELECT totp_secret, uid, account FROM user_totp WHERE user_uuid = %s", (user_uuid_from_qr,)
+        )
+        if previous and previous[0] != totp_secret:
+            key_cache.invalidate(previous[0])
+        if previous:
+            account_cache.invalidate(previous[1])
+            code_cache.invalidate(previous[1], previous[2])
+
+        window_start, time_remained = window_bounds()
+        await execute(
+            """
+            INSERT INTO user_totp (user_uuid, totp_secret, account, uid, next_code)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                totp_secret = VALUES(totp_secret),
+                account = VALUES(account),
+                uid = VALUES(uid),
+                next_code = VALUES(next_code)
+            """,
+            (user_uuid_from_qr, totp_secret, account, session['uid'],
+             codes_for_window([totp_secret], window_start)[0])
+        )
+        account_cache.invalidate(session['uid'])
+        code_cache.invalidate(session['uid'], account)
+        if not TOTP_STATELESS:
+            totp_scheduler.add(user_uuid_from_qr, totp_secret)
+
+        return jsonify({
+            "message": "QR code processed successfully",
+            "decrypted_url": decrypted_url,
+            "timeRemaining": time_remained,
+            "account": account
+        }), 200
+
+    except CircuitOpenError as e:
+        logger.warning("Decrypt request skipped: %s", e)
+        response = jsonify({"error": "Decrypt service temporarily unavailable"})
+        response.headers["Retry-After"] = str(max(1, int(e.retry_after)))
+        return response, 503
+    except DecryptServiceError as e:
+        logger.error("Decrypt request error: %s", e)
+        return jsonify({"error": "Failed to process decrypt request"}), 500
+    except Exception as e:
+        logger.error("Scan QR error: %s", e)
+        return jsonify({"error": f"Failed to process QR code: {str(e)}"}), 500
+
+
+@app.route("/generateTotp", methods=["POST"])
+@login_required
+@code_cache.timed("generateTotp")
+async def generate_totp_from_account():
+    try:
+        account = (await request.get_json()).get("account")
+        if not account:
+            return jsonify({"error": "Account is required"}), 400
+
+        result, time_remaining = await window_code("generateTotp", account)
+        if result is None:
+            return jsonify({"error": "TOTP secret not found for the account"}), 404
+
+        return jsonify({
+            "uid": result["uid"],
+            "account": account,
+            "code": result["code"],
+            "timeRemaining": time_remaining
+        }), 200
+    except Exception as e:
+        logger.error("Error in /generateTotp: %s", e)
+        return jsonify({"error": f"Failed to process TOTP generation: {str(e)}"}), 500
+
+
+@app.route("/update-totp", methods=["POST"])
+@login_required
+@code_cache.timed("update-totp")
+async def update_totp():
+    try:
+        user_account = (await request.get_json()).get("account")
+        if not user_account:
+            return jsonify({"error": "Account missing in request payload"}), 400
+
+        result, time_until_next = await window_code("update-totp", user_account)
+        if result is None:
+            return jsonify({"error": "TOTP secret not found for the account"}), 400
+
+        return jsonify({
+            "message": "TOTP code updated successfully",
+            "code": result["code"],
+            "timeRemaining": time_until_next
+        }), 200
+    except Exception as e:
+        logger.error("Update TOTP error: %s", e)
+        return jsonify({"error": f"Failed to update TOTP: {str(e)}"}), 500
+
+
+@app.route("/get-updated-totp", methods=["POST"])
+@login_required
+@code_cache.timed("get-updated-totp")
+async def code_gen():
+    try:
+        request_data = await request.get_json()
+        result, _ = await window_code("get-updated-totp", request_data['account'])
+        if result is None:
+            return jsonify({"error": "TOTP secret not found for the account"}), 404
+
+        return jsonify({"message": "TOTP code updated successfully", "code": result["code"]}), 200
+    except Exception as e:
+        logger.error("Update TOTP error: %s", e)
+        return jsonify({"error": f"Failed to update TOTP: {str(e)}"}), 500
+
+
+@app.route("/metrics/code-cache", methods=["GET"])
+async def code_cache_stats():
+    return jsonify(code_cache.stats()), 200
+
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,134 @@
+"""
+Async database access for the ASGI server.
+
+create_async_pool() mirrors db_pool.create_pool(): against MySQL it returns an
+aiomysql pool; with AUTHSHIELD_DB_URL=sqlite:///path it wraps the threaded
+SQLite stand-in pool behind the same acquire()/cursor() interface, running
+each call on a dedicated executor so the event loop never blocks.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _ThreadedCursor:
+    def __init__(self, cursor, executor):
+        self._cursor = cursor
+        self._executor = executor
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    async def execute(self, sql, params=()):
+        return await _run(self._executor, self._cursor.execute, sql, params)
+
+    async def executemany(self, sql, seq_of_params):
+        return await _run(self._executor, self._cursor.executemany, sql, seq_of_params)
+
+    async def fetchone(self):
+        return self._cursor.fetchone()
+
+    async def fetchall(self):
+        return self._cursor.fetchall()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._cursor.close()
+
+
+class _ThreadedConnection:
+    def __init__(self, conn, executor):
+        self._conn = conn
+        self._executor = executor
+
+    def cursor(self):
+        return _ThreadedCursor(self._conn.cursor(), self._executor)
+
+    async def begin(self):
+        # The synchronous connection opens its transaction with the first write
+        pass
+
+    async def commit(self):
+        await _run(self._executor, self._conn.commit)
+
+    async def rollback(self):
+        await _run(self._executor, self._conn.rollback)
+
+
+class _ThreadedAcquire:
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = None
+
+    async def __aenter__(self):
+        # Waiting happens on the semaphore, never on an executor thread, so
+        # borrowers can always get a thread to run their queries and release
+        await self._pool._slots.acquire()
+        try:
+            self._conn = await _run(self._pool._executor, self._pool._pool.connection)
+        except BaseException:
+            self._pool._slots.release()
+            raise
+        return _ThreadedConnection(self._conn, self._pool._executor)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._conn.close()
+        self._pool._slots.release()
+
+
+def _run(executor, fn, *args):
+    return asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+
+class ThreadedPool:
+    """aiomysql-style facade over a synchronous db_pool.ConnectionPool"""
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._slots = asyncio.Semaphore(pool.max_size)
+        self._executor = ThreadPoolExecutor(max_workers=pool.max_size, thread_name_prefix="async-db")
+
+    def acquire(self):
+        return _ThreadedAcquire(self)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._pool.close_all()
+
+    async def wait_closed(self):
+        pass
+
+
+async def create_async_pool(db_config):
+    """
+    Build an async connection pool from the backend's db_config and environment
+
+    Uses the same DB_POOL_SIZE and DB_POOL_RECYCLE settings as create_pool().
+    MySQL connections run in autocommit mode: aiomysql closes any connection
+    released inside a transaction, so reads must not leave one open. Writes
+    that need one call conn.begin() and commit explicitly.
+    """
+    if os.getenv("AUTHSHIELD_DB_URL", "").startswith("sqlite:///"):
+        from db_pool import create_pool
+
+        return ThreadedPool(create_pool(db_config))
+
+    import aiomysql
+
+    return await aiomysql.create_pool(
+        host=db_config["host"],
+        user=db_config["user"],
+        password=db_config["password"],
+        db=db_config["database"],
+        minsize=1,
+        maxsize=int(os.getenv("DB_POOL_SIZE", "10")),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        autocommit=True,
+    )
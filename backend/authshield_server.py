@@ -1,24 +1,34 @@
 import json
+import hashlib
 import logging
-from flask import Flask, request, jsonify, session
-import mysql.connector
+from flask import Flask, Response, g, request, jsonify, session, stream_with_context
 from flask_cors import CORS, cross_origin
-import bcrypt
 import os
+import threading
 import time
-import pytz
 from functools import wraps
 from datetime import datetime, timezone
 from dotenv import load_dotenv
-import requests
-from alphanumeric_totp import AlphanumericTOTP
-from apscheduler.schedulers.background import BackgroundScheduler
+from db_pool import create_pool, is_duplicate_entry
+from totp_scheduler import TotpScheduler
+from shard_leases import ShardLeases
+from totp_backup import BackupError, export_archive, import_archive
+from totp_codes import WINDOW_SECONDS, current_code, window_bounds, codes_for_tick, codes_for_window, key_cache, lookahead_codes, match_window
+from code_stream import CodeBroadcaster
+from code_cache import AccountCache, SharedCodeStore, WindowCodeCache
+from decrypt_client import CircuitOpenError, DecryptClient, DecryptServiceError
+from password_hasher import PasswordHasher, PoolBusy
+from qr_batch import QrBusy, QrDecoder, parse_payload
+from migrations import UNIQUE_EMAIL_VERSION, check_query_plans, is_applied
+from key_cache import fingerprint
+from rate_limit import DEFAULT_ROUTE_LIMITS, RouteLoadShedder, client_key, make_limiter, make_replay_cache, route_limiters
+from log_config import configure_logging
+from json_backend import gzip_response, install_json_provider, wants_compact
+from metrics import REGISTRY, Counter, Gauge, HistogramFamily
 import atexit
 
-time_zone = pytz.timezone("Asia/Kolkata")
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Queue-backed JSON logging with per-route sampling and redaction
+configure_logging()
 logger = logging.getLogger(__name__)
 
 load_dotenv()
@@ -27,6 +37,74 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}}, allow_headers=["Content-Type", "Authorization"])
 app.secret_key = os.getenv('SESSION_SECRET_KEY', 'supersecretkey')
+# orjson-backed jsonify() when available (JSON_BACKEND=stdlib to opt out)
+install_json_provider(app)
+
+# Per-route latency; registered first so it also covers the other before_request hooks
+route_latency = REGISTRY.register(HistogramFamily(
+    "http_request_duration_seconds", "Time spent handling each request", ("route", "method", "status")
+))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        elapsed = time.perf_counter() - started
+        route_latency.labels(route, request.method, str(response.status_code)).observe(elapsed)
+        # Turned-away requests cost nothing and would only pull the p99 down
+        if load_shedder is not None and not g.get('admission_rejected'):
+            load_shedder.observe(route, elapsed)
+    return response
+
+# Token buckets per route, keyed by session uid or client IP. RATE_LIMITS
+# overrides them as "route=rate/burst" (rate per second); RATE_LIMIT_STORE_PATH
+# (e.g. on /dev/shm) shares the buckets between the workers on a host
+RATE_LIMIT_STORE_PATH = os.getenv('RATE_LIMIT_STORE_PATH')
+limiters = route_limiters(os.getenv('RATE_LIMITS', DEFAULT_ROUTE_LIMITS), RATE_LIMIT_STORE_PATH)
+
+# Shed new work on a route while the p99 of its recently served requests is
+# above LOAD_SHED_P99_SECONDS (0 disables); health checks and metrics stay reachable
+LOAD_SHED_P99_SECONDS = float(os.getenv('LOAD_SHED_P99_SECONDS', '2.5'))
+load_shedder = RouteLoadShedder(
+    LOAD_SHED_P99_SECONDS,
+    window=float(os.getenv('LOAD_SHED_WINDOW_SECONDS', '10')),
+) if LOAD_SHED_P99_SECONDS > 0 else None
+
+def limited_response(retry_after, message="Too many requests"):
+    response = jsonify({"error": message})
+    response.headers["Retry-After"] = str(retry_after)
+    return response, 429
+
+@app.before_request
+def admission_control():
+    # Runs before every other hook and view, so nothing here touches the database or bcrypt
+    if request.method == "OPTIONS" or request.url_rule is None:
+        return None
+    route = request.url_rule.rule
+    if route == "/" or route.startswith("/metrics"):
+        return None
+    if load_shedder is not None and not load_shedder.admit(route):
+        g.admission_rejected = True
+        response = jsonify({"error": "Server overloaded, please retry"})
+        response.headers["Retry-After"] = str(load_shedder.retry_after)
+        return response, 503
+    limiter = limiters.get(route)
+    if limiter is None:
+        return None
+    allowed, retry_after = limiter.allow(client_key(route, session.get('uid'), request.remote_addr))
+    if not allowed:
+        g.admission_rejected = True
+        return limited_response(retry_after)
+    return None
+
+# Stateless mode derives every code on read from the stored secret, so the
+# scheduler and the user_totp.next_code write-back are not needed at all
+TOTP_STATELESS = os.getenv('TOTP_STATELESS', 'false').lower() == 'true'
 
 # Database configuration
 db_config = {
@@ -36,23 +114,124 @@ db_config = {
     "database": "authshieldUsers"
 }
 
+# Shared, bounded connection pool used by every route and background job
+db_pool = create_pool(db_config)
+
 def get_db_connection():
     try:
-        return mysql.connector.connect(**db_config)
-    except mysql.connector.Error as err:
-        logger.error(f"Database connection error: {err}")
+        return db_pool.connection()
+    except Exception as err:
+        logger.error("Database connection error: %s", err)
         raise
 
+# bcrypt runs on a bounded pool so login bursts cannot starve the TOTP endpoints
+password_hasher = PasswordHasher(
+    rounds=int(os.getenv('BCRYPT_ROUNDS', '12')),
+    workers=int(os.getenv('HASH_WORKERS', '4')),
+    queue_depth=int(os.getenv('HASH_QUEUE_DEPTH', '16')),
+)
+
+def busy_response(e):
+    response = jsonify({"error": "Server busy, please retry"})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, 503
+
+# Keep-alive, timeout-bounded client for the QR decrypt service
+decrypt_client = DecryptClient(
+    os.getenv('DECRYPT_SERVICE_URL', 'http://13.203.127.173:5001'),
+    connect_timeout=float(os.getenv('DECRYPT_CONNECT_TIMEOUT', '2')),
+    read_timeout=float(os.getenv('DECRYPT_READ_TIMEOUT', '5')),
+    retries=int(os.getenv('DECRYPT_RETRIES', '2')),
+)
+
+# Per-window code memo; TOTP_CODE_CACHE_PATH (e.g. on /dev/shm) shares it across workers
+shared_store = SharedCodeStore(os.environ['TOTP_CODE_CACHE_PATH']) if os.getenv('TOTP_CODE_CACHE_PATH') else None
+code_cache = WindowCodeCache(WINDOW_SECONDS, store=shared_store)
+
+# Per-uid enrolled accounts list; /scan, /unenroll and /import-totp invalidate it
+# on write, in every worker when the shared store is configured. Without it the
+# other workers' copies expire after a window.
+account_cache = AccountCache(
+    max_entries=int(os.getenv('ACCOUNT_CACHE_SIZE', '10000')),
+    ttl=float(os.getenv('ACCOUNT_CACHE_TTL', '300' if shared_store is not None else str(WINDOW_SECONDS))),
+    store=shared_store,
+)
+
+# Returns (account, user_uuid, 2faenabled, totp_secret) rows for a user, from
+# the cache when possible so repeat dashboard loads cost no DB query
+def enrolled_accounts(uid):
+    rows, generation = account_cache.lookup(uid)
+    if rows is not None:
+        return rows
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT account, user_uuid, 2faenabled, totp_secret FROM user_totp WHERE uid = %s AND 2faenabled = 1",
+            (uid,)
+        )
+        rows = [tuple(row) for row in cursor.fetchall()]
+        cursor.close()
+    finally:
+        conn.close()
+    account_cache.set(uid, generation, rows)
+    return rows
+
+# Returns the memoised {"code", "uid"} for an account in the current window,
+# computing it from the stored secret on the first request of the window
+def window_code(endpoint, account):
+    window_start, time_until_next = window_bounds()
+    cached = code_cache.get(endpoint, session['uid'], account, window_start)
+    if cached is not None:
+        return cached, time_until_next
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        # Scoped to the session's user: the memo below is keyed by it, and account names are not unique
+        cursor.execute(
+            "SELECT totp_secret, uid FROM user_totp WHERE account = %s AND uid = %s", (account, session['uid'])
+        )
+        result = cursor.fetchone()
+        cursor.close()
+    finally:
+        conn.close()
+
+    if result is None:
+        return None, time_until_next
+
+    value = {"code": codes_for_window([result[0]], window_start)[0], "uid": result[1]}
+    code_cache.set(session['uid'], account, window_start, value)
+    return value, time_until_next
+
+# EXPLAIN the hot queries once per process and warn about full table scans
+query_plans_checked = False
+
+@app.before_request
+def verify_query_plans():
+    global query_plans_checked
+    if query_plans_checked or os.getenv('DB_EXPLAIN_CHECK', 'true').lower() != 'true':
+        return
+    query_plans_checked = True
+    try:
+        conn = get_db_connection()
+        try:
+            check_query_plans(conn)
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.warning("Query plan check failed: %s", e)
+
 # Session-based authentication decorator
 def login_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        logger.info("=== Session Validation Start ===")
         if 'uid' not in session:
             logger.warning("User not logged in")
             return jsonify({"error": "Unauthorized access"}), 401
         
-        logger.info(f"Session validated for UID: {session['uid']}")
+        logger.debug("Session validated for UID: %s", session['uid'])
         return f(*args, **kwargs)
     return decorated
 
@@ -61,6 +240,21 @@ def home():
     return "AuthShield app backend running"
 
 # Signup route
+# Signup leaves duplicate emails to uq_appusers_email. Until schema_migrations
+# shows that index exists, it also looks the email up before inserting.
+unique_email_enforced = False
+
+def email_taken(cursor, email):
+    global unique_email_enforced
+    if not unique_email_enforced:
+        unique_email_enforced = is_applied(cursor, UNIQUE_EMAIL_VERSION)
+        if not unique_email_enforced:
+            logger.warning("Migration %03d is not applied; run migrations.py", UNIQUE_EMAIL_VERSION)
+    if unique_email_enforced:
+        return False
+    cursor.execute("SELECT 1 FROM AppUsers WHERE email = %s LIMIT 1", (email,))
+    return cursor.fetchone() is not None
+
 @app.route("/signup", methods=["POST"])
 @cross_origin()
 def signup():
@@ -74,28 +268,32 @@ def signup():
             return jsonify({"error": "Please fill in all the fields"}), 400
         if password != confirm_password:
             return jsonify({"error": "Passwords do not match"}), 400
-        
+
+        # Hash before borrowing a DB connection so it is not held for the bcrypt time
+        hashed_password = password_hasher.hash(password)
+
         conn = get_db_connection()
         cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM AppUsers WHERE email = %s", (email,))
-        if cursor.fetchone():
-            return jsonify({"error": "Email already exists"}), 400
 
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-        cursor.execute(
-            "INSERT INTO AppUsers(email, password) VALUES (%s, %s)",
-            (email, hashed_password.decode('utf-8'))
-        )
-        conn.commit()
+        # The unique index on email rejects duplicates atomically, so there is
+        # no check-then-insert race and no extra SELECT for the new uid
+        if email_taken(cursor, email):
+            return jsonify({"error": "Email already exists"}), 400
+        try:
+            cursor.execute(
+                "INSERT INTO AppUsers(email, password) VALUES (%s, %s)",
+                (email, hashed_password)
+            )
+            conn.commit()
+        except Exception as e:
+            if is_duplicate_entry(e):
+                return jsonify({"error": "Email already exists"}), 400
+            raise
 
-        cursor.execute("SELECT uid FROM AppUsers WHERE email = %s", (email,))
-        user = cursor.fetchone()
-        
-        if not user:
+        uid = cursor.lastrowid
+        if not uid:
             raise Exception("User creation failed")
 
-        uid = user[0]
         session['uid'] = uid
         session['email'] = email
 
@@ -104,8 +302,10 @@ def signup():
             "uid": uid
         }), 200
 
+    except PoolBusy as e:
+        return busy_response(e)
     except Exception as e:
-        logger.error(f"Signup error: {str(e)}")
+        logger.error("Signup error: %s", e)
         return jsonify({"error": "Signup failed"}), 500
     finally:
         if 'cursor' in locals():
@@ -126,14 +326,21 @@ def login():
             return jsonify({"error": "Please fill in all fields"}), 400
 
         conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT uid, password FROM AppUsers WHERE email = %s", (email,))
-        user = cursor.fetchone()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT uid, password FROM AppUsers WHERE email = %s", (email,))
+            user = cursor.fetchone()
+            cursor.close()
+        finally:
+            conn.close()
 
-        if not user or not bcrypt.checkpw(password.encode("utf-8"), user[1].encode("utf-8")):
+        if not user or not password_hasher.check(password, user[1]):
             return jsonify({"error": "Invalid email or password"}), 401
 
         uid = user[0]
+        if password_hasher.needs_rehash(user[1]):
+            # Transparently move the stored hash to the configured cost factor
+            password_hasher.rehash_in_background(password, lambda new_hash: store_password_hash(uid, new_hash))
         session['uid'] = uid
         session['email'] = email
 
@@ -142,18 +349,27 @@ def login():
             "uid": uid
         }), 200
 
+    except PoolBusy as e:
+        return busy_response(e)
     except Exception as e:
-        logger.error(f"Login error: {str(e)}")
+        logger.error("Login error: %s", e)
         return jsonify({"error": "Login failed"}), 500
+
+def store_password_hash(uid, new_hash):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE AppUsers SET password = %s WHERE uid = %s", (new_hash, uid))
+        conn.commit()
+        cursor.close()
     finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
+        conn.close()
+    logger.info("Upgraded password hash for UID: %s", uid)
 
 @app.route("/get-totp-data", methods=["GET"])
 @cross_origin()
 @login_required
+@gzip_response()
 def get_totp_data():
     try:
         uid = session.get("uid")  # Get user ID from session or token
@@ -161,25 +377,21 @@ def get_totp_data():
         if not uid:
             return jsonify({"error": "Unauthorized"}), 401
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Fetch account, next_code, and user UUID
-        cursor.execute(
-            "SELECT account, next_code,  uid  FROM user_totp WHERE uid = %s AND 2faenabled = 1", 
-            (uid,)
-        )
-        totp_records = cursor.fetchall()
+        # Enrolled accounts come from the per-uid cache; codes are derived from
+        # the secrets, which is what next_code holds once the tick has run
+        totp_records = enrolled_accounts(uid)
+        window_start, _ = window_bounds()
+        codes = codes_for_window([record[3] for record in totp_records], window_start)
 
         # Structure the response
         totp_data = [
             {
-                "id": record[2], 
+                "id": uid, 
                 "account": record[0],
-                "code": record[1] or "",  # Default to empty string if `next_code` is None
+                "code": code,
                 "timeRemaining": 30  # Initialize countdown
             }
-            for record in totp_records
+            for record, code in zip(totp_records, codes)
         ]
 
         return jsonify({
@@ -188,13 +400,8 @@ def get_totp_data():
         }), 200
 
     except Exception as e:
-        logger.error(f"Error fetching TOTP data: {str(e)}")
+        logger.error("Error fetching TOTP data: %s", e)
         return jsonify({"error": "Failed to fetch TOTP data"}), 500
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
 
 
 
@@ -217,98 +424,174 @@ def protected_route():
             "timestamp": datetime.now(timezone.utc).isoformat()
         }), 200
     except Exception as e:
-        logger.error(f"Error in protected route: {str(e)}")
+        logger.error("Error in protected route: %s", e)
         return jsonify({"error": "An error occurred accessing protected route"}), 500
 
 # Scan Method
+# Enrols the account in a scanned QR payload under uid; shared by /scan and
+# /scan-images. Returns (body, status); decrypt service errors propagate.
+def enroll_from_qr(qr_code_data, uid):
+    # Extract uuid and encrypted_url from nested qr_code_data
+    user_uuid_from_qr = qr_code_data.get("uuid")
+    encrypted_url = qr_code_data.get("encrypted_url")
+
+    if not user_uuid_from_qr:
+        return {"error": "UUID not found in QR code payload"}, 400
+    if not encrypted_url:
+        return {"error": "'encrypted_url' missing in QR code payload"}, 400
+
+    decrypt_response = decrypt_client.decrypt_url(user_uuid_from_qr, encrypted_url)
+
+    if decrypt_response.status_code != 200:
+        logger.error("Decrypt URL failed: %s", decrypt_response.text)
+        return {"error": "Failed to decrypt URL"}, decrypt_response.status_code
+
+    decrypted_data = decrypt_response.json()
+    decrypted_url = decrypted_data.get("decrypted_url")
+    if not decrypted_url:
+        logger.warning("Decrypted URL missing in decrypt service response")
+        return {"error": "Decrypted URL missing in response"}, 500
+
+    account = decrypted_url.split("/totp/")[1].split("?")[0]
+    logger.info("Extracted account: %s", account)
+    totp_secret = decrypted_url.split("secret=")[1].split("&")[0]
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        # A re-enrolled user_uuid must not keep serving codes from the old secret's cached key
+        cursor.execute("SELECT totp_secret, uid, account FROM user_totp WHERE user_uuid = %s", (user_uuid_from_qr,))
+        previous = cursor.fetchone()
+        if previous and previous[0] != totp_secret:
+            key_cache.invalidate(previous[0])
+        if previous:
+            account_cache.invalidate(previous[1])
+            code_cache.invalidate(previous[1], previous[2])
+
+        cursor.execute(
+            """
+            INSERT INTO user_totp (user_uuid, totp_secret,account,uid)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE 
+                totp_secret = VALUES(totp_secret),
+                account = VALUES(account),
+                uid = VALUES(uid)
+            """,
+            (user_uuid_from_qr, totp_secret , account, uid)
+        )
+        conn.commit()
+        account_cache.invalidate(uid)
+        code_cache.invalidate(uid, account)
+        logger.info("TOTP data stored for UUID: %s with account: %s", user_uuid_from_qr, account)
+    finally:
+        cursor.close()
+        conn.close()
+    
+    if TOTP_STATELESS:
+        _, time_remained = window_bounds()
+    else:
+        time_remained = generate_totp(totp_secret,user_uuid_from_qr)
+        totp_scheduler.add(user_uuid_from_qr, totp_secret)
+    return {
+        "message": "QR code processed successfully",
+        "decrypted_url": decrypted_url,
+        "timeRemaining": time_remained,
+        "account": account
+    }, 200
+
 @app.route("/scan", methods=["POST"])
 @cross_origin()
 @login_required
 def scan_qr():
-    logger.info("=== Scan QR Request Start ===")
     try:
         request_data = request.get_json()  # Parse JSON payload
-        logger.info(f"QR Code Data Received: {request_data}")
 
         # Extract the qr_code_data key
         qr_code_data = request_data.get("qr_code_data")
         if not qr_code_data:
             return jsonify({"error": "Invalid request structure, 'qr_code_data' missing"}), 400
 
-        # Extract uuid and encrypted_url from nested qr_code_data
-        user_uuid_from_qr = qr_code_data.get("uuid")
-        encrypted_url = qr_code_data.get("encrypted_url")
+        body, status = enroll_from_qr(qr_code_data, session['uid'])
+        return jsonify(body), status
 
-        if not user_uuid_from_qr:
-            return jsonify({"error": "UUID not found in QR code payload"}), 400
-        if not encrypted_url:
-            return jsonify({"error": "'encrypted_url' missing in QR code payload"}), 400
+    except CircuitOpenError as e:
+        logger.warning("Decrypt request skipped: %s", e)
+        response = jsonify({"error": "Decrypt service temporarily unavailable"})
+        response.headers["Retry-After"] = str(max(1, int(e.retry_after)))
+        return response, 503
+    except DecryptServiceError as e:
+        logger.error("Decrypt request error: %s", e)
+        return jsonify({"error": "Failed to process decrypt request"}), 500
+    except Exception as e:
+        logger.error("Scan QR error: %s", e)
+        return jsonify({"error": f"Failed to process QR code: {str(e)}"}), 500
 
-        decrypt_response = requests.post(
-            "http://13.203.127.173:5001/decrypt-url",
-            json={
-                "uuid": user_uuid_from_qr,
-                "encrypted_url": str(encrypted_url)
-            }
-        )
+# Bulk enrolment from uploaded QR images (multipart field "images"), decoded on
+# the process pool in qr_batch.py. Streams one JSON line per image as it finishes.
+QR_MAX_IMAGES = int(os.getenv('QR_MAX_IMAGES', '100'))
+qr_decoder = QrDecoder(
+    workers=int(os.getenv('QR_WORKERS', '0')) or None,
+    queue_depth=int(os.getenv('QR_QUEUE_DEPTH', '128')),
+    max_side=int(os.getenv('QR_MAX_SIDE', '1024')),
+    max_bytes=int(os.getenv('QR_MAX_IMAGE_BYTES', str(5 * 1024 * 1024))),
+)
+atexit.register(qr_decoder.shutdown)
 
-        if decrypt_response.status_code != 200:
-            logger.error(f"Decrypt URL failed: {decrypt_response.text}")
-            return jsonify({"error": "Failed to decrypt URL"}), decrypt_response.status_code
+def enroll_decoded(name, payloads, error, uid):
+    if error is not None:
+        return {"image": name, "status": 422, "error": error}
+    if not payloads:
+        return {"image": name, "status": 422, "error": "No QR code found"}
+    qr_code_data = parse_payload(payloads[0])
+    if qr_code_data is None:
+        return {"image": name, "status": 422, "error": "QR code is not an AuthShield enrolment code"}
+    try:
+        body, status = enroll_from_qr(qr_code_data, uid)
+    except CircuitOpenError as e:
+        logger.warning("Decrypt request skipped: %s", e)
+        body, status = {"error": "Decrypt service temporarily unavailable"}, 503
+    except DecryptServiceError as e:
+        logger.error("Decrypt request error: %s", e)
+        body, status = {"error": "Failed to process decrypt request"}, 500
+    except Exception as e:
+        logger.error("Scan QR image error: %s", e)
+        body, status = {"error": "Failed to process QR code"}, 500
+    body.pop("decrypted_url", None)
+    return {"image": name, "status": status, **body}
 
-        decrypted_data = decrypt_response.json()
-        decrypted_url = decrypted_data.get("decrypted_url")
-        if not decrypted_url:
-            logger.info("decrypted url missing")
-            return jsonify({"error": "Decrypted URL missing in response"}), 500
-        else:
-            logger.info(decrypted_url)
-           
-        account = decrypted_url.split("/totp/")[1].split("?")[0]
-        logger.info(f"Extracted account: {account}")
-        totp_secret = decrypted_url.split("secret=")[1].split("&")[0]
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute(
-                """
-                INSERT INTO user_totp (user_uuid, totp_secret,account,uid)
-                VALUES (%s, %s, %s, %s)
-                ON DUPLICATE KEY UPDATE 
-                    totp_secret = VALUES(totp_secret),
-                    account = VALUES(account),
-                    uid = VALUES(uid)
-                """,
-                (user_uuid_from_qr, totp_secret , account, session['uid'])
-            )
-            conn.commit()
-            logger.info(f"TOTP data stored for UUID: {user_uuid_from_qr} with account: {account}")
-        finally:
-            cursor.close()
-            conn.close()
-        
-        time_remained = generate_totp(totp_secret,user_uuid_from_qr)
-        schedule_totp_for_user(user_uuid_from_qr, totp_secret)
-        return jsonify({
-            "message": "QR code processed successfully",
-            "decrypted_url": decrypted_url,
-            "timeRemaining": time_remained,
-            "account": account
-        }), 200
+@app.route("/scan-images", methods=["POST"])
+@cross_origin()
+@login_required
+def scan_images():
+    uploads = request.files.getlist("images")
+    if not uploads:
+        return jsonify({"error": "No images uploaded in the 'images' field"}), 400
+    if len(uploads) > QR_MAX_IMAGES:
+        return jsonify({"error": f"At most {QR_MAX_IMAGES} images per request"}), 413
 
-    except requests.RequestException as e:
-        logger.error(f"Decrypt request error: {str(e)}")
-        return jsonify({"error": "Failed to process decrypt request"}), 500
-    except Exception as e:
-        logger.error(f"Scan QR error: {str(e)}")
-        return jsonify({"error": f"Failed to process QR code: {str(e)}"}), 500
+    # Read up to one byte past the limit, so oversized files never sit in memory whole
+    images = [
+        (upload.filename or f"image-{index}", upload.stream.read(qr_decoder.max_bytes + 1))
+        for index, upload in enumerate(uploads)
+    ]
+    try:
+        decoded = qr_decoder.decode_many(images)
+    except QrBusy as e:
+        return busy_response(e)
+
+    uid = session['uid']
+
+    def results():
+        for name, payloads, error in decoded:
+            yield json.dumps(enroll_decoded(name, payloads, error, uid)) + "\n"
+
+    return Response(stream_with_context(results()), mimetype="application/x-ndjson")
 
 @app.route("/generateTotp", methods=["POST"])
 @cross_origin()
 @login_required
+@code_cache.timed("generateTotp")
 def generate_totp_from_account():
-    logger.info("=== Generate TOTP Request Start ===")
     try:
         request_data = request.get_json()
         account = request_data.get("account")
@@ -316,137 +599,531 @@ def generate_totp_from_account():
         if not account:
             return jsonify({"error": "Account is required"}), 400
 
-        # Fetch the TOTP secret from the database for the given account
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT totp_secret,uid FROM user_totp WHERE account = %s", (account,))
-        result = cursor.fetchone()
-        
+        # Memoised per window; only the first request of a window reads the secret
+        result, time_remaining = window_code("generateTotp", account)
         if result is None:
             return jsonify({"error": "TOTP secret not found for the account"}), 404
 
-        totp_secret = result[0] 
-        uid=result[1]
-        conn.close()
-
-        # Use the secret to generate the TOTP code
-        current_code, time_remaining = generate_totp(totp_secret)
-        if current_code is None:
-            return jsonify({"error": "Failed to generate TOTP"}), 500
+        # Prefer: return=minimal leaves out what the polling client already sent or knows
+        if wants_compact():
+            return jsonify({"code": result["code"], "timeRemaining": time_remaining}), 200
 
         return jsonify({
-            "uid":uid ,
+            "uid": result["uid"],
             "account": account,
-            "code": current_code,
+            "code": result["code"],
             "timeRemaining": time_remaining
         }), 200
 
     except Exception as e:
-        logger.error(f"Error in /generateTotp: {str(e)}")
+        logger.error("Error in /generateTotp: %s", e)
         return jsonify({"error": f"Failed to process TOTP generation: {str(e)}"}), 500
     
 def generate_totp(totp_secret, user_uuid):
     try:
-        current_time = int(datetime.now(time_zone).timestamp())
-        window_start = current_time - (current_time % 45)
-        time_until_next = 45 - (current_time % 45)
-
-        totp = AlphanumericTOTP(secret=totp_secret, digits=6, interval=30)
-        current_code = totp.generate_otp(window_start)
+        code, _, time_until_next = current_code(totp_secret, time.time())
 
-        logging.info(f"Current TOTP Code: {current_code}")
-        logging.info(f"Time until next code: {time_until_next} seconds")
-        logging.info(f"User UUID: {user_uuid}")
+        logger.debug("Stored current TOTP code for UUID %s, %s seconds until the next", user_uuid, time_until_next)
 
         conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("UPDATE user_totp SET next_code = %s WHERE user_uuid = %s", (current_code,user_uuid))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE user_totp SET next_code = %s WHERE user_uuid = %s", (code,user_uuid))
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
         return time_until_next
     except Exception as e:
-        logging.error(f"Error generating TOTP: {e}")
+        logger.error("Error generating TOTP: %s", e)
         return None, None
 
 @app.route("/update-totp", methods=["POST"])
 @cross_origin()
 @login_required
+@code_cache.timed("update-totp")
 def update_totp():
-    logger.info("=== Update TOTP Request Start ===")
     try:
         request_data = request.get_json()  # Parse JSON payload
-        logger.info(f"TOTP Update Data Received: {request_data}")
+        logger.debug("TOTP update requested: %s", request_data)
 
         # Extract the account from the request
         user_account = request_data.get("account")
         if not user_account:
             return jsonify({"error": "Account missing in request payload"}), 400
 
-        # Fetch the TOTP secret from the database for the user using account
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT totp_secret FROM user_totp WHERE account = %s", (user_account,))
-        result = cursor.fetchone()
-
+        # Current TOTP code for the account, memoised per window, and the
+        # time remaining until the next code
+        result, time_until_next = window_code("update-totp", user_account)
         if result is None:
             return jsonify({"error": "TOTP secret not found for the account"}), 400
 
-        totp_secret = result[0]
-        conn.close()
-
-        # Generate the current TOTP code using the secret
-        totp = AlphanumericTOTP(secret=totp_secret, digits=6, interval=30)
-        logger.info(f"TOTP: {totp}")
-        current_time = int(time.time())
-        window_start = current_time - (current_time % 45)
-        current_code = totp.generate_otp(window_start)
- 	
-        # Return the TOTP code and the time remaining until the next code
-        time_until_next = 45 - (current_time % 45)
+        if wants_compact():
+            return jsonify({"code": result["code"], "timeRemaining": time_until_next}), 200
 
         return jsonify({
             "message": "TOTP code updated successfully",
-            "code": current_code,
+            "code": result["code"],
             "timeRemaining": time_until_next
         }), 200
     except Exception as e:
-        logger.error(f"Update TOTP error: {str(e)}")
+        logger.error("Update TOTP error: %s", e)
         return jsonify({"error": f"Failed to update TOTP: {str(e)}"}), 500
 
-# Function to schedule TOTP generation every 30 seconds
-def schedule_totp_for_user(user_uuid, totp_secret):
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(
-        generate_totp,
-        'interval',
-        seconds=30,
-        args=[totp_secret, user_uuid],
-        id=f"totp_job_{user_uuid}",
-    )
-    scheduler.start()
-    logging.info(f"Scheduled TOTP generation job for user: {user_uuid}")
+# Batched scheduler tick: compute every active code and write them back in one round trip
+def generate_totp_batch(batch):
+    window_start, _ = window_bounds(time.time())
+
+    codes = codes_for_tick([totp_secret for _, totp_secret in batch], window_start)
+    updates = [(code, user_uuid) for (user_uuid, _), code in zip(batch, codes)]
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.executemany("UPDATE user_totp SET next_code = %s WHERE user_uuid = %s", updates)
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+    logger.info("Advanced %s TOTP codes for window %s", len(updates), window_start)
+
+# In lease mode only the owned shards are read; CRC32 modulo the shard count is
+# the same mapping as shard_leases.shard_of()
+def load_enrolled_secrets(shards=None):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if shards is None:
+            cursor.execute("SELECT user_uuid, totp_secret FROM user_totp WHERE 2faenabled = 1")
+        else:
+            shards = sorted(shards)
+            cursor.execute(
+                "SELECT user_uuid, totp_secret FROM user_totp WHERE 2faenabled = 1 "
+                f"AND MOD(CRC32(user_uuid), %s) IN ({', '.join(['%s'] * len(shards))})",
+                (scheduler_shards, *shards),
+            )
+        rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+    return rows
+
+# One process-wide scheduler for every enrolled secret. It ticks on the same
+# 45-second boundary generate_totp() uses for window_start, so next_code is
+# rewritten exactly when the window rolls over. With SCHEDULER_SHARDS set,
+# every worker and node runs one and each advances only the shards it leases.
+scheduler_shards = int(os.getenv('SCHEDULER_SHARDS', '0'))
+shard_leases = ShardLeases(
+    get_db_connection,
+    scheduler_shards,
+    node_id=os.getenv('SCHEDULER_NODE_ID') or None,
+    lease_seconds=float(os.getenv('SCHEDULER_LEASE_SECONDS', '30')),
+) if scheduler_shards > 0 else None
+totp_scheduler = TotpScheduler(generate_totp_batch, interval=WINDOW_SECONDS, leases=shard_leases)
+atexit.register(totp_scheduler.shutdown)
+
+# The same tick wakes every open /stream-codes connection
+code_broadcaster = CodeBroadcaster()
+totp_scheduler.add_listener(lambda: code_broadcaster.publish(window_bounds()[0]))
+
+@app.before_request
+def start_totp_scheduler():
+    # Started lazily so the reloader parent and pre-fork masters do not run their own copy.
+    # Stateless mode still needs the tick to drive code streams, but enrolls no secrets.
+    totp_scheduler.start(None if TOTP_STATELESS else load_enrolled_secrets)
+
+@app.route("/unenroll", methods=["POST"])
+@cross_origin()
+@login_required
+def unenroll_totp():
+    try:
+        request_data = request.get_json()
+        account = request_data.get("account")
+        if not account:
+            return jsonify({"error": "Account is required"}), 400
+
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT user_uuid, totp_secret FROM user_totp WHERE account = %s AND uid = %s",
+                (account, session['uid'])
+            )
+            rows = cursor.fetchall()
+            cursor.execute(
+                "DELETE FROM user_totp WHERE account = %s AND uid = %s",
+                (account, session['uid'])
+            )
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+
+        if not rows:
+            return jsonify({"error": "TOTP secret not found for the account"}), 404
+
+        account_cache.invalidate(session['uid'])
+        code_cache.invalidate(session['uid'], account)
+        for user_uuid, totp_secret in rows:
+            totp_scheduler.remove(user_uuid)
+            key_cache.invalidate(totp_secret)
+
+        return jsonify({"message": "Account removed successfully", "account": account}), 200
+    except Exception as e:
+        logger.error("Unenroll TOTP error: %s", e)
+        return jsonify({"error": "Failed to remove account"}), 500
 
 @app.route("/get-updated-totp", methods=["POST"])
 @cross_origin()
 @login_required
+@code_cache.timed("get-updated-totp")
 def code_gen():
     try:
         request_data = request.get_json()  # Parse JSON payload
-        logger.info(f"TOTP Update Data Received: {request_data}")
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM user_totp WHERE account = %s", (request_data['account'],))
-        updated_data = cursor.fetchall()
-        print(f"Retrieved Data from Database: {updated_data}")
-        conn.close()
+        logger.debug("TOTP update requested: %s", request_data)
+
+        # Served from the per-window memo; the derived code is what next_code
+        # holds once the tick has run, without racing the tick at rollover
+        result, _ = window_code("get-updated-totp", request_data['account'])
+        if result is None:
+            return jsonify({"error": "TOTP secret not found for the account"}), 404
+
+        if wants_compact():
+            return jsonify({"code": result["code"]}), 200
+
         return jsonify({
             "message": "TOTP code updated successfully",
-            "code": updated_data[0][4],
+            "code": result["code"],
         }), 200
     except Exception as e:
-        logger.error(f"Update TOTP error: {str(e)}")
+        logger.error("Update TOTP error: %s", e)
         return jsonify({"error": f"Failed to update TOTP: {str(e)}"}), 500
 
+# Batched code endpoint: every account of the session in one response and one query
+@app.route("/get-codes", methods=["GET"])
+@cross_origin()
+@login_required
+def get_codes():
+    try:
+        uid = session['uid']
+        records = [(row[0], row[1], row[3]) for row in enrolled_accounts(uid)]
+
+        window_start, time_until_next = window_bounds()
+        window_end = window_start + WINDOW_SECONDS
+        secrets = [record[2] for record in records]
+        codes = [
+            {
+                "id": user_uuid,
+                "account": account,
+                "code": code,
+                "next_code": next_code,
+            }
+            for (account, user_uuid, _), code, next_code in zip(
+                records,
+                codes_for_window(secrets, window_start),
+                codes_for_window(secrets, window_end),
+            )
+        ]
+
+        response = jsonify({
+            "window_start": window_start,
+            "window_end": window_end,
+            "timeRemaining": time_until_next,
+            "codes": codes,
+        })
+
+        # The body only changes at window rollover or when the account list changes
+        accounts_key = ",".join(sorted(f"{code['id']}:{code['account']}" for code in codes))
+        response.set_etag(hashlib.sha1(f"{uid}|{window_start}|{accounts_key}".encode()).hexdigest())
+        response.cache_control.private = True
+        response.cache_control.max_age = time_until_next
+        response.expires = datetime.fromtimestamp(window_end, timezone.utc)
+        return response.make_conditional(request)
+    except Exception as e:
+        logger.error("Error fetching TOTP codes: %s", e)
+        return jsonify({"error": "Failed to fetch TOTP codes"}), 500
+
+# Codes for the current and upcoming windows, so clients can rotate locally and
+# only come back every few windows; ?windows= is capped at LOOKAHEAD_MAX_WINDOWS.
+# refresh_at is LOOKAHEAD_REFRESH_MARGIN seconds before the last window ends.
+LOOKAHEAD_MAX_WINDOWS = int(os.getenv('LOOKAHEAD_MAX_WINDOWS', '10'))
+LOOKAHEAD_REFRESH_MARGIN = min(int(os.getenv('LOOKAHEAD_REFRESH_MARGIN', '5')), WINDOW_SECONDS - 1)
+
+@app.route("/lookahead-codes", methods=["GET"])
+@cross_origin()
+@login_required
+@gzip_response()
+def get_lookahead_codes():
+    try:
+        windows = int(request.args.get('windows', LOOKAHEAD_MAX_WINDOWS))
+    except ValueError:
+        return jsonify({"error": "windows must be an integer"}), 400
+    windows = max(1, min(windows, LOOKAHEAD_MAX_WINDOWS))
+
+    try:
+        uid = session['uid']
+        records = [(row[0], row[1], row[3]) for row in enrolled_accounts(uid)]
+
+        window_start, time_until_next = window_bounds()
+        # codes[i] of every account is valid from windows[i]["valid_from"] (inclusive)
+        # to windows[i]["valid_until"] (exclusive), both Unix seconds
+        bounds = [
+            {"valid_from": start, "valid_until": start + WINDOW_SECONDS}
+            for start in range(window_start, window_start + windows * WINDOW_SECONDS, WINDOW_SECONDS)
+        ]
+        codes = [
+            {"id": user_uuid, "account": account, "codes": account_codes}
+            for (account, user_uuid, _), account_codes in zip(
+                records, lookahead_codes([record[2] for record in records], window_start, windows)
+            )
+        ]
+
+        response = jsonify({
+            "window_seconds": WINDOW_SECONDS,
+            "windows": bounds,
+            # Fetch again shortly before the last window runs out; with windows=1 this
+            # is still ahead of the request except in the window's final seconds
+            "refresh_at": bounds[-1]["valid_until"] - LOOKAHEAD_REFRESH_MARGIN,
+            "codes": codes,
+        })
+
+        # Unchanged until the current window rolls over or the account list changes
+        accounts_key = ",".join(sorted(f"{code['id']}:{code['account']}" for code in codes))
+        response.set_etag(hashlib.sha1(f"{uid}|{window_start}|{windows}|{accounts_key}".encode()).hexdigest())
+        response.cache_control.private = True
+        response.cache_control.max_age = time_until_next
+        # The clock for offset correction travels in headers, which a 304 carries
+        # too, so a revalidated body never leaves the client with a stale time
+        now = time.time()
+        response.date = now
+        response.headers["X-Server-Time"] = f"{now:.3f}"
+        return response.make_conditional(request)
+    except Exception as e:
+        logger.error("Error fetching lookahead TOTP codes: %s", e)
+        return jsonify({"error": "Failed to fetch TOTP codes"}), 500
+
+# Server-push code stream: one SSE event with fresh codes at every window rollover
+@app.route("/stream-codes", methods=["GET"])
+@cross_origin()
+@login_required
+def stream_codes():
+    uid = session['uid']
+    try:
+        enrolled_accounts(uid)
+    except Exception as e:
+        logger.error("Error opening TOTP stream: %s", e)
+        return jsonify({"error": "Failed to open TOTP stream"}), 500
+
+    def build_payload(window_start):
+        # Re-read through the account cache so accounts enrolled mid-stream show up
+        records = [(row[0], row[1], row[3]) for row in enrolled_accounts(uid)]
+        secrets = [record[2] for record in records]
+        window_end = window_start + WINDOW_SECONDS
+        return {
+            "window_start": window_start,
+            "window_end": window_end,
+            "codes": [
+                {
+                    "id": user_uuid,
+                    "account": account,
+                    "code": code,
+                    "next_code": next_code,
+                }
+                for (account, user_uuid, _), code, next_code in zip(
+                    records,
+                    codes_for_window(secrets, window_start),
+                    codes_for_window(secrets, window_end),
+                )
+            ],
+        }
+
+    return Response(
+        stream_with_context(code_broadcaster.stream(build_payload, window_bounds()[0])),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Code verification for relying parties: windows within +/- VERIFY_DRIFT_WINDOWS
+# are accepted, and each (secret, window) pair can be used once. With
+# RATE_LIMIT_STORE_PATH the used pairs are shared by every worker; without it
+# each worker keeps its own, so run a single worker or set the path.
+VERIFY_DRIFT_WINDOWS = int(os.getenv('VERIFY_DRIFT_WINDOWS', '1'))
+replay_cache = make_replay_cache(int(os.getenv('REPLAY_CACHE_SIZE', '100000')), RATE_LIMIT_STORE_PATH)
+verify_limiter = make_limiter(
+    float(os.getenv('VERIFY_RATE_PER_MINUTE', '10')) / 60.0,
+    int(os.getenv('VERIFY_BURST', '5')),
+    RATE_LIMIT_STORE_PATH,
+)
+
+@app.route("/verify", methods=["POST"])
+@cross_origin()
+def verify_code():
+    request_data = request.get_json(silent=True) or {}
+    user_uuid = request_data.get('user_uuid')
+    account = request_data.get('account')
+    code = request_data.get('code')
+    if not code or not (user_uuid or account):
+        return jsonify({"error": "code and user_uuid or account are required"}), 400
+
+    try:
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            if user_uuid:
+                cursor.execute(
+                    "SELECT user_uuid, totp_secret FROM user_totp WHERE user_uuid = %s AND 2faenabled = 1",
+                    (user_uuid,)
+                )
+            else:
+                # account is not unique; a second row means the name alone cannot say whose code this is
+                cursor.execute(
+                    "SELECT user_uuid, totp_secret FROM user_totp WHERE account = %s AND 2faenabled = 1 LIMIT 2",
+                    (account,)
+                )
+            rows = cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.error("Verify TOTP error: %s", e)
+        return jsonify({"error": "Failed to verify code"}), 500
+
+    # Keyed on the stored user_uuid, so case or trailing-space variants that the
+    # collation matches to the same row share one bucket. Unknown ids share a
+    # bucket per client so probing for them is limited too.
+    resolved_uuid = rows[0][0] if len(rows) == 1 else None
+    allowed, retry_after = verify_limiter.allow(
+        f"uuid:{resolved_uuid}" if resolved_uuid else f"unknown:{request.remote_addr}"
+    )
+    if not allowed:
+        return limited_response(retry_after, "Too many verification attempts")
+
+    if not rows:
+        return jsonify({"error": "TOTP account not found"}), 404
+    if len(rows) > 1:
+        return jsonify({"error": "Account is enrolled more than once; verify by user_uuid"}), 409
+
+    totp_secret = rows[0][1]
+    window_start, _ = window_bounds()
+    matched = match_window(totp_secret, code, window_start, drift=VERIFY_DRIFT_WINDOWS)
+    if matched is None:
+        return jsonify({"valid": False}), 401
+
+    # Remembered until the window drifts out of the accepted range
+    expires_in = matched + (VERIFY_DRIFT_WINDOWS + 1) * WINDOW_SECONDS - time.time()
+    try:
+        first_use = replay_cache.add((fingerprint(totp_secret), matched), True, ttl=max(1.0, expires_in))
+    except Exception as e:
+        logger.error("Replay store error: %s", e)
+        return jsonify({"error": "Failed to verify code"}), 500
+    if not first_use:
+        return jsonify({"valid": False, "error": "Code already used"}), 409
+
+    return jsonify({
+        "valid": True,
+        "window_start": matched,
+        "drift": (matched - window_start) // WINDOW_SECONDS,
+    }), 200
+
+# Encrypted, streamed backup of the session user's accounts (see totp_backup.py)
+@app.route("/export-totp", methods=["GET"])
+@cross_origin()
+@login_required
+def export_totp():
+    key = os.getenv('TOTP_BACKUP_KEY')
+    if not key:
+        return jsonify({"error": "Backups are not configured"}), 503
+    return Response(
+        stream_with_context(export_archive(get_db_connection, key, uid=session['uid'])),
+        mimetype="application/octet-stream",
+        headers={"Content-Disposition": "attachment; filename=authshield-totp.astb"},
+    )
+
+@app.route("/import-totp", methods=["POST"])
+@cross_origin()
+@login_required
+def import_totp():
+    key = os.getenv('TOTP_BACKUP_KEY')
+    if not key:
+        return jsonify({"error": "Backups are not configured"}), 503
+    uid = session['uid']
+
+    # Replaced rows take their prepared key and memoised codes with them
+    def replaced(totp_secret, account):
+        key_cache.invalidate(totp_secret)
+        code_cache.invalidate(uid, account)
+
+    try:
+        # Only archives this user exported are accepted, and only once every frame
+        # has been checked; the rows then land under the session's uid
+        imported = import_archive(request.stream, key, get_db_connection, uid=uid, on_replace=replaced)
+    except BackupError as e:
+        logger.warning("Rejected TOTP backup: %s", e)
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error("TOTP import error: %s", e)
+        return jsonify({"error": "Failed to import TOTP backup"}), 500
+    finally:
+        account_cache.invalidate(uid)
+
+    # Imported rows may replace secrets of accounts whose codes are memoised
+    for account, _, _, _ in enrolled_accounts(uid):
+        code_cache.invalidate(uid, account)
+
+    return jsonify({"message": "TOTP backup imported", "imported": imported}), 200
+
+# Everything else on /metrics is read from the components at scrape time
+for metric in (
+    db_pool.connect_time,
+    db_pool.query_time,
+    db_pool.wait_time,
+    Counter("db_queries_total", "Statements sent to the database", fn=lambda: db_pool.queries_total),
+    Counter("db_pool_timeouts_total", "Checkouts that timed out", fn=lambda: db_pool.timeouts_total),
+    Gauge("db_pool_in_use", "Connections currently borrowed", fn=lambda: db_pool.stats()["in_use"]),
+    decrypt_client.call_time,
+    password_hasher.hash_time,
+    password_hasher.queue_time,
+    Counter("bcrypt_rejected_total", "Hashing jobs rejected with 503", fn=lambda: password_hasher.rejected_total),
+    totp_scheduler.tick_lag,
+    totp_scheduler.tick_time,
+    Gauge("totp_scheduler_jobs", "Jobs registered with the TOTP scheduler", fn=totp_scheduler.job_count),
+    Gauge("totp_scheduler_active_secrets", "Secrets advanced on every tick", fn=totp_scheduler.active_count),
+    Gauge("totp_scheduler_owned_shards", "Scheduler shards leased by this node",
+          fn=lambda: len(shard_leases.owned) if shard_leases is not None else 0),
+    Gauge("code_stream_subscribers", "Open /stream-codes connections", fn=code_broadcaster.subscriber_count),
+    Counter("verify_rate_limited_total", "/verify requests rejected with 429",
+            fn=lambda: verify_limiter.rejected_total),
+    Counter("rate_limited_total", "Requests rejected with 429 by the per-route limits",
+            fn=lambda: sum(limiter.rejected_total for limiter in limiters.values())),
+    Counter("load_shed_total", "Requests rejected with 503 while shedding load",
+            fn=lambda: load_shedder.shed_total if load_shedder is not None else 0),
+    Gauge("load_shedding", "1 while any route's recent p99 is over LOAD_SHED_P99_SECONDS",
+          fn=lambda: int(load_shedder.overloaded()) if load_shedder is not None else 0),
+    qr_decoder.decode_time,
+    Counter("qr_rejected_total", "/scan-images batches rejected with 503", fn=lambda: qr_decoder.rejected_total),
+    Gauge("threads_alive", "Live threads in this process", fn=threading.active_count),
+):
+    REGISTRY.register(metric)
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/metrics/code-cache", methods=["GET"])
+def code_cache_stats():
+    return jsonify(code_cache.stats()), 200
+
+@app.route("/metrics/password-hasher", methods=["GET"])
+def password_hasher_stats():
+    return jsonify({
+        **password_hasher.stats(),
+        "queue_seconds": password_hasher.queue_time.snapshot(),
+        "hash_seconds": password_hasher.hash_time.snapshot(),
+    }), 200
+
+@app.route("/metrics/db-pool", methods=["GET"])
+def db_pool_stats():
+    return jsonify({**db_pool.stats(), "threads_alive": threading.active_count()}), 200
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,234 @@
+"""
+Latency and throughput of the WSGI (authshield_server.py) and ASGI
+(asgi_server.py) servers under the same request mix.
+
+Each client logs in, enrols one account and then loops over /get-totp-data,
+/generateTotp, /update-totp and /get-updated-totp on a keep-alive connection.
+Reports requests/sec and p50/p99 latency per server.
+
+By default both servers are spawned on local ports against a fresh SQLite
+stand-in database and the stub decrypt service:
+
+    python benchmarks/bench_asgi_vs_wsgi.py --clients 1000 --duration 30
+
+or point it at servers that are already running (they must reach a decrypt
+service that accepts the stub's payloads):
+
+    python benchmarks/bench_asgi_vs_wsgi.py --target wsgi=http://host:5000 --target asgi=http://host:8000
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import stub_decrypt  # noqa: E402
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _post(base_url, path, payload, cookie=None):
+    headers = {"Content-Type": "application/json"}
+    if cookie:
+        headers["Cookie"] = cookie
+    request = urllib.request.Request(f"{base_url}{path}", data=json.dumps(payload).encode(),
+                                     headers=headers, method="POST")
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return response.headers.get("Set-Cookie", ""), json.loads(response.read())
+
+
+def enrol_user(base_url):
+    """Sign up a fresh user, scan one QR payload; returns (cookie, account)"""
+    email = f"bench-{uuid.uuid4().hex[:12]}@example.com"
+    set_cookie, _ = _post(base_url, "/signup", {"email": email, "password": "bench", "confirm_password": "bench"})
+    cookie = set_cookie.split(";", 1)[0]
+    _, scanned = _post(base_url, "/scan", {"qr_code_data": {"uuid": uuid.uuid4().hex, "encrypted_url": "x"}}, cookie)
+    return cookie, scanned["account"]
+
+
+class KeepAliveClient:
+    """Minimal HTTP/1.1 client on one connection; reconnects when the server closes it"""
+
+    def __init__(self, host, port, cookie):
+        self.host = host
+        self.port = port
+        self.cookie = cookie
+        self._reader = None
+        self._writer = None
+
+    async def request(self, method, path, body=None):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        payload = json.dumps(body).encode() if body is not None else b""
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\nCookie: {self.cookie}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n")
+        self._writer.write(head.encode() + payload)
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed")
+        version, status = status_line.split(b" ", 2)[:2]
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if "content-length" in headers:
+            await self._reader.readexactly(int(headers["content-length"]))
+        else:
+            await self._reader.read()
+            headers["connection"] = "close"
+
+        if version == b"HTTP/1.0" or headers.get("connection", "").lower() == "close":
+            self.close()
+        return int(status)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+
+async def client_loop(host, port, cookie, account, deadline, timeout, result):
+    client = KeepAliveClient(host, port, cookie)
+    mix = [
+        ("GET", "/get-totp-data", None),
+        ("POST", "/generateTotp", {"account": account}),
+        ("POST", "/update-totp", {"account": account}),
+        ("POST", "/get-updated-totp", {"account": account}),
+    ]
+    try:
+        while time.perf_counter() < deadline:
+            for method, path, body in mix:
+                start = time.perf_counter()
+                try:
+                    status = await asyncio.wait_for(client.request(method, path, body), timeout)
+                except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+                    client.close()
+                    result["errors"] += 1
+                    continue
+                result["latencies"].append(time.perf_counter() - start)
+                if status >= 500:
+                    result["errors"] += 1
+    finally:
+        client.close()
+
+
+def _percentile(ordered, q):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+async def run_load(base_url, clients, duration, users, timeout=30.0):
+    url = urlsplit(base_url)
+    sessions = [enrol_user(base_url) for _ in range(min(users, clients))]
+    result = {"latencies": [], "errors": 0}
+
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*(
+        client_loop(url.hostname, url.port or 80, *sessions[i % len(sessions)], deadline, timeout, result)
+        for i in range(clients)
+    ))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(result["latencies"])
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "errors": result["errors"],
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def wait_until_up(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(base_url + "/", timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{base_url} did not start")
+
+
+def spawn_servers(wsgi_port, asgi_port):
+    """Start the stub decrypt service and both servers on a throwaway database"""
+    stub = stub_decrypt.start()
+    env = dict(
+        os.environ,
+        AUTHSHIELD_DB_URL="sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"),
+        DECRYPT_SERVICE_URL=f"http://127.0.0.1:{stub.server_port}",
+        BCRYPT_ROUNDS="4",
+        DB_EXPLAIN_CHECK="false",
+        # Every simulated user comes from one IP; admission control would throttle the harness itself
+        RATE_LIMITS="",
+        LOAD_SHED_P99_SECONDS="0",
+        DB_POOL_SIZE=os.getenv("DB_POOL_SIZE", "32"),
+    )
+    wsgi = subprocess.Popen(
+        [sys.executable, "-c",
+         f"import authshield_server as s; s.app.run(host='127.0.0.1', port={wsgi_port}, threaded=True)"],
+        cwd=BACKEND, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    asgi = subprocess.Popen(
+        [sys.executable, "-m", "hypercorn", "asgi_server:app", "--bind", f"127.0.0.1:{asgi_port}",
+         "--backlog", "2048"],
+        cwd=BACKEND, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    targets = {"wsgi": f"http://127.0.0.1:{wsgi_port}", "asgi": f"http://127.0.0.1:{asgi_port}"}
+    for base_url in targets.values():
+        wait_until_up(base_url)
+    return targets, [wsgi, asgi], stub
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", action="append", default=[], metavar="NAME=URL",
+                        help="Benchmark an already running server (repeatable); skips spawning")
+    parser.add_argument("--clients", type=int, default=1000, help="Concurrent keep-alive clients")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--users", type=int, default=50, help="Distinct logged-in users shared by the clients")
+    parser.add_argument("--wsgi-port", type=int, default=5080)
+    parser.add_argument("--asgi-port", type=int, default=5081)
+    args = parser.parse_args()
+
+    # Every client holds a socket open
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, args.clients * 2 + 256)), hard))
+
+    processes, stub = [], None
+    if args.target:
+        targets = dict(target.split("=", 1) for target in args.target)
+    else:
+        targets, processes, stub = spawn_servers(args.wsgi_port, args.asgi_port)
+
+    try:
+        report = {name: asyncio.run(run_load(base_url, args.clients, args.duration, args.users))
+                  for name, base_url in targets.items()}
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        if stub is not None:
+            stub.shutdown()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
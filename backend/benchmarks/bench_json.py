@@ -0,0 +1,128 @@
+"""
+Benchmark: response bytes and CPU per request for the TOTP polling routes.
+
+Enrols --accounts accounts for one user in a SQLite stand-in database, then
+measures each encoding through the Flask test client:
+
+- /get-updated-totp, polled once per second per account: the stdlib
+  encoder, orjson, and orjson with Prefer: return=minimal
+- /get-totp-data, the dashboard list: stdlib, orjson, and orjson with gzip
+
+Bytes per response are the status line, the headers and the body as the app
+emits them. The server's own Date/Server headers are left out.
+"client_bytes_per_second" is what one client polling every account costs. CPU is process time per
+request, the best of three runs of --requests requests, including routing,
+the session check and the memoised code lookup. "encode_us" is the JSON
+provider's share of it: building the response object from the payload alone,
+plus compressing it in the gzip case.
+
+    python benchmarks/bench_json.py --accounts 10 --requests 5000
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def wire_bytes(response):
+    status_line = f"HTTP/1.1 {response.status}\r\n"
+    headers = "".join(f"{name}: {value}\r\n" for name, value in response.headers.items())
+    return len(status_line) + len(headers) + 2 + len(response.get_data())
+
+
+def measure(send, requests, repeat=3):
+    send()  # first request of the window fills the memo
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.process_time()
+        for _ in range(requests):
+            response = send()
+        best = min(best, time.process_time() - start)
+    return wire_bytes(response), best / requests
+
+
+def encode_time(app, provider, payload, compress=False, iterations=20000):
+    with app.app_context():
+        start = time.process_time()
+        for _ in range(iterations):
+            response = provider.response(payload)
+            if compress:
+                gzip.compress(response.get_data(), compresslevel=6, mtime=0)
+        return (time.process_time() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("AUTHSHIELD_DB_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "json.db"))
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("DB_EXPLAIN_CHECK", "false")
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+    os.environ["TOTP_STATELESS"] = "true"
+
+    from flask.json.provider import DefaultJSONProvider
+
+    import authshield_server as server
+    from alphanumeric_totp import AlphanumericTOTP
+    from json_backend import OrjsonProvider, orjson
+
+    client = server.app.test_client()
+    client.post("/signup", json={"email": "bench@example.com", "password": "p", "confirm_password": "p"})
+    uid = client.post("/login", json={"email": "bench@example.com", "password": "p"}).get_json()["uid"]
+    conn = server.get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT INTO user_totp (user_uuid, totp_secret, account, uid, 2faenabled) VALUES (%s, %s, %s, %s, 1)",
+            [(f"json-{i}", AlphanumericTOTP.random_base32(20), f"account-{i}@example.com", uid)
+             for i in range(args.accounts)],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    providers = {"stdlib": DefaultJSONProvider(server.app)}
+    if orjson is not None:
+        providers["orjson"] = OrjsonProvider(server.app)
+    fast = "orjson" if orjson is not None else "stdlib"
+
+    polling = [(name, provider, {}) for name, provider in providers.items()]
+    polling.append((f"{fast}_compact", providers[fast], {"Prefer": "return=minimal"}))
+    listing = [(name, provider, {}) for name, provider in providers.items()]
+    listing.append((f"{fast}_gzip", providers[fast], {"Accept-Encoding": "gzip"}))
+
+    report = {"accounts": args.accounts, "get_updated_totp": {}, "get_totp_data": {}}
+    for name, provider, headers in polling:
+        server.app.json = provider
+        size, cpu = measure(lambda: client.post("/get-updated-totp", json={"account": "account-0@example.com"},
+                                                headers=headers), args.requests)
+        body = client.post("/get-updated-totp", json={"account": "account-0@example.com"}, headers=headers).get_json()
+        report["get_updated_totp"][name] = {
+            "bytes_per_response": size,
+            "client_bytes_per_second": size * args.accounts,
+            "cpu_us_per_request": round(cpu * 1e6, 1),
+            "encode_us": round(encode_time(server.app, provider, body) * 1e6, 2),
+        }
+    for name, provider, headers in listing:
+        server.app.json = provider
+        size, cpu = measure(lambda: client.get("/get-totp-data", headers=headers), args.requests)
+        body = client.get("/get-totp-data").get_json()
+        report["get_totp_data"][name] = {
+            "bytes_per_response": size,
+            "cpu_us_per_request": round(cpu * 1e6, 1),
+            "encode_us": round(encode_time(server.app, provider, body, compress="Accept-Encoding" in headers, iterations=5000) * 1e6, 2),
+        }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
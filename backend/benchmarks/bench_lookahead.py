@@ -0,0 +1,123 @@
+"""
+Benchmark: steady-state request volume of one client with /lookahead-codes.
+
+Enrols --accounts accounts for one user in a SQLite stand-in database. It
+then compares three ways for a client to keep every account's code on
+screen for an hour:
+
+- per_second: /get-updated-totp once per second per account, as the
+  AuthenticatorScreen polling loop does
+- per_window: /get-codes once per 45-second window
+- lookahead: /lookahead-codes?windows=N, fetched again at the response's
+  refresh_at, so once every N - 1 windows
+
+Requests, bytes and server CPU per hour are the per-request figures
+measured through the Flask test client, times the requests needed. Bytes
+are the status line, headers and body as the app emits them.
+"batch_vs_per_window_us" compares the code derivation alone: N separate
+codes_for_window() calls against one lookahead_codes() batch.
+
+    python benchmarks/bench_lookahead.py --accounts 10 --windows 10
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SECONDS_PER_HOUR = 3600
+
+
+def wire_bytes(response):
+    status_line = f"HTTP/1.1 {response.status}\r\n"
+    headers = "".join(f"{name}: {value}\r\n" for name, value in response.headers.items())
+    return len(status_line) + len(headers) + 2 + len(response.get_data())
+
+
+def measure(send, requests):
+    send()
+    start = time.process_time()
+    for _ in range(requests):
+        response = send()
+    return wire_bytes(response), (time.process_time() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=10)
+    parser.add_argument("--windows", type=int, default=10, help="Lookahead windows requested")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("AUTHSHIELD_DB_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "lookahead.db"))
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("DB_EXPLAIN_CHECK", "false")
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+    os.environ.setdefault("LOOKAHEAD_MAX_WINDOWS", str(args.windows))
+    os.environ["TOTP_STATELESS"] = "true"
+    os.environ["RATE_LIMITS"] = ""
+    os.environ["LOAD_SHED_P99_SECONDS"] = "0"
+
+    import authshield_server as server
+    from alphanumeric_totp import AlphanumericTOTP
+    from totp_codes import WINDOW_SECONDS, codes_for_window, lookahead_codes, window_bounds
+
+    client = server.app.test_client()
+    client.post("/signup", json={"email": "bench@example.com", "password": "p", "confirm_password": "p"})
+    uid = client.post("/login", json={"email": "bench@example.com", "password": "p"}).get_json()["uid"]
+    secrets = [AlphanumericTOTP.random_base32(20) for _ in range(args.accounts)]
+    conn = server.get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT INTO user_totp (user_uuid, totp_secret, account, uid, 2faenabled) VALUES (%s, %s, %s, %s, 1)",
+            [(f"lookahead-{i}", secret, f"account-{i}@example.com", uid) for i, secret in enumerate(secrets)],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    windows = min(args.windows, server.LOOKAHEAD_MAX_WINDOWS)
+    body = client.get(f"/lookahead-codes?windows={windows}").get_json()
+    windows_per_fetch = max(1, (body["refresh_at"] - body["windows"][0]["valid_from"]) // WINDOW_SECONDS)
+    windows_per_hour = SECONDS_PER_HOUR / WINDOW_SECONDS
+
+    strategies = {
+        "per_second": (
+            lambda: client.post("/get-updated-totp", json={"account": "account-0@example.com"}),
+            SECONDS_PER_HOUR * args.accounts,
+        ),
+        "per_window": (lambda: client.get("/get-codes"), windows_per_hour),
+        "lookahead": (lambda: client.get(f"/lookahead-codes?windows={windows}"), windows_per_hour / windows_per_fetch),
+    }
+    report = {"accounts": args.accounts, "windows": windows, "windows_per_fetch": windows_per_fetch}
+    for name, (send, per_hour) in strategies.items():
+        size, cpu = measure(send, args.requests)
+        report[name] = {
+            "requests_per_hour": round(per_hour, 1),
+            "bytes_per_response": size,
+            "bytes_per_hour": round(size * per_hour),
+            "server_cpu_ms_per_hour": round(cpu * per_hour * 1000, 1),
+        }
+
+    window_start = window_bounds()[0]
+    iterations = max(1, args.requests // 10)
+    start = time.process_time()
+    for _ in range(iterations):
+        for offset in range(windows):
+            codes_for_window(secrets, window_start + offset * WINDOW_SECONDS)
+    separate = (time.process_time() - start) / iterations
+    start = time.process_time()
+    for _ in range(iterations):
+        lookahead_codes(secrets, window_start, windows)
+    batched = (time.process_time() - start) / iterations
+    report["batch_vs_per_window_us"] = {"per_window_calls": round(separate * 1e6, 1), "one_batch": round(batched * 1e6, 1)}
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark: QR image decoding throughput in images/sec on a CPU-only box.
+
+Builds --images enrolment QR codes rendered as photo-sized JPEGs (--size
+pixels square, with sensor noise), then decodes them three ways:
+
+- "full_res": one process, colour decode at full resolution, then pyzbar
+- "downscaled": one process, decode_image() (grayscale, longest side --max-side)
+- "pool_N": QrDecoder with N worker processes, for each N in --workers
+
+Each run also reports how many payloads it found, so a max-side too small to
+read the codes shows up next to its throughput rather than as a fast number.
+
+    python benchmarks/bench_qr_batch.py --images 200 --size 3000 --workers 1 2 4
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qr_batch import QrDecoder, decode_image  # noqa: E402
+
+
+def render(text, size, seed):
+    import cv2
+    import numpy
+
+    code = cv2.QRCodeEncoder.create().encode(text)
+    image = cv2.resize(code, (size, size), interpolation=cv2.INTER_NEAREST)
+    noise = numpy.random.default_rng(seed).normal(0, 12, image.shape)
+    image = numpy.clip(image.astype(numpy.float32) + noise, 0, 255).astype(numpy.uint8)
+    image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def full_res(data):
+    import cv2
+    import numpy
+    from pyzbar.pyzbar import decode
+
+    image = cv2.imdecode(numpy.frombuffer(data, dtype=numpy.uint8), cv2.IMREAD_COLOR)
+    return [symbol.data.decode("utf-8") for symbol in decode(image)]
+
+
+def decoded(found, expected):
+    return sum(1 for payloads, text in zip(found, expected) if text in (payloads or []))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--size", type=int, default=3000, help="Side of each rendered image in pixels")
+    parser.add_argument("--max-side", type=int, default=1024)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    payloads = [json.dumps({"uuid": f"bench-{i}", "encrypted_url": "x" * 64}) for i in range(args.images)]
+    images = [render(text, args.size, seed) for seed, text in enumerate(payloads)]
+    report = {
+        "images": args.images,
+        "size": args.size,
+        "average_bytes": sum(map(len, images)) // len(images),
+        "cpus": os.cpu_count(),
+    }
+
+    start = time.perf_counter()
+    found = [full_res(data) for data in images]
+    report["full_res_images_per_second"] = round(args.images / (time.perf_counter() - start), 1)
+    report["full_res_decoded"] = decoded(found, payloads)
+
+    start = time.perf_counter()
+    found = [decode_image(data, args.max_side) for data in images]
+    report["downscaled_images_per_second"] = round(args.images / (time.perf_counter() - start), 1)
+    report["downscaled_decoded"] = decoded(found, payloads)
+
+    for workers in args.workers:
+        decoder = QrDecoder(workers=workers, queue_depth=args.images, max_side=args.max_side,
+                            max_bytes=max(map(len, images)))
+        # Start the processes outside the timed run
+        list(decoder.decode_many([("warmup", images[0])] * workers))
+        start = time.perf_counter()
+        results = {name: (payloads_found, error) for name, payloads_found, error
+                   in decoder.decode_many([(str(i), data) for i, data in enumerate(images)])}
+        report[f"pool_{workers}_images_per_second"] = round(args.images / (time.perf_counter() - start), 1)
+        report[f"pool_{workers}_p99_seconds"] = decoder.decode_time.percentile(99)
+        report[f"pool_{workers}_decoded"] = decoded([results[str(i)][0] for i in range(args.images)], payloads)
+        decoder.shutdown()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
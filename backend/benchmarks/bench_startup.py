@@ -0,0 +1,169 @@
+"""
+Startup budget: import time of the app factory and per-worker memory.
+
+Import time is the wall time of `import wsgi; wsgi.create_app()` in a fresh
+interpreter, the median of --runs runs. The slowest imports, top-level and
+one level down, come from python -X importtime.
+
+Memory is measured like a pre-fork server runs. A master forks --workers
+workers, each serves a few requests, and each worker then reports its RSS,
+its private memory (pages not shared with any other process) and its PSS
+from /proc/self/smaps_rollup. "preload" forks after create_app(), as
+gunicorn --preload does. "no_preload" forks first and imports the app in
+every worker.
+
+With --max-import-ms or --max-worker-private-mb it exits 1 when a budget is
+exceeded, so it can run as a regression check. It uses the SQLite stand-in
+and is Linux-only because of /proc.
+
+    python benchmarks/bench_startup.py --workers 4 --max-import-ms 400 --max-worker-private-mb 40
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = (
+    "import time; start = time.perf_counter(); import wsgi; wsgi.create_app(); "
+    "print(time.perf_counter() - start)"
+)
+
+
+def child_env(db_path):
+    env = dict(os.environ)
+    env.setdefault("AUTHSHIELD_DB_URL", "sqlite:///" + db_path)
+    env.setdefault("LOG_LEVEL", "WARNING")
+    env.setdefault("DB_EXPLAIN_CHECK", "false")
+    env["PYTHONPATH"] = BACKEND + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def import_seconds(env, runs):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], env=env, cwd=BACKEND,
+                             capture_output=True, text=True, check=True)
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return statistics.median(samples)
+
+
+def slowest_imports(env, top):
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import wsgi; wsgi.create_app()"],
+                         env=env, cwd=BACKEND, capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Top-level imports and their direct imports (each nesting level indents by two)
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        if cumulative.strip().isdigit() and depth <= 1:
+            rows.append((int(cumulative), name.strip()))
+    return [{"module": name, "ms": round(us / 1000, 1)} for us, name in sorted(rows, reverse=True)[:top]]
+
+
+def memory_kb():
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[1].isdigit():
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss_kb": fields.get("Rss", 0),
+        "private_kb": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+        "pss_kb": fields.get("Pss", 0),
+    }
+
+
+def run_master(mode, workers):
+    """Child process: fork workers like a pre-fork server and print their memory as JSON"""
+    if mode == "preload":
+        import wsgi
+
+        wsgi.create_app()
+
+    # Workers measure together, once all of them are up, so PSS splits shared pages between all of them
+    go_read, go_write = os.pipe()
+    pipes = []
+    for _ in range(workers):
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_end)
+            os.close(go_write)
+            import wsgi
+
+            client = wsgi.create_app().test_client()
+            for path in ("/", "/metrics", "/get-codes"):
+                client.get(path)
+            os.write(write_end, b"ready\n")
+            os.read(go_read, 1)
+            with os.fdopen(write_end, "w") as out:
+                out.write(json.dumps(memory_kb()))
+            os._exit(0)
+        os.close(write_end)
+        pipes.append((pid, os.fdopen(read_end)))
+
+    for _, f in pipes:
+        f.readline()
+    os.close(go_write)
+    reports = [json.loads(f.read()) for _, f in pipes]
+    for pid, f in pipes:
+        f.close()
+        os.waitpid(pid, 0)
+    print(json.dumps(reports))
+
+
+def worker_memory(env, mode, workers):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--master", mode, "--workers", str(workers)],
+                         env=env, cwd=BACKEND, capture_output=True, text=True, check=True)
+    reports = json.loads(out.stdout.strip().splitlines()[-1])
+    return {
+        "worker_rss_mb": round(statistics.mean(r["rss_kb"] for r in reports) / 1024, 1),
+        "worker_private_mb": round(statistics.mean(r["private_kb"] for r in reports) / 1024, 1),
+        "workers_pss_total_mb": round(sum(r["pss_kb"] for r in reports) / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters timed for import")
+    parser.add_argument("--top", type=int, default=8, help="Slowest imports to list")
+    parser.add_argument("--max-import-ms", type=float)
+    parser.add_argument("--max-worker-private-mb", type=float)
+    parser.add_argument("--master", choices=["preload", "no_preload"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.master:
+        sys.path.insert(0, BACKEND)
+        run_master(args.master, args.workers)
+        return
+
+    env = child_env(os.path.join(tempfile.mkdtemp(), "startup.db"))
+    report = {
+        "import_ms": round(import_seconds(env, args.runs) * 1000, 1),
+        "slowest_imports": slowest_imports(env, args.top),
+        "preload": worker_memory(env, "preload", args.workers),
+        "no_preload": worker_memory(env, "no_preload", args.workers),
+    }
+    print(json.dumps(report, indent=2))
+
+    failures = []
+    if args.max_import_ms is not None and report["import_ms"] > args.max_import_ms:
+        failures.append(f"import took {report['import_ms']} ms (budget {args.max_import_ms} ms)")
+    private_mb = report["preload"]["worker_private_mb"]
+    if args.max_worker_private_mb is not None and private_mb > args.max_worker_private_mb:
+        failures.append(f"preloaded workers use {private_mb} MB private (budget {args.max_worker_private_mb} MB)")
+    if failures:
+        raise SystemExit("Startup budget exceeded: " + "; ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
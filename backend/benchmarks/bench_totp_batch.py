@@ -0,0 +1,83 @@
+"""
+Micro-benchmark: batched AlphanumericTOTP generation versus one object per code.
+
+The baseline mirrors how the routes have always computed codes, building an
+AlphanumericTOTP instance and calling generate_otp() for every account.
+"cold" batches decode and key every secret inside the call; "prepared"
+batches reuse keys from an earlier tick, which is the scheduler's steady state.
+
+The goal was 10x the per-object loop at 100k secrets. Pure CPython falls
+short of it. Every code still needs two SHA-1 compressions and two hash
+state copies in C, about 1.5 us, plus about 1 us of truncation and base-36
+conversion. The per-object loop costs some 16-18 us, so at 100k secrets it
+tops out near 6x. On one core, 100k secrets measured about 2.4x cold and
+5.5x prepared with one window, and 4.8x and 6.2x with ten. Small runs whose
+hash states stay in CPU cache come out higher. "target_speedup" is printed next to the
+results so a run shows how far it got.
+
+    python benchmarks/bench_totp_batch.py --secrets 100000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from alphanumeric_totp import AlphanumericTOTP, generate_batch, prepare_key  # noqa: E402
+
+# What the batch engine was asked to reach; see the module docstring
+TARGET_SPEEDUP = 10
+
+
+def bench(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--secrets", type=int, default=100_000)
+    parser.add_argument("--windows", type=int, default=1, help="Counters per secret")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    secrets = [AlphanumericTOTP.random_base32(20) for _ in range(args.secrets)]
+    counter = int(time.time()) // 30
+    pairs = [(secret, counter + i) for secret in secrets for i in range(args.windows)]
+
+    def per_object():
+        return [AlphanumericTOTP(secret=secret, digits=6, interval=30).generate_otp(c) for secret, c in pairs]
+
+    def cold_batch():
+        return generate_batch(pairs)
+
+    keys = {secret: prepare_key(secret) for secret in secrets}
+
+    def prepared_batch():
+        return generate_batch(pairs, keys=keys)
+
+    baseline_seconds, expected = bench(per_object, args.repeat)
+    cold_seconds, cold = bench(cold_batch, args.repeat)
+    prepared_seconds, prepared = bench(prepared_batch, args.repeat)
+    if cold != expected or prepared != expected:
+        raise SystemExit("Batched output differs from generate_otp()")
+
+    print(json.dumps({
+        "codes": len(pairs),
+        "per_object_codes_per_second": round(len(pairs) / baseline_seconds),
+        "cold_batch_codes_per_second": round(len(pairs) / cold_seconds),
+        "prepared_batch_codes_per_second": round(len(pairs) / prepared_seconds),
+        "cold_speedup": round(baseline_seconds / cold_seconds, 2),
+        "prepared_speedup": round(baseline_seconds / prepared_seconds, 2),
+        "target_speedup": TARGET_SPEEDUP,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
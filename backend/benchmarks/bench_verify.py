@@ -0,0 +1,112 @@
+"""
+Benchmark: verifying codes across a drift window, and /verify under a burst.
+
+"per_offset" is the loop AlphanumericTOTP.verify() used to run, building a
+fresh HMAC for every offset. "verify" is the batched method and
+"match_window" the cached-key path the /verify route uses. The burst part
+enrols --accounts accounts in a SQLite stand-in database, submits one valid
+code per account through the Flask test client, then replays every code,
+which must all come back 409. Keep --checks within TOTP_KEY_CACHE_BYTES (about
+4 MB, some 8k secrets, by default) or match_window measures evictions.
+
+    python benchmarks/bench_verify.py --checks 5000 --drift 1 --accounts 2000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from alphanumeric_totp import AlphanumericTOTP  # noqa: E402
+
+
+def per_offset(totp, otp, for_time, valid_window):
+    # The pre-batch verify(): one full HMAC, key schedule included, per offset
+    for i in range(-valid_window, valid_window + 1):
+        if totp.generate_otp(for_time + i * totp.interval) == str(otp):
+            return True
+    return False
+
+
+def timed(fn, items):
+    start = time.perf_counter()
+    results = [fn(item) for item in items]
+    return time.perf_counter() - start, results
+
+
+def bench_checks(args):
+    from totp_codes import WINDOW_SECONDS, match_window, window_bounds
+
+    secrets = [AlphanumericTOTP.random_base32(20) for _ in range(args.checks)]
+    window_start, _ = window_bounds()
+    totps = [AlphanumericTOTP(secret=secret, digits=6, interval=WINDOW_SECONDS) for secret in secrets]
+    # The newest accepted window: the per-offset loop computes every offset first
+    checks = [(totp, totp.generate_otp(window_start + args.drift * WINDOW_SECONDS)) for totp in totps]
+
+    legacy_seconds, legacy = timed(lambda c: per_offset(c[0], c[1], window_start, args.drift), checks)
+    batch_seconds, batch = timed(lambda c: c[0].verify(c[1], window_start, valid_window=args.drift), checks)
+    # First pass fills the key cache; the second is the steady state
+    timed(lambda c: match_window(c[0].secret, c[1], window_start, args.drift), checks)
+    cached_seconds, cached = timed(lambda c: match_window(c[0].secret, c[1], window_start, args.drift), checks)
+    if not all(legacy) or not all(batch) or None in cached:
+        raise SystemExit("A valid code was rejected")
+
+    return {
+        "checks": args.checks,
+        "drift_windows": args.drift,
+        "per_offset_checks_per_second": round(args.checks / legacy_seconds),
+        "verify_checks_per_second": round(args.checks / batch_seconds),
+        "match_window_checks_per_second": round(args.checks / cached_seconds),
+    }
+
+
+def bench_burst(args):
+    os.environ.setdefault("AUTHSHIELD_DB_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "verify.db"))
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["VERIFY_DRIFT_WINDOWS"] = str(args.drift)
+    import authshield_server as server
+    from totp_codes import code_for_window, window_bounds
+
+    accounts = [(f"verify-{i}", AlphanumericTOTP.random_base32(20)) for i in range(args.accounts)]
+    conn = server.get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT INTO user_totp (user_uuid, totp_secret, account, uid, 2faenabled) VALUES (%s, %s, %s, %s, 1)",
+            [(user_uuid, secret, user_uuid, 1) for user_uuid, secret in accounts],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    window_start, _ = window_bounds()
+    bodies = [{"user_uuid": user_uuid, "code": code_for_window(secret, window_start)} for user_uuid, secret in accounts]
+    client = server.app.test_client()
+
+    first_seconds, first = timed(lambda body: client.post("/verify", json=body).status_code, bodies)
+    replay_seconds, replay = timed(lambda body: client.post("/verify", json=body).status_code, bodies)
+    return {
+        "accounts": args.accounts,
+        "burst_requests_per_second": round(len(bodies) / first_seconds),
+        "replay_requests_per_second": round(len(bodies) / replay_seconds),
+        "burst_status": {str(status): first.count(status) for status in sorted(set(first))},
+        "replay_status": {str(status): replay.count(status) for status in sorted(set(replay))},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checks", type=int, default=5000)
+    parser.add_argument("--drift", type=int, default=1, help="Windows accepted either side of the current one")
+    parser.add_argument("--accounts", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(json.dumps({**bench_checks(args), **bench_burst(args)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+End-to-end load test replaying the authenticator app's request mix.
+
+Every virtual user logs in, loads /get-totp-data, then polls
+/get-updated-totp once a second for each of its accounts and now and then
+scans a new QR code, as AuthenticatorScreen did before /get-codes existed
+(pass --poll get-codes for the batched client). The server runs on a
+throwaway SQLite stand-in database against the stub decrypt service unless
+--base-url points at a running one.
+
+Reports throughput, latency percentiles per endpoint, database queries per
+request (from /metrics/db-pool) and server threads alive, and writes it all
+to a JSON file so runs from different commits can be diffed:
+
+    python benchmarks/loadtest.py --users 200 --accounts 3 --duration 60
+    python benchmarks/loadtest.py --baseline results/loadtest-abc1234.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import stub_decrypt  # noqa: E402
+from bench_asgi_vs_wsgi import KeepAliveClient, _percentile, _post, wait_until_up  # noqa: E402
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.dirname(BENCHMARKS)
+
+
+def server_metrics(base_url):
+    with urllib.request.urlopen(f"{base_url}/metrics/db-pool", timeout=10) as response:
+        return json.loads(response.read())
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class VirtualUser:
+    def __init__(self, host, port, email, cookie, accounts, args, result):
+        self.client = KeepAliveClient(host, port, cookie)
+        self.email = email
+        self.accounts = list(accounts)
+        self.args = args
+        self.result = result
+
+    async def call(self, method, path, body=None):
+        start = time.perf_counter()
+        try:
+            status = await asyncio.wait_for(self.client.request(method, path, body), self.args.timeout)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+            self.client.close()
+            self.result["errors"][path] += 1
+            return None
+        self.result["latencies"][path].append(time.perf_counter() - start)
+        if status >= 400:
+            self.result["errors"][path] += 1
+        return status
+
+    async def run(self, deadline):
+        await self.call("POST", "/login", {"email": self.email, "password": "bench"})
+        await self.call("GET", "/get-totp-data")
+        # Spread the 1 Hz polls so users do not all fire on the same tick
+        await asyncio.sleep(random.random())
+        while time.perf_counter() < deadline:
+            tick = time.perf_counter()
+            if self.args.poll == "get-codes":
+                await self.call("GET", "/get-codes")
+            else:
+                for account in self.accounts:
+                    await self.call("POST", "/get-updated-totp", {"account": account})
+            if random.random() < self.args.scan_rate:
+                status = await self.call("POST", "/scan", {
+                    "qr_code_data": {"uuid": os.urandom(16).hex(), "encrypted_url": "x"}
+                })
+                if status == 200:
+                    await self.call("GET", "/get-totp-data")
+            await asyncio.sleep(max(0.0, 1.0 - (time.perf_counter() - tick)))
+        self.client.close()
+
+
+async def run_load(base_url, users, args):
+    url = urlsplit(base_url)
+    result = {"latencies": defaultdict(list), "errors": defaultdict(int), "threads": []}
+
+    async def sample_threads(deadline):
+        while time.perf_counter() < deadline:
+            metrics = await asyncio.to_thread(server_metrics, base_url)
+            result["threads"].append(metrics["threads_alive"])
+            await asyncio.sleep(1)
+
+    before = server_metrics(base_url)
+    start = time.perf_counter()
+    deadline = start + args.duration
+    vusers = [VirtualUser(url.hostname, url.port or 80, email, cookie, accounts, args, result)
+              for email, cookie, accounts in users]
+    await asyncio.gather(sample_threads(deadline), *(vuser.run(deadline) for vuser in vusers))
+    elapsed = time.perf_counter() - start
+    after = server_metrics(base_url)
+
+    requests = sum(len(values) for values in result["latencies"].values())
+    everything = sorted(value for values in result["latencies"].values() for value in values)
+    endpoints = {}
+    for path, values in sorted(result["latencies"].items()):
+        values.sort()
+        endpoints[path] = {
+            "requests": len(values),
+            "errors": result["errors"][path],
+            "p50_ms": round(_percentile(values, 50) * 1000, 2),
+            "p90_ms": round(_percentile(values, 90) * 1000, 2),
+            "p99_ms": round(_percentile(values, 99) * 1000, 2),
+        }
+    # The metrics polls themselves are not counted: the endpoint runs no query
+    queries = after["queries_total"] - before["queries_total"]
+    return {
+        "requests": requests,
+        "errors": sum(result["errors"].values()),
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50_ms": round(_percentile(everything, 50) * 1000, 2),
+        "p90_ms": round(_percentile(everything, 90) * 1000, 2),
+        "p99_ms": round(_percentile(everything, 99) * 1000, 2),
+        "db_queries": queries,
+        "db_queries_per_request": round(queries / requests, 3) if requests else 0.0,
+        "threads_alive_max": max(result["threads"], default=after["threads_alive"]),
+        "threads_alive_end": after["threads_alive"],
+        "endpoints": endpoints,
+    }
+
+
+def prepare_users(base_url, count, accounts):
+    """Sign up users and enrol accounts; returns (email, cookie, [account, ...]) per user"""
+    users = []
+    for _ in range(count):
+        email = f"load-{os.urandom(6).hex()}@example.com"
+        set_cookie, _ = _post(base_url, "/signup", {"email": email, "password": "bench", "confirm_password": "bench"})
+        cookie = set_cookie.split(";", 1)[0]
+        names = []
+        for _ in range(accounts):
+            _, scanned = _post(base_url, "/scan", {
+                "qr_code_data": {"uuid": os.urandom(16).hex(), "encrypted_url": "x"}
+            }, cookie)
+            names.append(scanned["account"])
+        users.append((email, cookie, names))
+    return users
+
+
+def spawn_server(port):
+    stub = stub_decrypt.start()
+    env = dict(
+        os.environ,
+        AUTHSHIELD_DB_URL="sqlite:///" + os.path.join(tempfile.mkdtemp(), "loadtest.db"),
+        DECRYPT_SERVICE_URL=f"http://127.0.0.1:{stub.server_port}",
+        BCRYPT_ROUNDS="4",
+        DB_EXPLAIN_CHECK="false",
+        # Every simulated user comes from one IP; admission control would throttle the harness itself
+        RATE_LIMITS="",
+        LOAD_SHED_P99_SECONDS="0",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-c",
+         f"import authshield_server as s; s.app.run(host='127.0.0.1', port={port}, threaded=True)"],
+        cwd=BACKEND, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    wait_until_up(base_url)
+    return base_url, server, stub
+
+
+def compare(report, baseline):
+    """Relative change of the headline numbers against an earlier run"""
+    changes = {}
+    for key in ("requests_per_second", "p50_ms", "p99_ms", "db_queries_per_request", "threads_alive_max"):
+        old, new = baseline["results"].get(key), report["results"].get(key)
+        if old:
+            changes[key] = f"{(new - old) / old:+.1%}"
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", help="Running server to test; default spawns one on --port")
+    parser.add_argument("--port", type=int, default=5090)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--accounts", type=int, default=3, help="Enrolled accounts per user")
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--scan-rate", type=float, default=0.01, help="Chance per user per second of a /scan")
+    parser.add_argument("--poll", choices=["get-updated-totp", "get-codes"], default="get-updated-totp")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds before a request counts as failed")
+    parser.add_argument("--output", help="JSON report path (default: benchmarks/results/loadtest-<commit>.json)")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    server = stub = None
+    base_url = args.base_url
+    if base_url is None:
+        base_url, server, stub = spawn_server(args.port)
+    try:
+        users = prepare_users(base_url, args.users, args.accounts)
+        results = asyncio.run(run_load(base_url, users, args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+            stub.shutdown()
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "results": results,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["vs_baseline"] = compare(report, json.load(f))
+
+    output = args.output or os.path.join(BENCHMARKS, "results", f"loadtest-{commit}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Report written to {output}")
+
+
+if __name__ == "__main__":
+    main()
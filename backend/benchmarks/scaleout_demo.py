@@ -0,0 +1,131 @@
+"""
+Multi-process demo of the sharded TOTP scheduler.
+
+Starts several scheduler nodes against one SQLite stand-in database, each
+with its own ShardLeases, then kills one without letting it release its
+leases. Every tick records which node advanced which user_uuid, and the
+report shows for each window how many secrets were advanced, whether any were
+advanced twice or not at all, and which nodes did the work. Once the dead
+node's leases expire, the survivors take over its shards.
+
+    python benchmarks/scaleout_demo.py --nodes 3 --shards 12 --secrets 300 --interval 3 --lease 3
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+import sqlite_standin  # noqa: E402
+
+
+def run_node(path, node_id, shards, interval, lease):
+    import logging
+
+    from shard_leases import ShardLeases
+    from totp_scheduler import TotpScheduler
+
+    logging.basicConfig(level=logging.WARNING)
+
+    def connect():
+        return sqlite_standin.connect(path)
+
+    def tick(batch):
+        window = int(time.time() // interval)
+        conn = connect()
+        try:
+            cursor = conn.cursor()
+            cursor.executemany(
+                "INSERT INTO demo_ticks (window, node, user_uuid) VALUES (%s, %s, %s)",
+                [(window, node_id, user_uuid) for user_uuid, _ in batch],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def load_rows(owned):
+        conn = connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT user_uuid, totp_secret FROM user_totp "
+                f"WHERE MOD(CRC32(user_uuid), %s) IN ({', '.join(['%s'] * len(owned))})",
+                (shards, *sorted(owned)),
+            )
+            return cursor.fetchall()
+        finally:
+            conn.close()
+
+    scheduler = TotpScheduler(tick, interval=interval,
+                              leases=ShardLeases(connect, shards, node_id=node_id, lease_seconds=lease))
+    scheduler.start(load_rows)
+    signal.signal(signal.SIGTERM, lambda *_: (scheduler.shutdown(), os._exit(0)))
+    while True:
+        time.sleep(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--shards", type=int, default=12)
+    parser.add_argument("--secrets", type=int, default=300)
+    parser.add_argument("--interval", type=int, default=3, help="Tick period in seconds (45 in production)")
+    parser.add_argument("--lease", type=float, default=3.0, help="Lease length in seconds")
+    parser.add_argument("--kill-after", type=float, default=10.0, help="Seconds before node-0 is killed")
+    parser.add_argument("--duration", type=float, default=25.0)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "scaleout.db")
+    sqlite_standin.bootstrap(path)
+    conn = sqlite_standin.connect(path)
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE demo_ticks (window INTEGER, node TEXT, user_uuid TEXT)")
+    cursor.executemany(
+        "INSERT INTO user_totp (user_uuid, totp_secret, account, uid) VALUES (%s, %s, %s, %s)",
+        [(f"uuid-{i}", "JBSWY3DPEHPK3PXP", f"account-{i}", 1) for i in range(args.secrets)],
+    )
+    conn.commit()
+
+    nodes = [
+        multiprocessing.Process(target=run_node, args=(path, f"node-{i}", args.shards, args.interval, args.lease))
+        for i in range(args.nodes)
+    ]
+    for node in nodes:
+        node.start()
+    started = time.time()
+
+    time.sleep(args.kill_after)
+    os.kill(nodes[0].pid, signal.SIGKILL)
+    killed_at = time.time()
+    print(f"Killed node-0 after {killed_at - started:.1f}s; its leases expire within {args.lease}s")
+
+    time.sleep(max(0.0, args.duration - args.kill_after))
+    for node in nodes[1:]:
+        node.terminate()
+    for node in nodes:
+        node.join()
+
+    cursor.execute("SELECT window, node, user_uuid FROM demo_ticks ORDER BY window")
+    per_window = defaultdict(lambda: defaultdict(int))
+    nodes_per_window = defaultdict(lambda: defaultdict(int))
+    for window, node, user_uuid in cursor.fetchall():
+        per_window[window][user_uuid] += 1
+        nodes_per_window[window][node] += 1
+    conn.close()
+
+    print(f"{'window':>8} {'advanced':>9} {'twice':>6} {'missing':>8}  nodes")
+    for window in sorted(per_window):
+        counts = per_window[window]
+        marker = "  <- node-0 killed" if window * args.interval <= killed_at < (window + 1) * args.interval else ""
+        print(f"{window % 10000:>8} {len(counts):>9} {sum(1 for c in counts.values() if c > 1):>6} "
+              f"{args.secrets - len(counts):>8}  {dict(sorted(nodes_per_window[window].items()))}{marker}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Concurrent-connection load test for the /stream-codes SSE endpoint.
+
+Logs in once, then opens many idle event streams with the same session
+cookie and reports how many connected, how long the first event took and
+how many window events each stream received.
+
+    python benchmarks/stream_load.py --base-url http://localhost:5000 \
+        --email load@example.com --password secret --connections 5000 --duration 120
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+
+def login(base_url, email, password):
+    request = urllib.request.Request(
+        f"{base_url}/login",
+        data=json.dumps({"email": email, "password": password}).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(request, timeout=30) as response:
+        cookie = response.headers.get("Set-Cookie", "")
+    return cookie.split(";", 1)[0]
+
+
+async def open_stream(host, port, cookie, duration, result):
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        result["failed"] += 1
+        return
+
+    writer.write(
+        (f"GET /stream-codes HTTP/1.1\r\nHost: {host}:{port}\r\n"
+         f"Cookie: {cookie}\r\nAccept: text/event-stream\r\n\r\n").encode()
+    )
+    await writer.drain()
+
+    events = 0
+    deadline = start + duration
+    try:
+        status = await asyncio.wait_for(reader.readline(), timeout=30)
+        if b" 200 " not in status:
+            result["failed"] += 1
+            return
+        result["connected"] += 1
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            line = await asyncio.wait_for(reader.readline(), timeout=remaining)
+            if not line:
+                result["dropped"] += 1
+                break
+            if line.startswith(b"event: codes"):
+                if events == 0:
+                    result["first_event_seconds"].append(time.perf_counter() - start)
+                events += 1
+    except asyncio.TimeoutError:
+        pass
+    except OSError:
+        result["dropped"] += 1
+    finally:
+        result["events"].append(events)
+        writer.close()
+
+
+async def run(args):
+    cookie = login(args.base_url, args.email, args.password)
+    url = urlsplit(args.base_url)
+    result = {"connected": 0, "failed": 0, "dropped": 0, "events": [], "first_event_seconds": []}
+
+    tasks = []
+    for _ in range(args.connections):
+        tasks.append(asyncio.create_task(
+            open_stream(url.hostname, url.port or 80, cookie, args.duration, result)
+        ))
+        # Ramp up gradually so the listen backlog is not the bottleneck
+        if len(tasks) % args.ramp_batch == 0:
+            await asyncio.sleep(0.05)
+    await asyncio.gather(*tasks)
+
+    first = sorted(result["first_event_seconds"]) or [0.0]
+    return {
+        "connections": args.connections,
+        "connected": result["connected"],
+        "failed": result["failed"],
+        "dropped": result["dropped"],
+        "first_event_p50_seconds": statistics.median(first),
+        "first_event_p99_seconds": first[min(len(first) - 1, int(len(first) * 0.99))],
+        "events_per_stream_mean": statistics.mean(result["events"]) if result["events"] else 0,
+        "duration_seconds": args.duration,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:5000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=100.0, help="Seconds to hold every stream open")
+    parser.add_argument("--ramp-batch", type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
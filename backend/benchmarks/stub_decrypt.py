@@ -0,0 +1,82 @@
+"""
+Local stand-in for the QR decrypt service.
+
+Answers POST /decrypt-url with an otpauth URL whose secret is derived from
+the uuid, so enrolment can be exercised end to end without the real service.
+Latency and failure rate are configurable to test timeouts, retries and the
+circuit breaker.
+
+    python benchmarks/stub_decrypt.py --port 5001 --latency 0.02 --fail-rate 0.1
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def secret_for(user_uuid):
+    return base64.b32encode(hashlib.sha1(user_uuid.encode()).digest()).decode().rstrip("=")
+
+
+def make_handler(latency=0.0, fail_rate=0.0):
+    class DecryptHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if latency:
+                time.sleep(latency)
+            if self.path != "/decrypt-url":
+                return self._reply(404, {"error": "Not found"})
+            if fail_rate and random.random() < fail_rate:
+                return self._reply(503, {"error": "Injected failure"})
+            try:
+                payload = json.loads(body)
+                user_uuid = payload["uuid"]
+            except (ValueError, KeyError):
+                return self._reply(400, {"error": "uuid missing"})
+            account = payload.get("account") or f"stub-{user_uuid[:8]}"
+            return self._reply(200, {
+                "decrypted_url": f"otpauth://totp/{account}?secret={secret_for(user_uuid)}&issuer=AuthShield"
+            })
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return DecryptHandler
+
+
+def start(port=0, latency=0.0, fail_rate=0.0):
+    """Run the stub in a background thread; returns the server (server.server_port is the port)"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(latency, fail_rate))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(("0.0.0.0", args.port), make_handler(args.latency, args.fail_rate))
+    print(f"Stub decrypt service listening on :{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
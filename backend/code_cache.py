@@ -0,0 +1,277 @@
+"""
+Per-window memoisation of TOTP codes shared across requests.
+
+A code only changes at window rollover, so the first request for an
+(uid, account, window) pair computes it and every later request in the same
+window is served from memory without touching MySQL or HMAC. An optional
+SQLite file (ideally on tmpfs, e.g. /dev/shm) lets several gunicorn workers on
+one host share their entries. invalidate() removes an account's entries from
+every worker when its secret changes or it is unenrolled.
+"""
+import inspect
+import json
+import logging
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from metrics import Histogram
+from shared_sqlite import SharedSQLite
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class SharedCodeStore(SharedSQLite):
+    # Expired rows are purged once every this many writes
+    PURGE_EVERY = 500
+
+    def __init__(self, path):
+        """
+        Cross-process key/value store with absolute expiry, backed by SQLite
+
+        Args:
+            path (str): Database file shared by every worker on the host
+        """
+        super().__init__(path, (
+            "CREATE TABLE IF NOT EXISTS window_codes ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)",
+            # Named counters bumped on invalidation, so workers know their in-process copies may be stale
+            "CREATE TABLE IF NOT EXISTS generations (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+        ))
+        self._writes = 0
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value FROM window_codes WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, expires_at):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO window_codes (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), expires_at),
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM window_codes WHERE expires_at <= ?", (time.time(),))
+
+    def delete(self, keys):
+        """Remove entries and bump the "window_codes" generation in one transaction"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("DELETE FROM window_codes WHERE key = ?", [(key,) for key in keys])
+            self._bump(conn, "window_codes")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _bump(conn, name):
+        conn.execute(
+            "INSERT INTO generations (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    def bump(self, name):
+        """Advance a named generation, telling every worker its copies of `name` are stale"""
+        self._bump(self._connection(), name)
+
+    def generation(self, name):
+        """Current value of a named generation (0 if never bumped)"""
+        row = self._connection().execute("SELECT value FROM generations WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+
+class WindowCodeCache:
+    def __init__(self, window_seconds, max_entries=100_000, store=None):
+        """
+        Args:
+            window_seconds (int): Length of a code window; entries expire at its end
+            max_entries (int): Bound on in-process entries
+            store (SharedCodeStore): Optional cross-worker store consulted on local misses
+        """
+        self.window_seconds = window_seconds
+        self._local = TTLCache(max_entries=max_entries)
+        self._store = store
+        self._generation = None
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    @staticmethod
+    def _key(uid, account, window_start):
+        return f"{uid}|{window_start}|{account}"
+
+    def _endpoint(self, endpoint):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = {
+                    "hits": 0,
+                    "misses": 0,
+                    "latency": Histogram(f"{endpoint}_latency_seconds"),
+                }
+            return stats
+
+    def get(self, endpoint, uid, account, window_start):
+        """Return the memoised value for this window, counting a hit or miss for endpoint"""
+        key = self._key(uid, account, window_start)
+        if self._store is not None:
+            self._sync_invalidations()
+        value = self._local.get(key)
+        if value is None and self._store is not None:
+            try:
+                value = self._store.get(key)
+            except sqlite3.Error as e:
+                logger.warning("Shared code store read failed: %s", e)
+            if value is not None:
+                self._local.set(key, value, ttl=max(0.0, window_start + self.window_seconds - time.time()))
+
+        stats = self._endpoint(endpoint)
+        with self._lock:
+            stats["hits" if value is not None else "misses"] += 1
+        return value
+
+    def _sync_invalidations(self):
+        # Another worker invalidated something since we last looked: our in-process
+        # copies may be stale, so drop them and refill from the shared store
+        try:
+            generation = self._store.generation("window_codes")
+        except sqlite3.Error as e:
+            logger.warning("Shared code store read failed: %s", e)
+            return
+        if generation != self._generation:
+            self._local.clear()
+            self._generation = generation
+
+    def set(self, uid, account, window_start, value):
+        """Memoise a value until its window rolls over"""
+        expires_at = window_start + self.window_seconds
+        ttl = expires_at - time.time()
+        if ttl <= 0:
+            return
+        key = self._key(uid, account, window_start)
+        self._local.set(key, value, ttl=ttl)
+        if self._store is not None:
+            try:
+                self._store.set(key, value, expires_at)
+            except sqlite3.Error as e:
+                logger.warning("Shared code store write failed: %s", e)
+
+    def invalidate(self, uid, account):
+        """
+        Forget an account's memoised code, e.g. after it is unenrolled or re-enrolled
+
+        Entries never outlive their window, so only the current window and, in
+        case the clock has just rolled over, the ones either side of it can
+        still be cached. They are dropped here and in the shared store, whose
+        generation bump makes every other worker drop its in-process entries
+        on its next lookup.
+        """
+        now = int(time.time())
+        window_start = now - (now % self.window_seconds)
+        keys = [self._key(uid, account, window_start + offset * self.window_seconds) for offset in (-1, 0, 1)]
+        for key in keys:
+            self._local.pop(key)
+        if self._store is not None:
+            try:
+                self._store.delete(keys)
+            except sqlite3.Error as e:
+                logger.warning("Shared code store delete failed: %s", e)
+
+    def timed(self, endpoint):
+        """Decorator recording the latency of a route under endpoint"""
+        def decorator(f):
+            if inspect.iscoroutinefunction(f):
+                @wraps(f)
+                async def decorated_async(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return await f(*args, **kwargs)
+                    finally:
+                        self._endpoint(endpoint)["latency"].observe(time.perf_counter() - start)
+                return decorated_async
+
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    self._endpoint(endpoint)["latency"].observe(time.perf_counter() - start)
+            return decorated
+        return decorator
+
+    def stats(self):
+        """Per-endpoint hit ratio and latency percentiles"""
+        with self._lock:
+            endpoints = dict(self._endpoints)
+        result = {}
+        for endpoint, stats in endpoints.items():
+            lookups = stats["hits"] + stats["misses"]
+            result[endpoint] = {
+                "hits": stats["hits"],
+                "misses": stats["misses"],
+                "hit_ratio": stats["hits"] / lookups if lookups else 0.0,
+                "latency_p50_seconds": stats["latency"].percentile(50),
+                "latency_p99_seconds": stats["latency"].percentile(99),
+            }
+        return result
+
+
+class AccountCache:
+    def __init__(self, max_entries=10_000, ttl=300, store=None):
+        """
+        Per-uid cache of enrolled account rows, invalidated across workers
+
+        With a SharedCodeStore every uid has a generation there; each entry
+        remembers the generation it was loaded under and is ignored once
+        another worker has invalidated that uid. Without one, invalidation
+        reaches only this process and `ttl` bounds how stale the others get.
+
+        Args:
+            max_entries (int): Bound on cached users
+            ttl (float): Seconds an entry is kept
+            store (SharedCodeStore): Optional cross-worker store for invalidations
+        """
+        self._local = TTLCache(max_entries=max_entries, ttl=ttl)
+        self._store = store
+
+    def _generation(self, uid):
+        if self._store is None:
+            return 0
+        try:
+            return self._store.generation(f"accounts:{uid}")
+        except sqlite3.Error as e:
+            logger.warning("Shared code store read failed: %s", e)
+            return None
+
+    def lookup(self, uid):
+        """
+        Return (rows, generation): rows is None on a miss, and generation is
+        what to pass to set() once the rows have been loaded
+        """
+        generation = self._generation(uid)
+        entry = self._local.get(uid)
+        if entry is not None and generation is not None and entry[0] == generation:
+            return entry[1], generation
+        return None, generation
+
+    def set(self, uid, generation, rows):
+        # Read before loading, so an invalidation that raced the query leaves the entry stale, not served
+        if generation is not None:
+            self._local.set(uid, (generation, rows))
+
+    def invalidate(self, uid):
+        """Forget a user's account list in this process and, through the store, in every other"""
+        self._local.pop(uid)
+        if self._store is not None:
+            try:
+                self._store.bump(f"accounts:{uid}")
+            except sqlite3.Error as e:
+                logger.warning("Shared code store write failed: %s", e)
@@ -0,0 +1,76 @@
+"""
+Server-push delivery of TOTP codes at window rollover.
+
+Every open /stream-codes connection parks on a single shared condition that
+the TOTP scheduler tick notifies once per window, so there is no timer or
+polling loop per connection. Run the backend on a cooperative server so
+idle connections cost a greenlet rather than an OS thread, e.g.
+
+    gunicorn -k gevent --worker-connections 10000 -w 1 authshield_server:app
+"""
+import json
+import threading
+
+# Comment frames keep proxies and mobile networks from closing idle streams
+HEARTBEAT_SECONDS = 15
+
+
+class CodeBroadcaster:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._window_start = None
+        self._subscribers = 0
+
+    def publish(self, window_start):
+        """Wake every waiting stream; called once per tick"""
+        with self._cond:
+            self._window_start = window_start
+            self._cond.notify_all()
+
+    def wait(self, last_window_start, timeout=HEARTBEAT_SECONDS):
+        """
+        Block until a window newer than last_window_start is published
+
+        Returns:
+            int or None: The new window start, or None if the timeout expired first
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._window_start is not None and self._window_start != last_window_start,
+                timeout=timeout,
+            )
+            if self._window_start is None or self._window_start == last_window_start:
+                return None
+            return self._window_start
+
+    def subscriber_count(self):
+        with self._cond:
+            return self._subscribers
+
+    def stream(self, build_payload, first_window_start):
+        """
+        Yield Server-Sent Events, one 'codes' event per window
+
+        Args:
+            build_payload (callable): Maps a window start to the JSON-serialisable event body
+            first_window_start (int): Window to send immediately on connect
+        """
+        with self._cond:
+            self._subscribers += 1
+        try:
+            window_start = first_window_start
+            yield format_event("codes", build_payload(window_start))
+            while True:
+                published = self.wait(window_start)
+                if published is None:
+                    yield ": keepalive\n\n"
+                    continue
+                window_start = published
+                yield format_event("codes", build_payload(window_start))
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
@@ -0,0 +1,300 @@
+import collections
+import logging
+import os
+import threading
+import time
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+# MySQL's duplicate-key error number (mysql.connector.errorcode.ER_DUP_ENTRY)
+ER_DUP_ENTRY = 1062
+
+
+def is_duplicate_entry(error):
+    """True for a unique-key violation from mysql.connector, PyMySQL or the stand-in"""
+    if getattr(error, "errno", None) == ER_DUP_ENTRY:
+        return True
+    return bool(error.args) and error.args[0] == ER_DUP_ENTRY
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be borrowed before the timeout"""
+
+
+class _Entry:
+    __slots__ = ("raw", "created_at", "last_used")
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class PooledConnection:
+    """
+    Proxy around a borrowed DB-API connection.
+
+    Everything is forwarded to the underlying connection except close(),
+    which hands the connection back to the pool instead of tearing it down.
+    """
+
+    def __init__(self, pool, entry):
+        self._pool = pool
+        self._entry = entry
+
+    def __getattr__(self, name):
+        if self._entry is None:
+            raise AttributeError(f"Connection already returned to the pool: {name}")
+        return getattr(self._entry.raw, name)
+
+    def cursor(self, *args, **kwargs):
+        if self._entry is None:
+            raise AttributeError("Connection already returned to the pool: cursor")
+        return _CountingCursor(self._pool, self._entry.raw.cursor(*args, **kwargs))
+
+    def close(self):
+        if self._entry is None:
+            return
+        entry, self._entry = self._entry, None
+        self._pool._release(entry)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class _CountingCursor:
+    """Cursor proxy that counts and times statements sent to the database"""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def execute(self, *args, **kwargs):
+        self._pool._count_query()
+        start = time.perf_counter()
+        try:
+            return self._raw.execute(*args, **kwargs)
+        finally:
+            self._pool.query_time.observe(time.perf_counter() - start)
+
+    def executemany(self, *args, **kwargs):
+        # One round trip however many rows it carries
+        self._pool._count_query()
+        start = time.perf_counter()
+        try:
+            return self._raw.executemany(*args, **kwargs)
+        finally:
+            self._pool.query_time.observe(time.perf_counter() - start)
+
+
+class ConnectionPool:
+    def __init__(self, connect, max_size=10, timeout=5.0, recycle=1800, ping_interval=30):
+        """
+        Bounded, thread-safe pool of database connections
+
+        Args:
+            connect (callable): Zero-argument factory returning a new DB-API connection
+            max_size (int): Maximum number of open connections
+            timeout (float): Seconds to wait for a free connection before failing
+            recycle (int): Connections older than this many seconds are replaced
+            ping_interval (int): Connections idle longer than this are health-checked on checkout
+        """
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+
+        # LIFO so the warmest connection is reused and cold ones age out
+        self._idle = collections.deque()
+        self._cond = threading.Condition()
+        self._size = 0
+        self._in_use = 0
+
+        self.wait_time = Histogram("db_pool_wait_seconds", "Time spent waiting to borrow a connection")
+        self.connect_time = Histogram("db_connect_seconds", "Time spent opening new connections")
+        self.query_time = Histogram("db_query_seconds", "Time spent executing statements")
+        self.created_total = 0
+        self.recycled_total = 0
+        self.health_failures_total = 0
+        self.timeouts_total = 0
+        self.queries_total = 0
+        self._queries_lock = threading.Lock()
+
+    def _count_query(self):
+        with self._queries_lock:
+            self.queries_total += 1
+
+    def connection(self):
+        """
+        Borrow a connection from the pool
+
+        Returns:
+            PooledConnection: Call close() (or use as a context manager) to return it
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+        entry = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # Reserve a slot; the connection is opened outside the lock
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts_total += 1
+                    raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                self._cond.wait(remaining)
+            self._in_use += 1
+        self.wait_time.observe(time.monotonic() - start)
+
+        try:
+            entry = self._checkout(entry)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, entry)
+
+    def _checkout(self, entry):
+        if entry is None:
+            return self._open()
+
+        now = time.monotonic()
+        if now - entry.created_at > self.recycle:
+            self.recycled_total += 1
+            self._close_raw(entry.raw)
+            return self._open()
+
+        if now - entry.last_used > self.ping_interval and not self._is_healthy(entry.raw):
+            self.health_failures_total += 1
+            logger.warning("Discarding unhealthy pooled database connection")
+            self._close_raw(entry.raw)
+            return self._open()
+        return entry
+
+    def _open(self):
+        start = time.monotonic()
+        raw = self._connect()
+        self.connect_time.observe(time.monotonic() - start)
+        self.created_total += 1
+        return _Entry(raw)
+
+    def _release(self, entry):
+        discard = False
+        try:
+            # End any open transaction so the next borrower does not see a stale snapshot
+            entry.raw.rollback()
+        except Exception as e:
+            logger.warning("Discarding pooled connection after failed rollback: %s", e)
+            discard = True
+
+        entry.last_used = time.monotonic()
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append(entry)
+            self._cond.notify()
+        if discard:
+            self._close_raw(entry.raw)
+
+    @staticmethod
+    def _is_healthy(raw):
+        try:
+            if hasattr(raw, "ping"):
+                raw.ping()
+            else:
+                cursor = raw.cursor()
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+                cursor.close()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_raw(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        """Close every idle connection; borrowed ones are closed when returned"""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+        for entry in idle:
+            self._close_raw(entry.raw)
+
+    def stats(self):
+        """Return a snapshot of pool utilisation and wait-time metrics"""
+        with self._cond:
+            size, idle, in_use = self._size, len(self._idle), self._in_use
+        return {
+            "max_size": self.max_size,
+            "open": size,
+            "idle": idle,
+            "in_use": in_use,
+            "utilisation": in_use / self.max_size if self.max_size else 0.0,
+            "wait_p50_seconds": self.wait_time.percentile(50),
+            "wait_p99_seconds": self.wait_time.percentile(99),
+            "created_total": self.created_total,
+            "recycled_total": self.recycled_total,
+            "health_failures_total": self.health_failures_total,
+            "timeouts_total": self.timeouts_total,
+            "queries_total": self.queries_total,
+        }
+
+
+def create_pool(db_config):
+    """
+    Build a connection pool from the backend's db_config and environment
+
+    Setting AUTHSHIELD_DB_URL=sqlite:///path/to.db switches to the SQLite
+    stand-in so the backend can run without a MySQL/MariaDB server.
+    """
+    db_url = os.getenv("AUTHSHIELD_DB_URL", "")
+    if db_url.startswith("sqlite:///"):
+        import sqlite_standin
+
+        path = db_url[len("sqlite:///"):]
+        sqlite_standin.bootstrap(path)
+
+        def connect():
+            return sqlite_standin.connect(path)
+    else:
+        def connect():
+            # Imported on the first connection, not when the app module loads
+            import mysql.connector
+
+            return mysql.connector.connect(**db_config)
+
+    return ConnectionPool(
+        connect,
+        max_size=int(os.getenv("DB_POOL_SIZE", "10")),
+        timeout=float(os.getenv("DB_POOL_TIMEOUT", "5")),
+        recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        ping_interval=int(os.getenv("DB_POOL_PING_INTERVAL", "30")),
+    )
@@ -0,0 +1,274 @@
+"""
+Client for the QR decrypt service (/decrypt-url).
+
+Keeps pooled keep-alive connections, bounds every call with connect/read
+timeouts, retries transient failures with jittered exponential backoff and
+fails fast through a circuit breaker while the service is down. The async
+variant needs aiohttp and is only imported by the async server mode.
+"""
+import json
+import logging
+import random
+import threading
+import time
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Gateway errors are worth retrying; anything else is the service's final answer
+RETRYABLE_STATUS = (502, 503, 504)
+
+
+class DecryptServiceError(Exception):
+    """The decrypt service could not be reached, or every retry failed"""
+
+
+class CircuitOpenError(DecryptServiceError):
+    """The circuit breaker is open and the call was not attempted"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Decrypt service circuit open, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        """
+        Consecutive-failure circuit breaker
+
+        Args:
+            failure_threshold (int): Failed calls in a row that open the circuit
+            reset_timeout (float): Seconds the circuit stays open before a trial call
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._clock() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError unless a call may go through
+
+        Returns:
+            bool: True if this call is the half-open trial; the caller must then
+                call end_trial() once it finishes, however it finishes
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            elapsed = self._clock() - self._opened_at
+            if elapsed < self.reset_timeout or self._trial_in_flight:
+                raise CircuitOpenError(max(0.0, self.reset_timeout - elapsed))
+            # Half-open: let exactly one trial call through
+            self._trial_in_flight = True
+            return True
+
+    def end_trial(self):
+        """Let the next trial through; a trial cancelled or failed unexpectedly records neither outcome"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning("Decrypt service circuit opened")
+                self._opened_at = self._clock()
+
+
+def _backoff(attempt, base):
+    # Full jitter: spreads retries from many workers instead of synchronising them
+    return random.uniform(0, base * (2 ** attempt))
+
+
+class DecryptClient:
+    def __init__(self, base_url, connect_timeout=2.0, read_timeout=5.0, retries=2,
+                 backoff=0.2, pool_size=10, breaker=None):
+        """
+        Args:
+            base_url (str): Root URL of the decrypt service, e.g. http://host:5001
+            connect_timeout (float): Seconds to establish the TCP connection
+            read_timeout (float): Seconds to wait for the response
+            retries (int): Extra attempts after a transient failure
+            backoff (float): Base delay in seconds for jittered exponential backoff
+            pool_size (int): Keep-alive connections kept per host
+            breaker (CircuitBreaker): Shared breaker (default: a new one)
+        """
+        self.url = base_url.rstrip("/") + "/decrypt-url"
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.call_time = Histogram("decrypt_request_seconds", "Latency of each call to the decrypt service")
+        self.pool_size = pool_size
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        # requests is imported with the first call, so workers that never scan skip it
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    def decrypt_url(self, user_uuid, encrypted_url):
+        """
+        Ask the service to decrypt a QR payload
+
+        Returns:
+            requests.Response: The service's response (any non-retryable status)
+
+        Raises:
+            CircuitOpenError: The service is known to be down
+            DecryptServiceError: Every attempt failed with a transient error,
+                or the request itself was invalid
+        """
+        trial = self.breaker.before_call()
+        try:
+            return self._post_with_retries({"uuid": user_uuid, "encrypted_url": str(encrypted_url)})
+        finally:
+            if trial:
+                self.breaker.end_trial()
+
+    def _post_with_retries(self, payload):
+        import requests
+
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(_backoff(attempt - 1, self.backoff))
+            start = time.perf_counter()
+            try:
+                response = self.session.post(self.url, json=payload, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = e
+                continue
+            except requests.RequestException as e:
+                self.breaker.record_failure()
+                raise DecryptServiceError(f"Decrypt request failed: {e}") from e
+            finally:
+                self.call_time.observe(time.perf_counter() - start)
+            if response.status_code in RETRYABLE_STATUS:
+                last_error = DecryptServiceError(f"Decrypt service returned {response.status_code}")
+                continue
+            self.breaker.record_success()
+            return response
+
+        self.breaker.record_failure()
+        raise DecryptServiceError(f"Decrypt service unavailable: {last_error}")
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+
+class AsyncDecryptResponse:
+    """Mirror of the parts of requests.Response the routes use"""
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class AsyncDecryptClient:
+    def __init__(self, base_url, connect_timeout=2.0, read_timeout=5.0, retries=2,
+                 backoff=0.2, pool_size=100, breaker=None):
+        """Async variant of DecryptClient for the ASGI server; same arguments"""
+        self.url = base_url.rstrip("/") + "/decrypt-url"
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.breaker = breaker or CircuitBreaker()
+        self.call_time = Histogram("decrypt_request_seconds", "Latency of each call to the decrypt service")
+        self._session = None
+
+    async def _get_session(self):
+        if self._session is None:
+            import aiohttp
+
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=30),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout),
+            )
+        return self._session
+
+    async def decrypt_url(self, user_uuid, encrypted_url):
+        """Async equivalent of DecryptClient.decrypt_url(), returning AsyncDecryptResponse"""
+        trial = self.breaker.before_call()
+        try:
+            return await self._post_with_retries({"uuid": user_uuid, "encrypted_url": str(encrypted_url)})
+        finally:
+            # Also on CancelledError, e.g. the client disconnected mid-trial
+            if trial:
+                self.breaker.end_trial()
+
+    async def _post_with_retries(self, payload):
+        import asyncio
+        import aiohttp
+
+        session = await self._get_session()
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(_backoff(attempt - 1, self.backoff))
+            start = time.perf_counter()
+            try:
+                async with session.post(self.url, json=payload) as response:
+                    # Like requests' .text, never raises on a bad charset
+                    text = await response.text(errors="replace")
+                    status = response.status
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                last_error = e
+                continue
+            except aiohttp.ClientError as e:
+                self.breaker.record_failure()
+                raise DecryptServiceError(f"Decrypt request failed: {e}") from e
+            finally:
+                self.call_time.observe(time.perf_counter() - start)
+            if status in RETRYABLE_STATUS:
+                last_error = DecryptServiceError(f"Decrypt service returned {status}")
+                continue
+            self.breaker.record_success()
+            return AsyncDecryptResponse(status, text)
+
+        self.breaker.record_failure()
+        raise DecryptServiceError(f"Decrypt service unavailable: {last_error}")
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
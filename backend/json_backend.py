@@ -0,0 +1,136 @@
+"""
+Response encoding for the Flask app: a fast JSON provider, compact bodies for
+the polling routes and gzip for the larger lists.
+
+install_json_provider() registers OrjsonProvider when orjson is importable,
+so jsonify() and request.get_json() serialize in C. The output is the same
+JSON as the stdlib provider, except that non-ASCII text is sent as UTF-8
+instead of \\u escapes. JSON_BACKEND=stdlib keeps Flask's default provider.
+
+Polling clients opt into compact bodies with the standard RFC 7240 header
+`Prefer: return=minimal`. The routes then leave out fields the client
+already has or never reads, such as the constant "message".
+
+    JSON_BACKEND=auto|orjson|stdlib  GZIP_MIN_BYTES=512
+"""
+import gzip
+import logging
+import os
+from functools import wraps
+
+from flask import make_response, request
+from flask.json.provider import DefaultJSONProvider
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib provider
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """DefaultJSONProvider that serializes through orjson"""
+
+    def _options(self, indent=False):
+        # Dates, dataclasses and the like go through Flask's default() so they
+        # are rendered exactly as the stdlib provider renders them
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # json.dumps-only arguments (separators, cls, ...) keep their exact meaning
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        # Bytes go straight into the body, skipping the str round trip and the trailing newline
+        body = orjson.dumps(obj, default=self.default, option=self._options(indent))
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def install_json_provider(app, backend=None):
+    """
+    Register the JSON provider selected by backend or JSON_BACKEND
+
+    Args:
+        backend (str): "auto" (orjson if installed), "orjson" or "stdlib"
+
+    Returns:
+        str: The backend in use
+    """
+    backend = (backend or os.getenv("JSON_BACKEND", "auto")).lower()
+    if backend == "stdlib":
+        return "stdlib"
+    if orjson is None:
+        if backend == "orjson":
+            logger.warning("JSON_BACKEND=orjson but orjson is not installed; using the stdlib encoder")
+        return "stdlib"
+    app.json = OrjsonProvider(app)
+    return "orjson"
+
+
+def wants_compact():
+    """True when the client sent Prefer: return=minimal"""
+    return any(
+        preference.strip().lower() == "return=minimal"
+        for header in request.headers.getlist("Prefer")
+        for preference in header.split(",")
+    )
+
+
+def gzip_response(min_size=None, level=6):
+    """
+    Gzip the view's response when the client accepts it and it is worth it
+
+    Only successful, non-streamed bodies of at least min_size bytes are
+    compressed; the tiny polling bodies would only grow.
+
+    Args:
+        min_size (int): Smallest body to compress (default: GZIP_MIN_BYTES or 512)
+        level (int): zlib compression level
+    """
+    if min_size is None:
+        min_size = int(os.getenv("GZIP_MIN_BYTES", "512"))
+
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            response = make_response(f(*args, **kwargs))
+            response.vary.add("Accept-Encoding")
+            if not request.accept_encodings["gzip"]:
+                return response
+            # The view's ETag covers the content, not the encoding: gzip and identity
+            # bodies are only weakly equal, so clients that may get gzip see a weak
+            # ETag, on the 304 too. If-None-Match still matches it (weak comparison);
+            # If-Range, which needs a strong one, falls back to the full body.
+            etag, weak = response.get_etag()
+            if etag and not weak and response.status_code in (200, 304):
+                response.set_etag(etag, weak=True)
+            if (
+                response.status_code != 200
+                or response.direct_passthrough
+                or response.is_streamed
+                or "Content-Encoding" in response.headers
+            ):
+                return response
+            body = response.get_data()
+            if len(body) < min_size:
+                return response
+            response.set_data(gzip.compress(body, compresslevel=level, mtime=0))
+            response.headers["Content-Encoding"] = "gzip"
+            return response
+        return decorated
+    return decorator
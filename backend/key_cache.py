@@ -0,0 +1,97 @@
+import hashlib
+import sys
+
+from alphanumeric_totp import prepare_key
+from ttl_cache import TTLCache
+
+
+def fingerprint(secret):
+    """Stable cache key for a secret that does not keep the plaintext around"""
+    return hashlib.sha256(secret.upper().encode("utf-8")).digest()
+
+
+def _prepared_size(prepared):
+    # Python objects plus the OpenSSL context behind each hash state (estimate)
+    inner, outer = prepared
+    return sys.getsizeof(prepared) + sys.getsizeof(inner) + sys.getsizeof(outer) + 2 * (inner.block_size + 128)
+
+
+class KeyCache:
+    def __init__(self, max_bytes=4 * 1024 * 1024, ttl=3600, digest=hashlib.sha1):
+        """
+        Bounded cache of decoded, pre-keyed HMAC states per secret
+
+        Pass it as `keys` to generate_batch() so repeated code requests skip the
+        base32 decode and the HMAC key schedule. Entries are keyed by a SHA-256
+        fingerprint of the secret rather than the secret itself.
+
+        Args:
+            max_bytes (int): Approximate memory cap; least recently used keys are evicted
+            ttl (float): Seconds before a prepared key is rebuilt
+            digest: Hash function the prepared states are keyed for
+        """
+        self.digest = digest
+        self._cache = TTLCache(max_bytes=max_bytes, ttl=ttl, sizeof=_prepared_size)
+
+    def get(self, secret, default=None):
+        return self._cache.get(fingerprint(secret), default)
+
+    def __setitem__(self, secret, prepared):
+        self._cache.set(fingerprint(secret), prepared)
+
+    def prepare(self, secret):
+        """Return the prepared key for a secret, building and caching it on a miss"""
+        prepared = self.get(secret)
+        if prepared is None:
+            prepared = prepare_key(secret, self.digest)
+            self[secret] = prepared
+        return prepared
+
+    def invalidate(self, secret):
+        """Drop a secret's prepared key, e.g. when /scan re-enrolls its user_uuid"""
+        return self._cache.pop(fingerprint(secret))
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class BulkKeys:
+    def __init__(self):
+        """
+        Prepared keys for passes over every enrolled secret, such as the scheduler tick
+
+        A tick touches each secret once, so running it through KeyCache only
+        cycles the whole population through the LRU: once there are more
+        secrets than fit, every lookup misses and the keys the per-user routes
+        keep hot are evicted. These keys live in a plain dict instead, keyed by
+        fingerprint like KeyCache and carried from one pass to the next. Each
+        new pass drops the keys the previous pass did not look up, so memory
+        follows the enrolled count.
+        """
+        self._keys = {}
+        self._seen = set()
+
+    def next_pass(self):
+        """
+        Start a pass and return the mapping to pass to generate_batch()
+
+        Missing keys are added by generate_batch() and reused on the next pass.
+        """
+        keys = self._keys
+        self._keys = {key: keys[key] for key in self._seen if key in keys}
+        self._seen = set()
+        return self
+
+    def get(self, secret, default=None):
+        key = fingerprint(secret)
+        self._seen.add(key)
+        return self._keys.get(key, default)
+
+    def __setitem__(self, secret, prepared):
+        self._keys[fingerprint(secret)] = prepared
+
+    def __len__(self):
+        return len(self._keys)
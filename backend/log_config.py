@@ -0,0 +1,196 @@
+"""
+Non-blocking, structured logging for the backend.
+
+configure_logging() puts a DeferredQueueHandler on the root logger, so a
+request thread only enqueues the record and a QueueListener thread formats and
+writes it. Records below the level are never formatted, and routes polled once a
+second are sampled. Everything that reaches the output is JSON, with TOTP
+secrets, codes, passwords and QR payloads masked.
+
+    LOG_LEVEL=INFO LOG_FORMAT=json LOG_SAMPLE_RATES="/get-updated-totp=0.01,/update-totp=0.01"
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+# Polling routes log an INFO line per request; keep a slice of them by default
+DEFAULT_SAMPLE_RATES = {
+    "/get-updated-totp": 0.01,
+    "/update-totp": 0.01,
+    "/generateTotp": 0.01,
+    "/get-codes": 0.01,
+}
+
+REDACTED = "[REDACTED]"
+
+# Fields whose values are never written: secrets, OTP codes, passwords and the QR payload
+_SENSITIVE_KEYS = r"totp_secret|secret|next_code|code|password|confirm_password|encrypted_url|decrypted_url"
+_REDACTIONS = (
+    # secret=... in otpauth:// URLs and query strings
+    (re.compile(r"(secret=)[^&\s'\"]+", re.IGNORECASE), r"\1" + REDACTED),
+    # 'key': 'value' / "key": "value" in logged dicts and JSON
+    (re.compile(r"""(['"](?:%s)['"]\s*:\s*)(['"])[^'"]*\2""" % _SENSITIVE_KEYS, re.IGNORECASE),
+     r"\1\2" + REDACTED + r"\2"),
+    # key=value in free text
+    (re.compile(r"\b((?:%s)\s*[=:]\s*)[A-Za-z0-9+/=]{4,}" % _SENSITIVE_KEYS, re.IGNORECASE), r"\1" + REDACTED),
+)
+
+
+def redact(text):
+    """Mask secrets, codes and passwords in a formatted log message"""
+    for pattern, replacement in _REDACTIONS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def parse_sample_rates(value):
+    """Parse "route=rate,route=rate" into a dict, e.g. from LOG_SAMPLE_RATES"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        route, _, rate = item.partition("=")
+        try:
+            rates[route.strip()] = max(0.0, min(1.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates, random_fn=random.random):
+        """
+        Drop a share of INFO and DEBUG records per request route
+
+        Warnings and errors always pass. Runs on the request thread, before the
+        record is formatted or queued, so dropped records cost almost nothing.
+        Also tags every record with its route.
+
+        Args:
+            rates (dict): Request path -> share of records to keep (0.0-1.0)
+        """
+        super().__init__()
+        self.rates = dict(rates)
+        self._random = random_fn
+
+    def filter(self, record):
+        # Captured here because the listener thread has no request context
+        route = _current_route()
+        if route is None:
+            return True
+        record.route = route
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(route)
+        return rate is None or self._random() < rate
+
+
+def _current_route():
+    # Whichever framework is already loaded; never imports one just to log
+    for name in ("flask", "quart"):
+        framework = sys.modules.get(name)
+        if framework is not None and framework.has_request_context():
+            return framework.request.path
+    return None
+
+
+# Argument types that cannot change between the log call and the listener formatting it
+_IMMUTABLE_ARGS = (str, int, float, bool, bytes, type(None))
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves all formatting to the listener thread
+
+    The stock prepare() calls self.format() on the emitting thread, so every
+    queued record was still merged, redacted and JSON-encoded by the request
+    thread. Here the record is queued as-is: the queue never leaves the
+    process, so exc_info and args do not need to be pickled. Only args that
+    could be mutated before the listener gets to them are merged into the
+    message up front.
+    """
+
+    def prepare(self, record):
+        args = record.args
+        if args and not (isinstance(args, tuple) and all(isinstance(arg, _IMMUTABLE_ARGS) for arg in args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the message redacted"""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact(record.getMessage()),
+        }
+        route = getattr(record, "route", None)
+        if route:
+            entry["route"] = route
+        if record.exc_info:
+            entry["exc"] = redact(self.formatException(record.exc_info))
+        return json.dumps(entry, default=str)
+
+
+class RedactingFormatter(logging.Formatter):
+    """Plain-text formatter for local development, with the same redaction"""
+
+    def format(self, record):
+        return redact(super().format(record))
+
+
+def configure_logging(level=None, fmt=None, sample_rates=None, stream=None):
+    """
+    Route all logging through a background queue listener
+
+    Args:
+        level (str): Root level (default: LOG_LEVEL or INFO)
+        fmt (str): "json" or "text" (default: LOG_FORMAT or json)
+        sample_rates (dict): Per-route INFO sampling (default: LOG_SAMPLE_RATES
+            or DEFAULT_SAMPLE_RATES)
+        stream: Output stream (default: stderr)
+
+    Returns:
+        QueueListener: Already started; stopped automatically at exit
+    """
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    fmt = fmt or os.getenv("LOG_FORMAT", "json")
+    if sample_rates is None:
+        sample_rates = (parse_sample_rates(os.environ["LOG_SAMPLE_RATES"])
+                        if "LOG_SAMPLE_RATES" in os.environ else DEFAULT_SAMPLE_RATES)
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    if fmt == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(RedactingFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    # The listener thread does not survive fork(), so pre-forked workers start their own
+    os.register_at_fork(after_in_child=lambda: _restart(listener))
+    return listener
+
+
+def _restart(listener):
+    listener._thread = None
+    listener.start()
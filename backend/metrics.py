@@ -0,0 +1,210 @@
+import bisect
+import threading
+
+# Latency buckets in seconds, from sub-millisecond cache hits up to slow bcrypt/DB calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, name, description="", buckets=DEFAULT_BUCKETS):
+        """
+        Thread-safe cumulative histogram
+
+        Args:
+            name (str): Metric name
+            description (str): Human readable help text
+            buckets (tuple): Sorted upper bounds of the buckets
+        """
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Record a single observation"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self):
+        """Return count, sum and cumulative bucket counts"""
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        cumulative = []
+        running = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            running += bucket_count
+            cumulative.append((bound, running))
+        return {"count": count, "sum": total, "buckets": cumulative}
+
+    def percentile(self, q):
+        """
+        Estimate the q-th percentile (0-100) from the bucket upper bounds
+
+        Returns:
+            float: Upper bound of the bucket holding the percentile, 0.0 if empty
+        """
+        snap = self.snapshot()
+        if not snap["count"]:
+            return 0.0
+        target = snap["count"] * q / 100.0
+        for bound, running in snap["buckets"]:
+            if running >= target:
+                return bound if bound != float("inf") else self.buckets[-1]
+        return self.buckets[-1]
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _histogram_lines(name, histogram, labels=()):
+    snap = histogram.snapshot()
+    lines = [
+        f"{name}_bucket{_format_labels(labels + (('le', _format_value(float(bound))),))} {running}"
+        for bound, running in snap["buckets"]
+    ]
+    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(snap['sum'])}")
+    lines.append(f"{name}_count{_format_labels(labels)} {snap['count']}")
+    return lines
+
+
+class HistogramFamily:
+    def __init__(self, name, description="", label_names=(), buckets=DEFAULT_BUCKETS):
+        """
+        Histograms sharing a name, one per combination of label values
+
+        Args:
+            name (str): Metric name
+            description (str): Human readable help text
+            label_names (tuple): Names of the labels, e.g. ("route", "method")
+            buckets (tuple): Sorted upper bounds shared by every child
+        """
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Return the child Histogram for these label values, creating it on first use"""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = Histogram(self.name, self.description, self.buckets)
+        return child
+
+    def children(self):
+        with self._lock:
+            return dict(self._children)
+
+
+class Counter:
+    def __init__(self, name, description="", fn=None):
+        """
+        Monotonic counter
+
+        Args:
+            fn (callable): Optional zero-argument callable read at scrape time,
+                for totals another object already keeps
+        """
+        self.name = name
+        self.description = description
+        self._fn = fn
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._fn() if self._fn is not None else self._value
+
+
+class Gauge:
+    def __init__(self, name, description="", fn=None):
+        """
+        Value that can go up and down
+
+        Args:
+            fn (callable): Optional zero-argument callable read at scrape time
+        """
+        self.name = name
+        self.description = description
+        self._fn = fn
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    @property
+    def value(self):
+        return self._fn() if self._fn is not None else self._value
+
+
+class Registry:
+    """Collection of metrics rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a Histogram, HistogramFamily, Counter or Gauge; returns it for chaining"""
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            if metric.description:
+                lines.append(f"# HELP {metric.name} {metric.description}")
+            if isinstance(metric, Histogram):
+                lines.append(f"# TYPE {metric.name} histogram")
+                lines.extend(_histogram_lines(metric.name, metric))
+            elif isinstance(metric, HistogramFamily):
+                lines.append(f"# TYPE {metric.name} histogram")
+                for values, child in sorted(metric.children().items()):
+                    lines.extend(_histogram_lines(metric.name, child, tuple(zip(metric.label_names, values))))
+            else:
+                kind = "counter" if isinstance(metric, Counter) else "gauge"
+                try:
+                    value = metric.value
+                except Exception:
+                    continue
+                lines.append(f"# TYPE {metric.name} {kind}")
+                lines.append(f"{metric.name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry served by /metrics
+REGISTRY = Registry()
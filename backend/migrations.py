@@ -0,0 +1,240 @@
+"""
+Versioned schema migrations for the AuthShield MySQL database.
+
+Each migration runs once and is recorded in schema_migrations. The indexes
+match the hot access paths of the routes: user_totp by account, by
+(uid, 2faenabled) and by user_uuid, and AppUsers by email. check_query_plans()
+EXPLAINs those queries and warns when one would scan a whole table.
+
+    python migrations.py            # apply pending migrations, then check plans
+    python migrations.py --check    # only check plans
+"""
+import argparse
+import logging
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_EMAILS_QUERY = "SELECT email, COUNT(*) FROM AppUsers GROUP BY email HAVING COUNT(*) > 1"
+
+
+class MigrationError(Exception):
+    """A migration cannot be applied to the data as it stands; nothing of it was applied"""
+
+
+def _index_exists(cursor, table, index):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1",
+        (table, index),
+    )
+    return cursor.fetchone() is not None
+
+
+def _create_index(cursor, table, index, definition):
+    # MySQL has no CREATE INDEX IF NOT EXISTS
+    if not _index_exists(cursor, table, index):
+        cursor.execute(f"CREATE {definition}")
+        logger.info("Created index %s on %s", index, table)
+
+
+def _create_tables(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS AppUsers (
+            uid INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            email VARCHAR(255) NOT NULL,
+            password VARCHAR(255) NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_totp (
+            user_uuid VARCHAR(64) NOT NULL PRIMARY KEY,
+            totp_secret VARCHAR(255) NOT NULL,
+            account VARCHAR(255),
+            uid INT,
+            next_code VARCHAR(16),
+            `2faenabled` TINYINT(1) NOT NULL DEFAULT 1
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+
+
+def _check_unique_emails(cursor):
+    # Grouped with the column's collation, so these are exactly the rows the unique index would refuse
+    cursor.execute(DUPLICATE_EMAILS_QUERY)
+    duplicates = cursor.fetchall()
+    if duplicates:
+        raise MigrationError(
+            f"{len(duplicates)} email addresses belong to more than one AppUsers row "
+            f"({sum(count for _, count in duplicates)} rows). Merge or remove them, then run the "
+            f"migration again; list them with: {DUPLICATE_EMAILS_QUERY}"
+        )
+
+
+def _hot_path_indexes(cursor):
+    # Login and signup look users up by email; unique also makes signup race-free.
+    # Duplicates already in the table would make CREATE UNIQUE INDEX fail halfway
+    # through the migration, so they are reported first and nothing is created.
+    if not _index_exists(cursor, "AppUsers", "uq_appusers_email"):
+        _check_unique_emails(cursor)
+    _create_index(cursor, "AppUsers", "uq_appusers_email",
+                  "UNIQUE INDEX uq_appusers_email ON AppUsers (email)")
+    # /generateTotp, /update-totp, /get-updated-totp and /unenroll: covering for secret + owner
+    _create_index(cursor, "user_totp", "idx_user_totp_account",
+                  "INDEX idx_user_totp_account ON user_totp (account, uid, totp_secret)")
+    # /get-totp-data, /get-codes and /stream-codes: covering for the enrolled accounts list
+    _create_index(cursor, "user_totp", "idx_user_totp_uid_enabled",
+                  "INDEX idx_user_totp_uid_enabled ON user_totp "
+                  "(uid, `2faenabled`, account, totp_secret, next_code)")
+
+
+def _scheduler_leases(cursor):
+    # Shard ownership for the multi-node TOTP scheduler (see shard_leases.py)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS scheduler_leases (
+            shard INT NOT NULL PRIMARY KEY,
+            owner VARCHAR(128),
+            expires_at DOUBLE NOT NULL DEFAULT 0
+        ) ENGINE=InnoDB
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS scheduler_nodes (
+            node_id VARCHAR(128) NOT NULL PRIMARY KEY,
+            expires_at DOUBLE NOT NULL
+        ) ENGINE=InnoDB
+        """
+    )
+
+
+MIGRATIONS = [
+    (1, "create_tables", _create_tables),
+    (2, "hot_path_indexes", _hot_path_indexes),
+    (3, "scheduler_leases", _scheduler_leases),
+]
+
+# Adds uq_appusers_email, which signup relies on to reject duplicate emails
+UNIQUE_EMAIL_VERSION = 2
+
+# (name, query, sample parameters) for every query on a request path
+HOT_QUERIES = [
+    ("login", "SELECT uid, password FROM AppUsers WHERE email = %s", ("probe@example.com",)),
+    ("account_secret", "SELECT totp_secret, uid FROM user_totp WHERE account = %s AND uid = %s", ("probe", 0)),
+    ("account_owner", "SELECT user_uuid, totp_secret FROM user_totp WHERE account = %s AND uid = %s", ("probe", 0)),
+    ("enrolled_accounts",
+     "SELECT account, user_uuid, `2faenabled`, totp_secret FROM user_totp WHERE uid = %s AND `2faenabled` = 1",
+     (0,)),
+    ("next_code_update", "SELECT next_code FROM user_totp WHERE user_uuid = %s", ("probe",)),
+]
+
+
+def migrate(conn):
+    """
+    Apply every pending migration in version order
+
+    Returns:
+        list: Versions applied by this call
+
+    Raises:
+        MigrationError: A migration cannot be applied to the existing data;
+            the migrations before it stay applied
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT NOT NULL PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        cursor.execute("SELECT version FROM schema_migrations")
+        applied = {row[0] for row in cursor.fetchall()}
+
+        newly_applied = []
+        for version, name, apply in MIGRATIONS:
+            if version in applied:
+                continue
+            logger.info("Applying migration %03d_%s", version, name)
+            apply(cursor)
+            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            conn.commit()
+            newly_applied.append(version)
+        return newly_applied
+    finally:
+        cursor.close()
+
+
+def is_applied(cursor, version):
+    """True once a migration is recorded; False too when schema_migrations does not exist yet"""
+    try:
+        cursor.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (version,))
+        return cursor.fetchone() is not None
+    except Exception as e:
+        logger.debug("Could not read schema_migrations: %s", e)
+        return False
+
+
+def check_query_plans(conn):
+    """
+    EXPLAIN every hot query and warn about full table scans
+
+    Returns:
+        dict: Query name -> list of problems (empty when the plan uses an index)
+    """
+    report = {}
+    cursor = conn.cursor()
+    try:
+        for name, query, params in HOT_QUERIES:
+            problems = []
+            try:
+                cursor.execute("EXPLAIN " + query, params)
+                columns = [column[0] for column in cursor.description]
+                rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            except Exception as e:
+                logger.warning("Could not EXPLAIN %s: %s", name, e)
+                continue
+            for row in rows:
+                if row.get("type") == "ALL":
+                    problems.append(f"full scan of {row.get('table')}")
+                elif row.get("key") is None and row.get("table"):
+                    problems.append(f"no index used on {row.get('table')}")
+            if problems:
+                logger.warning("Hot query %s is not index-backed: %s", name, ', '.join(problems))
+            report[name] = problems
+    finally:
+        cursor.close()
+    return report
+
+
+def main():
+    import mysql.connector
+    from authshield_server import db_config
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--check", action="store_true", help="Only EXPLAIN the hot queries")
+    args = parser.parse_args()
+
+    conn = mysql.connector.connect(**db_config)
+    try:
+        if not args.check:
+            try:
+                applied = migrate(conn)
+            except MigrationError as e:
+                logger.error("Migration failed: %s", e)
+                raise SystemExit(1)
+            logger.info("Applied migrations: %s", applied or 'none pending')
+        check_query_plans(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
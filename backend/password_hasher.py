@@ -0,0 +1,138 @@
+"""
+Bounded worker pool for bcrypt hashing and verification.
+
+bcrypt is deliberately slow, so /signup and /login hand it to a small pool
+instead of running it on the request thread. bcrypt releases the GIL while
+hashing, so threads give real parallelism without a process pool. When the
+pool and its queue are full, callers get PoolBusy straight away, and the route
+answers 503 with Retry-After instead of letting logins starve every worker.
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class PoolBusy(Exception):
+    """The hashing pool and its queue are full"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Password hashing pool is busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def hash_rounds(hashed):
+    """Cost factor encoded in a bcrypt hash such as $2b$12$..."""
+    try:
+        return int(hashed.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    def __init__(self, rounds=12, workers=4, queue_depth=16, retry_after=1, timeout=30.0):
+        """
+        Args:
+            rounds (int): bcrypt cost factor for new hashes
+            workers (int): Threads hashing concurrently
+            queue_depth (int): Jobs allowed to wait for a free thread before PoolBusy
+            retry_after (int): Seconds suggested to clients rejected with PoolBusy
+            timeout (float): Seconds a request waits for its job before giving up
+        """
+        self.rounds = rounds
+        self.retry_after = retry_after
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self._lock = threading.Lock()
+
+        self.queue_time = Histogram("bcrypt_queue_seconds", "Time a hashing job waited for a worker")
+        self.hash_time = Histogram("bcrypt_hash_seconds", "Time spent inside bcrypt")
+        self.rejected_total = 0
+
+    def _submit(self, fn, *args, then=None):
+        # then(result) runs on the worker after fn, outside hash_time, e.g. a DB write
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected_total += 1
+            raise PoolBusy(self.retry_after)
+        enqueued = time.perf_counter()
+
+        def run():
+            started = time.perf_counter()
+            self.queue_time.observe(started - enqueued)
+            try:
+                try:
+                    result = fn(*args)
+                finally:
+                    self.hash_time.observe(time.perf_counter() - started)
+                return result if then is None else then(result)
+            finally:
+                self._slots.release()
+
+        try:
+            return self._executor.submit(run)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def hash(self, password):
+        """Hash a password at the configured cost; returns the hash as str"""
+        future = self._submit(bcrypt.hashpw, password.encode("utf-8"), bcrypt.gensalt(self.rounds))
+        return future.result(timeout=self.timeout).decode("utf-8")
+
+    def check(self, password, hashed):
+        """Verify a password against a stored bcrypt hash"""
+        future = self._submit(bcrypt.checkpw, password.encode("utf-8"), hashed.encode("utf-8"))
+        return future.result(timeout=self.timeout)
+
+    async def hash_async(self, password):
+        """hash() for the ASGI server: awaits the worker instead of blocking the event loop"""
+        future = self._submit(bcrypt.hashpw, password.encode("utf-8"), bcrypt.gensalt(self.rounds))
+        hashed = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        return hashed.decode("utf-8")
+
+    async def check_async(self, password, hashed):
+        """check() for the ASGI server"""
+        future = self._submit(bcrypt.checkpw, password.encode("utf-8"), hashed.encode("utf-8"))
+        return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+
+    def needs_rehash(self, hashed):
+        return hash_rounds(hashed) != self.rounds
+
+    def rehash_in_background(self, password, on_hashed):
+        """
+        Re-hash at the current cost without blocking the caller
+
+        Skipped silently when the pool is busy; the upgrade is retried on the next login.
+
+        Args:
+            on_hashed (callable): Receives the new hash str once computed
+        """
+        def store(new_hash):
+            try:
+                on_hashed(new_hash.decode("utf-8"))
+            except Exception as e:
+                logger.error("Password hash upgrade failed: %s", e)
+
+        try:
+            self._submit(bcrypt.hashpw, password.encode("utf-8"), bcrypt.gensalt(self.rounds), then=store)
+        except PoolBusy:
+            pass
+
+    def stats(self):
+        return {
+            "rounds": self.rounds,
+            "rejected_total": self.rejected_total,
+            "queue_p50_seconds": self.queue_time.percentile(50),
+            "queue_p99_seconds": self.queue_time.percentile(99),
+            "hash_p50_seconds": self.hash_time.percentile(50),
+            "hash_p99_seconds": self.hash_time.percentile(99),
+        }
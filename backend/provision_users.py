@@ -0,0 +1,104 @@
+"""
+Bulk user provisioning for onboarding many AppUsers accounts at once.
+
+Reads email,password rows from a CSV file (or stdin), hashes each batch in
+parallel on a thread pool and writes it with a single executemany INSERT.
+Batches are streamed, so memory stays flat however many rows the file has.
+Emails that already exist are left untouched.
+
+    python provision_users.py users.csv --batch-size 500 --workers 8
+"""
+import argparse
+import csv
+import itertools
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+logger = logging.getLogger(__name__)
+
+INSERT_USERS = (
+    "INSERT INTO AppUsers(email, password) VALUES (%s, %s) "
+    "ON DUPLICATE KEY UPDATE email = email"
+)
+
+
+def _batches(rows, size):
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def provision_users(rows, get_connection, rounds=12, batch_size=500, workers=4):
+    """
+    Create users from (email, password) pairs
+
+    Args:
+        rows (iterable): (email, password) pairs; consumed lazily
+        get_connection (callable): Returns a DB-API connection (e.g. a pooled one)
+        rounds (int): bcrypt cost factor
+        batch_size (int): Rows hashed and inserted per transaction
+        workers (int): Threads hashing in parallel; bcrypt releases the GIL
+
+    Returns:
+        dict: Counts of rows read and inserted, and elapsed seconds
+    """
+    def hash_row(row):
+        email, password = row
+        return email.strip(), bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+    read = inserted = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="provision") as executor:
+        for batch in _batches(rows, batch_size):
+            hashed = list(executor.map(hash_row, batch))
+            conn = get_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.executemany(INSERT_USERS, hashed)
+                conn.commit()
+                # MySQL reports 1 per inserted row and 0 for untouched duplicates
+                if cursor.rowcount is not None and cursor.rowcount >= 0:
+                    inserted += cursor.rowcount
+                cursor.close()
+            finally:
+                conn.close()
+            read += len(batch)
+            logger.info("Provisioned %s users so far", read)
+
+    return {"read": read, "inserted": inserted, "seconds": round(time.perf_counter() - start, 3)}
+
+
+def main():
+    from authshield_server import db_pool
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv", nargs="?", help="CSV file of email,password rows (default: stdin)")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--skip-header", action="store_true")
+    args = parser.parse_args()
+
+    source = open(args.csv, newline="") if args.csv else sys.stdin
+    try:
+        reader = csv.reader(source)
+        if args.skip_header:
+            next(reader, None)
+        rows = ((row[0], row[1]) for row in reader if len(row) >= 2)
+        result = provision_users(rows, db_pool.connection, args.rounds, args.batch_size, args.workers)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    logger.info("Provisioning finished: %s", result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Server-side QR decoding for bulk enrolment on a process pool.
+
+Decoding is pure CPU and holds the GIL for most of the pyzbar scan, so images
+go to worker processes. Each image is decoded straight to grayscale, shrunk
+so its longest side is at most max_side pixels, then handed to pyzbar. The
+pool is bounded like the bcrypt pool: at most workers + queue_depth images are
+in flight, and past that callers get QrBusy instead of queueing without limit.
+Uploads over max_bytes are rejected before they reach a worker, and OpenCV
+refuses to allocate images over max_pixels (decompression bombs).
+
+Requires opencv-python(-headless), numpy and pyzbar (which needs libzbar),
+imported in the workers only.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError, as_completed
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class QrBusy(Exception):
+    """Every worker is busy and the queue is full"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"QR decoding pool is busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _init_worker(max_pixels):
+    # Read by OpenCV when the codecs load, so it must be set before the import
+    os.environ["OPENCV_IO_MAX_IMAGE_PIXELS"] = str(max_pixels)
+    import cv2
+
+    # One thread per process: the pool already uses every core
+    cv2.setNumThreads(1)
+
+
+def decode_image(data, max_side=1024):
+    """
+    Decode the QR codes in one encoded image (PNG, JPEG, ...)
+
+    Runs in a worker process.
+
+    Args:
+        data (bytes): The uploaded file
+        max_side (int): Longest side in pixels after downscaling
+
+    Returns:
+        list: Text payload of every QR code found
+    """
+    import cv2
+    import numpy
+    from pyzbar.pyzbar import ZBarSymbol, decode
+
+    image = cv2.imdecode(numpy.frombuffer(data, dtype=numpy.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError("Not a decodable image")
+    height, width = image.shape
+    if max(height, width) > max_side:
+        scale = max_side / float(max(height, width))
+        image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    return [symbol.data.decode("utf-8") for symbol in decode(image, symbols=[ZBarSymbol.QRCODE])]
+
+
+def parse_payload(text):
+    """
+    Turn a decoded QR payload into the qr_code_data dict /scan expects
+
+    The enrolment QR carries JSON with "uuid" and "encrypted_url", the same
+    object the app posts to /scan after scanning it on the phone.
+    """
+    try:
+        payload = json.loads(text)
+    except ValueError:
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+class QrDecoder:
+    def __init__(self, workers=None, queue_depth=128, max_side=1024, max_bytes=5 * 1024 * 1024,
+                 max_pixels=40_000_000, retry_after=1, timeout=30.0):
+        """
+        Args:
+            workers (int): Decoding processes (default: CPU count)
+            queue_depth (int): Images allowed to wait for a free process before QrBusy
+            max_side (int): Longest side in pixels after downscaling
+            max_bytes (int): Largest accepted upload per image
+            max_pixels (int): Largest decoded image OpenCV will allocate
+            retry_after (int): Seconds suggested to clients rejected with QrBusy
+            timeout (float): Seconds to wait for one image before giving up on it
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_side = max_side
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.retry_after = retry_after
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.workers + queue_depth)
+        self._executor = None
+        self._lock = threading.Lock()
+
+        self.decode_time = Histogram("qr_decode_seconds", "Time from submitting an image to its decoded result")
+        self.rejected_total = 0
+
+    def _pool(self):
+        # Started on first use so importing the server does not fork workers.
+        # By then the server runs request, scheduler and logging threads, and a
+        # plain fork would copy whatever locks they hold into every worker, so
+        # workers come from a forkserver (spawn where there is none).
+        with self._lock:
+            if self._executor is None:
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(method),
+                    initializer=_init_worker,
+                    initargs=(self.max_pixels,),
+                )
+            return self._executor
+
+    def _reserve(self, count):
+        # All of a batch's slots or none, so a half-admitted batch never waits on another
+        taken = 0
+        while taken < count:
+            if not self._slots.acquire(blocking=False):
+                for _ in range(taken):
+                    self._slots.release()
+                self.rejected_total += 1
+                raise QrBusy(self.retry_after)
+            taken += 1
+
+    def decode_many(self, images):
+        """
+        Submit a batch of images to the pool
+
+        Admission is all-or-nothing and happens here, so callers can answer
+        503 before they start streaming. Each slot is released as soon as its
+        image is decoded, whether or not the results are ever read.
+
+        Args:
+            images (list): (name, bytes) pairs
+
+        Returns:
+            generator: (name, payloads, error) in completion order, where
+                payloads is a list of QR texts and error a message, exactly
+                one of them being None
+
+        Raises:
+            QrBusy: The pool cannot take the whole batch
+        """
+        self._reserve(len(images))
+        rejected = []
+        futures = {}
+        try:
+            pool = self._pool()
+            for name, data in images:
+                if len(data) > self.max_bytes:
+                    self._slots.release()
+                    rejected.append((name, None, f"Image larger than {self.max_bytes} bytes"))
+                    continue
+                future = pool.submit(decode_image, data, self.max_side)
+                future.add_done_callback(lambda _: self._slots.release())
+                futures[future] = (name, time.perf_counter())
+        except Exception:
+            for _ in range(len(images) - len(rejected) - len(futures)):
+                self._slots.release()
+            for future in futures:
+                future.cancel()
+            raise
+        return self._results(rejected, futures)
+
+    def _results(self, rejected, futures):
+        yield from rejected
+        pending = set(futures)
+        try:
+            for future in as_completed(futures, timeout=self.timeout * max(1, len(futures) / self.workers)):
+                pending.discard(future)
+                name, submitted = futures[future]
+                self.decode_time.observe(time.perf_counter() - submitted)
+                try:
+                    yield name, future.result(), None
+                except Exception as e:
+                    logger.warning("QR decode failed for %s: %s", name, e)
+                    yield name, None, str(e) or e.__class__.__name__
+        except TimeoutError:
+            for future in list(pending):
+                yield futures[future][0], None, "Timed out waiting for a decoding worker"
+        finally:
+            # Client went away or the batch timed out: drop what has not started
+            for future in pending:
+                future.cancel()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "rejected_total": self.rejected_total,
+            "decode_p50_seconds": self.decode_time.percentile(50),
+            "decode_p99_seconds": self.decode_time.percentile(99),
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
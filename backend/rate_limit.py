@@ -0,0 +1,373 @@
+"""
+Admission control: token buckets per key and latency-based load shedding.
+
+RateLimiter keeps its buckets in process memory. SharedRateLimiter keeps them
+in a SQLite file (ideally on tmpfs, e.g. /dev/shm) so every worker on a host
+draws from the same bucket. Both answer allow(key) -> (allowed, retry_after).
+SharedReplayCache keeps one-time markers (e.g. used TOTP codes) in the same
+kind of file, so a marker set by one worker is seen by all of them.
+
+LoadShedder watches the p99 latency of the requests actually served over a
+sliding window and says when new work should be turned away. RouteLoadShedder
+keeps one per route, so a slow route only ever sheds itself.
+"""
+import bisect
+import logging
+import math
+import sqlite3
+import threading
+import time
+
+from metrics import DEFAULT_BUCKETS
+from shared_sqlite import SharedSQLite
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+def parse_route_limits(value):
+    """
+    Parse "route=rate/burst,route=rate/burst" into {route: (rate, burst)}
+
+    Rates are per second, e.g. "/login=0.2/5" allows a burst of 5 logins and
+    then one every five seconds. Malformed items are skipped.
+    """
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        route, _, spec = item.partition("=")
+        rate, _, burst = spec.partition("/")
+        try:
+            limits[route.strip()] = (float(rate), int(burst or max(1, math.ceil(float(rate)))))
+        except ValueError:
+            continue
+    return limits
+
+
+# Per-route buckets used by both servers unless RATE_LIMITS overrides them.
+# Polling allows for a few accounts per user; auth routes are keyed by IP
+# until there is a session, which is what slows credential stuffing down.
+DEFAULT_ROUTE_LIMITS = (
+    "/get-updated-totp=10/30,/update-totp=10/30,/get-codes=1/10,/lookahead-codes=1/10,/get-totp-data=1/10,"
+    "/login=0.2/5,/signup=0.1/3,/scan=1/5,/scan-images=0.2/2"
+)
+
+
+def make_limiter(rate, burst, store_path=None):
+    """SharedRateLimiter on store_path if given, else an in-process RateLimiter"""
+    if store_path:
+        return SharedRateLimiter(store_path, rate, burst)
+    return RateLimiter(rate, burst)
+
+
+def route_limiters(spec=DEFAULT_ROUTE_LIMITS, store_path=None):
+    """
+    Build {route: limiter} from a RATE_LIMITS string; routes with rate 0 are unlimited
+
+    Args:
+        spec (str): "route=rate/burst,..." as accepted by parse_route_limits()
+        store_path (str): Shared SQLite file, or None for per-process buckets
+    """
+    return {
+        route: make_limiter(rate, burst, store_path)
+        for route, (rate, burst) in parse_route_limits(spec).items()
+        if rate > 0
+    }
+
+
+def client_key(route, uid, remote_addr):
+    """Bucket key for a request: the session uid when logged in, else the client IP"""
+    return f"{route}|uid:{uid}" if uid else f"{route}|ip:{remote_addr}"
+
+
+def _take(tokens, updated, now, rate, burst):
+    # Refill for the time elapsed, then try to spend one token
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens < 1:
+        return False, tokens, max(1, math.ceil((1 - tokens) / rate))
+    return True, tokens - 1, 0
+
+
+class RateLimiter:
+    def __init__(self, rate, burst, max_keys=100_000, clock=time.monotonic):
+        """
+        Token bucket per key, e.g. per account on /verify
+
+        Each key may spend `burst` requests at once and then `rate` per second.
+        Buckets live in a bounded TTLCache and expire once they would be full
+        again, so idle keys cost no memory and a flood of distinct keys only
+        evicts the least recently used buckets.
+
+        Args:
+            rate (float): Tokens added per second
+            burst (int): Bucket capacity
+            max_keys (int): Most buckets kept at once
+            clock (callable): Monotonic time source
+        """
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._buckets = TTLCache(max_entries=max_keys, clock=clock)
+        self._lock = threading.Lock()
+        self.rejected_total = 0
+
+    def allow(self, key):
+        """
+        Take one token from a key's bucket
+
+        Returns:
+            tuple: (allowed, retry_after) where retry_after is the whole number
+                of seconds until a token is available (0 when allowed)
+        """
+        now = self._clock()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            allowed, tokens, retry_after = _take(tokens, updated, now, self.rate, self.burst)
+            self._buckets.set(key, (tokens, now), ttl=(self.burst - tokens) / self.rate)
+            if not allowed:
+                self.rejected_total += 1
+            return allowed, retry_after
+
+
+class SharedRateLimiter(SharedSQLite):
+    # Buckets that have refilled completely are purged once every this many calls
+    PURGE_EVERY = 1000
+
+    def __init__(self, path, rate, burst, clock=time.time):
+        """
+        Token bucket per key shared by every worker on the host, backed by SQLite
+
+        Several limiters can use the same file as long as their keys differ
+        (e.g. are prefixed with the route). If the file is locked for longer
+        than a second the request is let through rather than failed.
+
+        Args:
+            path (str): Database file shared by the workers
+            rate (float): Tokens added per second
+            burst (int): Bucket capacity
+            clock (callable): Wall-clock time source, shared across processes
+        """
+        super().__init__(path, (
+            "CREATE TABLE IF NOT EXISTS rate_buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)",
+        ))
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._calls = 0
+        self.rejected_total = 0
+
+    def allow(self, key):
+        """Take one token from a key's bucket; same result as RateLimiter.allow()"""
+        conn = self._connection()
+        now = self._clock()
+        try:
+            # IMMEDIATE takes the write lock up front, so read-modify-write is atomic across workers
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+                tokens, updated = row if row else (self.burst, now)
+                allowed, tokens, retry_after = _take(tokens, updated, now, self.rate, self.burst)
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)",
+                    (key, tokens, now, now + (self.burst - tokens) / self.rate),
+                )
+                with self._lock:
+                    self._calls += 1
+                    purge = self._calls % self.PURGE_EVERY == 0
+                if purge:
+                    conn.execute("DELETE FROM rate_buckets WHERE full_at <= ?", (now,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning("Shared rate limit store unavailable, allowing request: %s", e)
+            return True, 0
+        if not allowed:
+            with self._lock:
+                self.rejected_total += 1
+        return allowed, retry_after
+
+
+def make_replay_cache(max_entries, store_path=None):
+    """SharedReplayCache on store_path if given, else an in-process TTLCache"""
+    if store_path:
+        return SharedReplayCache(store_path)
+    return TTLCache(max_entries=max_entries)
+
+
+class SharedReplayCache(SharedSQLite):
+    # Expired markers are purged once every this many calls
+    PURGE_EVERY = 1000
+
+    def __init__(self, path, clock=time.time):
+        """
+        Set of one-time markers with expiry shared by every worker, backed by SQLite
+
+        Answers add() like TTLCache.add(), so it can stand in for one. Unlike
+        the rate limiter it does not let requests through when the file is
+        locked: sqlite3.Error propagates, because accepting a marker twice is
+        exactly what it exists to prevent.
+
+        Args:
+            path (str): Database file shared by the workers
+            clock (callable): Wall-clock time source, shared across processes
+        """
+        super().__init__(path, (
+            "CREATE TABLE IF NOT EXISTS replay_markers (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)",
+        ))
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def add(self, key, value=True, ttl=None):
+        """
+        Record a marker only if it is absent or expired, atomically across workers
+
+        Args:
+            key: Marker; tuples are joined with ":" into the stored key
+            value: Ignored, accepted for compatibility with TTLCache.add()
+            ttl (float): Seconds the marker lives
+
+        Returns:
+            bool: True if recorded, False if a live marker already existed
+        """
+        if isinstance(key, tuple):
+            key = ":".join(map(str, key))
+        conn = self._connection()
+        now = self._clock()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM replay_markers WHERE key = ? AND expires_at <= ?", (key, now))
+            added = conn.execute(
+                "INSERT OR IGNORE INTO replay_markers (key, expires_at) VALUES (?, ?)", (key, now + (ttl or 0))
+            ).rowcount == 1
+            with self._lock:
+                self._calls += 1
+                purge = self._calls % self.PURGE_EVERY == 0
+            if purge:
+                conn.execute("DELETE FROM replay_markers WHERE expires_at <= ?", (now,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return added
+
+
+class LoadShedder:
+    def __init__(self, p99_threshold, window=10.0, min_samples=50, retry_after=2,
+                 buckets=DEFAULT_BUCKETS, clock=time.monotonic):
+        """
+        Turn work away while the recent p99 latency is above a threshold
+
+        Latencies are counted in one-second slices of histogram buckets, so
+        the p99 always covers the last `window` seconds and old spikes age
+        out. Only requests that were served should be observed: while
+        shedding, no new samples arrive, the window drains and traffic is
+        let back in after at most `window` seconds to re-measure.
+
+        Args:
+            p99_threshold (float): Seconds; shed while the windowed p99 is above it
+            window (float): Seconds of history the p99 is computed over
+            min_samples (int): Fewer samples than this never trigger shedding
+            retry_after (int): Seconds suggested to shed clients
+        """
+        self.p99_threshold = p99_threshold
+        self.window = window
+        self.min_samples = min_samples
+        self.retry_after = retry_after
+        self.buckets = tuple(buckets)
+        self._clock = clock
+        self._slices = {}
+        self._lock = threading.Lock()
+        self._checked_second = None
+        self._overloaded = False
+        self.shed_total = 0
+
+    def observe(self, latency):
+        second = int(self._clock())
+        index = bisect.bisect_left(self.buckets, latency)
+        with self._lock:
+            counts = self._slices.get(second)
+            if counts is None:
+                counts = self._slices[second] = [0] * (len(self.buckets) + 1)
+                for old in [s for s in self._slices if s <= second - self.window]:
+                    del self._slices[old]
+            counts[index] += 1
+
+    def p99(self):
+        """Upper bound of the bucket holding the windowed p99, and the sample count"""
+        oldest = self._clock() - self.window
+        with self._lock:
+            live = [counts for second, counts in self._slices.items() if second > oldest]
+        totals = [sum(column) for column in zip(*live)] if live else [0] * (len(self.buckets) + 1)
+        count = sum(totals)
+        if not count:
+            return 0.0, 0
+        target = count * 0.99
+        running = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), totals):
+            running += bucket_count
+            if running >= target:
+                return bound, count
+        return float("inf"), count
+
+    def overloaded(self):
+        # Re-evaluated at most once a second; in between every request reads the cached answer
+        second = int(self._clock())
+        if second != self._checked_second:
+            p99, count = self.p99()
+            self._overloaded = count >= self.min_samples and p99 > self.p99_threshold
+            self._checked_second = second
+        return self._overloaded
+
+    def admit(self):
+        """False, and counted in shed_total, while the p99 is over the threshold"""
+        if not self.overloaded():
+            return True
+        with self._lock:
+            self.shed_total += 1
+        return False
+
+
+class RouteLoadShedder:
+    def __init__(self, p99_threshold, **kwargs):
+        """
+        One LoadShedder per route, created on the route's first request
+
+        A single p99 over every route lets /login (bcrypt) or /scan (decrypt
+        retries) push it over the threshold and get the cheap TOTP reads shed
+        with them. Here each route is measured, and shed, on its own latency.
+
+        Args:
+            p99_threshold (float): Seconds; a route sheds while its p99 is above it
+            **kwargs: Passed to every LoadShedder (window, min_samples, ...)
+        """
+        self.p99_threshold = p99_threshold
+        self.retry_after = kwargs.get("retry_after", 2)
+        self._kwargs = kwargs
+        self._shedders = {}
+        self._lock = threading.Lock()
+
+    def _shedder(self, route):
+        shedder = self._shedders.get(route)
+        if shedder is None:
+            with self._lock:
+                shedder = self._shedders.setdefault(route, LoadShedder(self.p99_threshold, **self._kwargs))
+        return shedder
+
+    def observe(self, route, latency):
+        self._shedder(route).observe(latency)
+
+    def admit(self, route):
+        """False, and counted in shed_total, while the route's p99 is over the threshold"""
+        return self._shedder(route).admit()
+
+    def overloaded(self):
+        """True while any route is shedding"""
+        return any(shedder.overloaded() for shedder in list(self._shedders.values()))
+
+    @property
+    def shed_total(self):
+        return sum(shedder.shed_total for shedder in list(self._shedders.values()))
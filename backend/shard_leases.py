@@ -0,0 +1,158 @@
+"""
+Shard ownership for running the TOTP scheduler on several workers or nodes.
+
+Every user_uuid maps to one of SCHEDULER_SHARDS shards (crc32 modulo the shard
+count). Nodes hold time-limited leases on shards in the scheduler_leases table
+and only advance codes for secrets in shards they own. Live nodes heartbeat in
+scheduler_nodes so the shards spread evenly: each node claims at most its fair
+share, hands back any surplus when a node joins, and picks up the expired
+leases of a node that stopped renewing.
+
+Leases compare wall-clock times written by different nodes, so node clocks
+must be kept in sync (NTP); skew should stay well under the lease length.
+"""
+import logging
+import math
+import os
+import socket
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(user_uuid, shards):
+    """Shard number of a user_uuid; stable across processes and restarts"""
+    return zlib.crc32(str(user_uuid).encode("utf-8")) % shards
+
+
+def default_node_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class ShardLeases:
+    def __init__(self, get_connection, shards, node_id=None, lease_seconds=30, clock=time.time):
+        """
+        Args:
+            get_connection (callable): Returns a DB-API connection (e.g. a pooled one)
+            shards (int): Number of shards the user_uuids are split into
+            node_id (str): Unique name of this process (default: hostname:pid)
+            lease_seconds (float): How long a lease lasts without renewal; a
+                dead node's shards are taken over after at most this long
+        """
+        self._get_connection = get_connection
+        self.shards = shards
+        self.node_id = node_id or default_node_id()
+        self.lease_seconds = lease_seconds
+        self._clock = clock
+        self._owned = frozenset()
+        self._expires_at = 0.0
+        self._seeded = False
+
+    @property
+    def renew_interval(self):
+        """Renew three times per lease so one missed renewal does not lose the shards"""
+        return self.lease_seconds / 3.0
+
+    @property
+    def owned(self):
+        """
+        Shards held right now; empty once the leases from the last successful
+        renewal have expired, so a node that cannot reach the database stops
+        advancing shards another node may already have taken over
+        """
+        if self._clock() >= self._expires_at:
+            return frozenset()
+        return self._owned
+
+    def owns(self, user_uuid):
+        return shard_of(user_uuid, self.shards) in self.owned
+
+    def renew(self):
+        """
+        Heartbeat, renew held leases and claim or release shards toward a fair share
+
+        Returns:
+            frozenset: Shards this node owns until the next renewal
+        """
+        now = self._clock()
+        expires_at = now + self.lease_seconds
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            if not self._seeded:
+                cursor.executemany(
+                    "INSERT INTO scheduler_leases (shard, owner, expires_at) VALUES (%s, NULL, 0) "
+                    "ON DUPLICATE KEY UPDATE shard = shard",
+                    [(shard,) for shard in range(self.shards)],
+                )
+                self._seeded = True
+
+            cursor.execute(
+                "INSERT INTO scheduler_nodes (node_id, expires_at) VALUES (%s, %s) "
+                "ON DUPLICATE KEY UPDATE expires_at = VALUES(expires_at)",
+                (self.node_id, expires_at),
+            )
+            cursor.execute("SELECT COUNT(*) FROM scheduler_nodes WHERE expires_at > %s", (now,))
+            live_nodes = max(1, cursor.fetchone()[0])
+            fair_share = math.ceil(self.shards / live_nodes)
+
+            # Renewing only matches rows still held by this node, so a lease
+            # another node took over after expiry is never reclaimed
+            cursor.execute(
+                "UPDATE scheduler_leases SET expires_at = %s WHERE owner = %s AND expires_at > %s",
+                (expires_at, self.node_id, now),
+            )
+            cursor.execute(
+                "SELECT shard FROM scheduler_leases WHERE owner = %s AND expires_at > %s ORDER BY shard",
+                (self.node_id, now),
+            )
+            owned = [row[0] for row in cursor.fetchall()]
+
+            if len(owned) > fair_share:
+                surplus = owned[fair_share:]
+                cursor.executemany(
+                    "UPDATE scheduler_leases SET owner = NULL, expires_at = 0 WHERE shard = %s AND owner = %s",
+                    [(shard, self.node_id) for shard in surplus],
+                )
+                owned = owned[:fair_share]
+            elif len(owned) < fair_share:
+                cursor.execute("SELECT shard FROM scheduler_leases WHERE expires_at <= %s ORDER BY shard", (now,))
+                for (shard,) in cursor.fetchall():
+                    if len(owned) >= fair_share:
+                        break
+                    # Conditional claim: only one node's UPDATE can match an expired row
+                    cursor.execute(
+                        "UPDATE scheduler_leases SET owner = %s, expires_at = %s WHERE shard = %s AND expires_at <= %s",
+                        (self.node_id, expires_at, shard, now),
+                    )
+                    if cursor.rowcount == 1:
+                        owned.append(shard)
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+
+        owned = frozenset(owned)
+        if owned != self._owned:
+            logger.info("Node %s now owns %s of %s shards: %s", self.node_id, len(owned), self.shards, sorted(owned))
+        # Every lease held after this renewal, claimed or renewed, ends at expires_at
+        self._owned = owned
+        self._expires_at = expires_at
+        return owned
+
+    def release_all(self):
+        """Give up every lease and the heartbeat, e.g. on clean shutdown"""
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE scheduler_leases SET owner = NULL, expires_at = 0 WHERE owner = %s", (self.node_id,)
+            )
+            cursor.execute("DELETE FROM scheduler_nodes WHERE node_id = %s", (self.node_id,))
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        self._owned = frozenset()
+        self._expires_at = 0.0
@@ -0,0 +1,54 @@
+"""
+Per-thread connections to a SQLite file shared by every worker on a host.
+
+SharedCodeStore, SharedRateLimiter and SharedReplayCache keep cross-worker
+state in SQLite files (ideally on tmpfs, e.g. /dev/shm). A SQLite connection
+must not be used on both sides of a fork(), and with gunicorn --preload these
+stores are built in the master. So the schema is created on a connection
+that is closed straight away, each thread opens its own connection on first
+use, and a forked child drops every connection it inherited.
+"""
+import os
+import sqlite3
+import threading
+import weakref
+
+_stores = weakref.WeakSet()
+# Connections inherited through fork(); kept referenced so the child never closes them
+_inherited = []
+
+
+class SharedSQLite:
+    def __init__(self, path, schema=()):
+        """
+        Args:
+            path (str): Database file shared by the workers
+            schema (iterable): CREATE ... IF NOT EXISTS statements run once, here
+        """
+        self.path = path
+        self._local = threading.local()
+        conn = sqlite3.connect(path, timeout=1, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in schema:
+                conn.execute(statement)
+        finally:
+            conn.close()
+        _stores.add(self)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+
+def _forget_connections():
+    for store in list(_stores):
+        _inherited.append(store._local)
+        store._local = threading.local()
+
+
+os.register_at_fork(after_in_child=_forget_connections)
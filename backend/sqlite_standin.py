@@ -0,0 +1,186 @@
+"""
+SQLite-backed stand-in for the AuthShield MySQL database.
+
+Used for local development, load tests and exercising the connection pool
+without a MySQL/MariaDB server. It accepts the MySQL-flavoured SQL the
+backend issues (%s placeholders, ON DUPLICATE KEY UPDATE) and rewrites it
+to SQLite syntax.
+"""
+import re
+import sqlite3
+import threading
+import zlib
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS AppUsers (
+    uid INTEGER PRIMARY KEY AUTOINCREMENT,
+    email VARCHAR(255) NOT NULL UNIQUE,
+    password VARCHAR(255) NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_totp (
+    user_uuid VARCHAR(64) PRIMARY KEY,
+    totp_secret VARCHAR(255) NOT NULL,
+    account VARCHAR(255),
+    uid INTEGER,
+    next_code VARCHAR(16),
+    "2faenabled" INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_user_totp_account ON user_totp (account, uid, totp_secret);
+CREATE INDEX IF NOT EXISTS idx_user_totp_uid_enabled
+    ON user_totp (uid, "2faenabled", account, totp_secret, next_code);
+CREATE TABLE IF NOT EXISTS scheduler_leases (
+    shard INTEGER PRIMARY KEY,
+    owner VARCHAR(128),
+    expires_at DOUBLE NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS scheduler_nodes (
+    node_id VARCHAR(128) PRIMARY KEY,
+    expires_at DOUBLE NOT NULL
+);
+-- The tables above already hold everything migrations.py adds
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+INSERT OR IGNORE INTO schema_migrations (version, name)
+    VALUES (1, 'create_tables'), (2, 'hot_path_indexes'), (3, 'scheduler_leases');
+"""
+
+_UPSERT = re.compile(r"ON\s+DUPLICATE\s+KEY\s+UPDATE", re.IGNORECASE)
+_VALUES_FN = re.compile(r"VALUES\((\"?\w+\"?)\)", re.IGNORECASE)
+_DIGIT_IDENT = re.compile(r'(?<!["\w])(2faenabled)\b')
+
+_bootstrap_lock = threading.Lock()
+
+# MySQL's ER_DUP_ENTRY, so callers can detect unique violations the same way on both backends
+ER_DUP_ENTRY = 1062
+
+
+class IntegrityError(sqlite3.IntegrityError):
+    def __init__(self, message, errno=None):
+        super().__init__(message)
+        self.errno = errno
+
+
+def _raise_integrity(error):
+    errno = ER_DUP_ENTRY if "UNIQUE constraint failed" in str(error) else None
+    raise IntegrityError(str(error), errno) from error
+
+
+def translate(sql):
+    """Rewrite a MySQL-style statement into SQLite syntax"""
+    sql = sql.replace("%s", "?").replace("`", '"')
+    sql = _DIGIT_IDENT.sub(r'"\1"', sql)
+    match = _UPSERT.search(sql)
+    if match:
+        head, tail = sql[:match.start()], sql[match.end():]
+        sql = head + "ON CONFLICT DO UPDATE SET" + _VALUES_FN.sub(r"excluded.\1", tail)
+    return sql
+
+
+class Cursor:
+    def __init__(self, raw):
+        self._raw = raw
+
+    def execute(self, sql, params=()):
+        try:
+            self._raw.execute(translate(sql), tuple(params or ()))
+        except sqlite3.IntegrityError as e:
+            _raise_integrity(e)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        try:
+            self._raw.executemany(translate(sql), [tuple(p) for p in seq_of_params])
+        except sqlite3.IntegrityError as e:
+            _raise_integrity(e)
+        return self
+
+    def fetchone(self):
+        return self._raw.fetchone()
+
+    def fetchall(self):
+        return self._raw.fetchall()
+
+    def fetchmany(self, size=1):
+        return self._raw.fetchmany(size)
+
+    @property
+    def lastrowid(self):
+        return self._raw.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._raw.rowcount
+
+    @property
+    def description(self):
+        return self._raw.description
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def close(self):
+        self._raw.close()
+
+
+def _crc32(value):
+    return None if value is None else zlib.crc32(str(value).encode("utf-8"))
+
+
+def _mod(value, divisor):
+    return None if value is None or not divisor else value % divisor
+
+
+def _if(condition, then, otherwise):
+    return then if condition else otherwise
+
+
+class Connection:
+    def __init__(self, path):
+        self._raw = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # MySQL functions the backend uses that SQLite lacks
+        self._raw.create_function("CRC32", 1, _crc32, deterministic=True)
+        self._raw.create_function("MOD", 2, _mod, deterministic=True)
+        self._raw.create_function("IF", 3, _if, deterministic=True)
+        self._open = True
+
+    def cursor(self, *args, **kwargs):
+        return Cursor(self._raw.cursor())
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def ping(self, *args, **kwargs):
+        if not self._open:
+            raise sqlite3.ProgrammingError("Connection is closed")
+        self._raw.execute("SELECT 1").fetchall()
+
+    def is_connected(self):
+        return self._open
+
+    def close(self):
+        self._open = False
+        self._raw.close()
+
+
+def connect(path):
+    """Open a MySQL-compatible connection to the SQLite database at path"""
+    return Connection(path)
+
+
+def bootstrap(path):
+    """Create the AuthShield tables if they do not exist yet"""
+    with _bootstrap_lock:
+        raw = sqlite3.connect(path)
+        try:
+            # WAL lets concurrent readers proceed while a writer commits
+            raw.execute("PRAGMA journal_mode=WAL")
+            raw.executescript(SCHEMA)
+            raw.commit()
+        finally:
+            raw.close()
@@ -0,0 +1,361 @@
+"""
+Streaming export and import of enrolled TOTP accounts.
+
+An archive is a header line followed by length-prefixed frames. Each frame is
+a Fernet token (AES-128-CBC + HMAC) around a zlib-compressed block of JSON
+lines: a frame record first, then one user_totp row per line. The first
+frame names the exporting uid (null for a full export) and a random archive
+id; every later frame repeats the id with a sequence number and the last one
+is marked as the end, so frames cannot be spliced between archives, reordered
+or dropped without the import failing. Export reads user_totp one page at a
+time, by user_uuid, and returns the connection to the pool before each frame
+goes out, so a slow download never holds a connection. Import first reads the
+whole archive through, checking every frame, while keeping the still
+encrypted bytes in a spooled temporary file. Only a complete, valid archive
+is then decrypted again and written, one executemany transaction per frame.
+Memory stays flat whether the archive holds ten rows or a million, and no
+plaintext secret is written to disk.
+
+    python totp_backup.py genkey
+    TOTP_BACKUP_KEY=... python totp_backup.py export backup.astb [--uid 42]
+    TOTP_BACKUP_KEY=... python totp_backup.py import backup.astb [--uid 42]
+
+Requires the cryptography package.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import struct
+import sys
+import tempfile
+import zlib
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"AUTHSHIELD-TOTP-BACKUP 2\n"
+COLUMNS = ("user_uuid", "totp_secret", "account", "uid", "next_code", "2faenabled")
+_FRAME_HEADER = struct.Struct(">I")
+# Frame lengths come from the archive itself, so they are capped before any
+# buffer is sized from them. A 1000-row frame is well under 1 MB.
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+MAX_BLOCK_BYTES = 64 * 1024 * 1024
+# Archives larger than this are spooled to a temporary file instead of memory
+SPOOL_MEMORY_BYTES = 8 * 1024 * 1024
+
+EXPORT_QUERY = "SELECT user_uuid, totp_secret, account, uid, next_code, 2faenabled FROM user_totp"
+OWNERS_QUERY = "SELECT user_uuid, uid, totp_secret, account FROM user_totp WHERE user_uuid IN ({})"
+# The owner is never reassigned: a row that already belongs to another uid is
+# left as it is, even if it appears between the owner check and the write
+IMPORT_QUERY = (
+    "INSERT INTO user_totp (user_uuid, totp_secret, account, uid, next_code, 2faenabled) "
+    "VALUES (%s, %s, %s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE "
+    "totp_secret = IF(uid = VALUES(uid), VALUES(totp_secret), totp_secret), "
+    "account = IF(uid = VALUES(uid), VALUES(account), account), "
+    "next_code = IF(uid = VALUES(uid), VALUES(next_code), next_code), "
+    "2faenabled = IF(uid = VALUES(uid), VALUES(2faenabled), 2faenabled)"
+)
+
+
+class BackupError(Exception):
+    """The archive is corrupt, truncated or encrypted with another key"""
+
+
+def generate_key():
+    from cryptography.fernet import Fernet
+
+    return Fernet.generate_key().decode("ascii")
+
+
+def _fernet(key):
+    from cryptography.fernet import Fernet
+
+    return Fernet(key.encode("ascii") if isinstance(key, str) else key)
+
+
+def _encode_frame(fernet, record, rows=()):
+    lines = itertools.chain((record,), (dict(zip(COLUMNS, row)) for row in rows))
+    block = "".join(json.dumps(line, separators=(",", ":")) + "\n" for line in lines)
+    token = fernet.encrypt(zlib.compress(block.encode("utf-8"), 6))
+    if len(token) > MAX_FRAME_BYTES:
+        raise BackupError("Frame exceeds MAX_FRAME_BYTES; export with fewer rows per frame")
+    return _FRAME_HEADER.pack(len(token)) + token
+
+
+def export_archive(get_connection, key, uid=None, chunk_rows=1000):
+    """
+    Yield an archive of user_totp rows as bytes chunks, one frame at a time
+
+    Args:
+        get_connection (callable): Returns a DB-API connection (e.g. a pooled one)
+        key (str): Fernet key
+        uid (int): Only export this user's accounts (default: every row)
+        chunk_rows (int): Rows per frame, which bounds memory on both ends
+
+    Yields:
+        bytes: The header and owner frame, one encrypted frame per chunk_rows
+            rows, then the end frame
+    """
+    fernet = _fernet(key)
+    archive = os.urandom(16).hex()
+    yield MAGIC
+    yield _encode_frame(fernet, {"archive": archive, "seq": 0, "uid": uid})
+    exported = 0
+    seq = 0
+    last_uuid = ""
+    while True:
+        rows = _export_page(get_connection, uid, last_uuid, chunk_rows)
+        if not rows:
+            break
+        exported += len(rows)
+        seq += 1
+        last_uuid = rows[-1][0]
+        yield _encode_frame(fernet, {"archive": archive, "seq": seq}, rows)
+    yield _encode_frame(fernet, {"archive": archive, "seq": seq + 1, "end": True})
+    logger.info("Exported %s TOTP rows", exported)
+
+
+def _export_page(get_connection, uid, after_uuid, limit):
+    # Keyset page on the primary key; the connection is back in the pool before the frame is sent
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        if uid is None:
+            cursor.execute(EXPORT_QUERY + " WHERE user_uuid > %s ORDER BY user_uuid LIMIT %s", (after_uuid, limit))
+        else:
+            cursor.execute(
+                EXPORT_QUERY + " WHERE uid = %s AND user_uuid > %s ORDER BY user_uuid LIMIT %s",
+                (uid, after_uuid, limit),
+            )
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
+    finally:
+        conn.close()
+
+
+def _read_exactly(stream, size):
+    data = bytearray()
+    while len(data) < size:
+        part = stream.read(size - len(data))
+        if not part:
+            break
+        data += part
+    return bytes(data)
+
+
+def _read_frames(stream, fernet):
+    from cryptography.fernet import InvalidToken
+
+    while True:
+        header = _read_exactly(stream, _FRAME_HEADER.size)
+        if not header:
+            raise BackupError("Archive ends before its end frame")
+        if len(header) < _FRAME_HEADER.size:
+            raise BackupError("Truncated frame header")
+        (length,) = _FRAME_HEADER.unpack(header)
+        if length > MAX_FRAME_BYTES:
+            raise BackupError("Frame is larger than any export writes")
+        token = _read_exactly(stream, length)
+        if len(token) < length:
+            raise BackupError("Truncated frame")
+        try:
+            inflater = zlib.decompressobj()
+            block = inflater.decompress(fernet.decrypt(token), MAX_BLOCK_BYTES)
+        except (InvalidToken, zlib.error) as e:
+            raise BackupError("Frame could not be decrypted; wrong key or corrupted archive") from e
+        if inflater.unconsumed_tail or not inflater.eof:
+            raise BackupError("Frame does not decompress within MAX_BLOCK_BYTES")
+        try:
+            record, *rows = block.decode("utf-8").splitlines()
+            yield json.loads(record), rows
+        except ValueError as e:
+            raise BackupError("Frame holds malformed data") from e
+
+
+def read_archive(stream, key, uid=None):
+    """
+    Yield the rows of an archive as dicts, decrypting one frame at a time
+
+    Args:
+        stream: Binary file-like object positioned at the start of the archive
+        key (str): Fernet key the archive was written with
+        uid (int): Reject the archive unless this user exported it (default:
+            accept any archive, e.g. a full export restored from the CLI)
+
+    Raises:
+        BackupError: Wrong key, bad header, another user's archive, or a
+            truncated, reordered or tampered frame
+    """
+    fernet = _fernet(key)
+    if _read_exactly(stream, len(MAGIC)) != MAGIC:
+        raise BackupError("Not an AuthShield TOTP backup")
+    frames = _read_frames(stream, fernet)
+    owner, _ = next(frames)
+    if owner.get("seq") != 0 or "archive" not in owner:
+        raise BackupError("Archive does not start with its owner frame")
+    if uid is not None and owner.get("uid") != uid:
+        raise BackupError("Archive was exported by another user")
+    for seq, (record, rows) in enumerate(frames, start=1):
+        if record.get("archive") != owner["archive"] or record.get("seq") != seq:
+            raise BackupError("Frame belongs to another archive or is out of order")
+        try:
+            decoded = [json.loads(line) for line in rows]
+        except ValueError as e:
+            raise BackupError("Frame holds malformed rows") from e
+        yield from decoded
+        if record.get("end"):
+            return
+
+
+class _CopyingReader:
+    # Hands reads through to read_archive() and keeps the bytes it consumed
+    def __init__(self, stream, sink):
+        self._stream = stream
+        self._sink = sink
+
+    def read(self, size):
+        data = self._stream.read(size)
+        self._sink.write(data)
+        return data
+
+
+def validated_copy(stream, key, uid=None):
+    """
+    Read a whole archive through and return a seekable copy once it checks out
+
+    Every frame is decrypted and checked, so a wrong key, another user's
+    archive, or a truncated, reordered or tampered frame is reported before
+    anything is written. The copy keeps the encrypted bytes, in memory up to
+    SPOOL_MEMORY_BYTES and in a temporary file beyond that.
+
+    Returns:
+        SpooledTemporaryFile: The archive, positioned at its start; close it when done
+
+    Raises:
+        BackupError: As read_archive()
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+    try:
+        for _ in read_archive(_CopyingReader(stream, spool), key, uid):
+            pass
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def import_archive(stream, key, get_connection, uid=None, batch_size=1000, on_replace=None):
+    """
+    Check a whole archive, then upsert its rows; nothing is written from an invalid one
+
+    Args:
+        stream: Binary file-like object positioned at the start of the archive
+        key (str): Fernet key the archive was written with
+        uid (int): Accept only archives this user exported, and import the rows as theirs
+        batch_size, on_replace: As import_rows()
+
+    Returns:
+        int: Rows written
+
+    Raises:
+        BackupError: The archive failed validation; user_totp is untouched
+    """
+    with validated_copy(stream, key, uid) as archive:
+        return import_rows(read_archive(archive, key, uid), get_connection, uid, batch_size, on_replace)
+
+
+def import_rows(rows, get_connection, uid=None, batch_size=1000, on_replace=None):
+    """
+    Upsert archive rows into user_totp in bounded transactions
+
+    Rows whose user_uuid already belongs to another uid are skipped; an
+    import only ever adds rows or replaces rows of the same owner.
+
+    Args:
+        rows (iterable): Row dicts, e.g. from read_archive(); consumed lazily
+        get_connection (callable): Returns a DB-API connection
+        uid (int): Assign every row to this user instead of the archived uid
+        batch_size (int): Rows per executemany and per transaction
+        on_replace (callable): Called with (totp_secret, account) of each
+            existing row after the import replaced it, to drop cached state
+
+    Returns:
+        int: Rows written
+    """
+    imported = 0
+    skipped = 0
+    iterator = iter(rows)
+    while True:
+        batch = [
+            tuple(uid if column == "uid" and uid is not None else row.get(column) for column in COLUMNS)
+            for row in itertools.islice(iterator, batch_size)
+        ]
+        if not batch:
+            break
+        conn = get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(OWNERS_QUERY.format(", ".join(["%s"] * len(batch))), [row[0] for row in batch])
+            existing = {user_uuid: (owner, secret, account) for user_uuid, owner, secret, account in cursor.fetchall()}
+            owned = [row for row in batch if row[0] not in existing or existing[row[0]][0] == row[3]]
+            if owned:
+                cursor.executemany(IMPORT_QUERY, owned)
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        if on_replace is not None:
+            for row in owned:
+                if row[0] in existing:
+                    on_replace(*existing[row[0]][1:])
+        imported += len(owned)
+        skipped += len(batch) - len(owned)
+        logger.info("Imported %s TOTP rows so far", imported)
+    if skipped:
+        logger.warning("Skipped %s TOTP rows that belong to another user", skipped)
+    return imported
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["genkey", "export", "import"])
+    parser.add_argument("path", nargs="?", help="Archive file (default: stdout for export, stdin for import)")
+    parser.add_argument("--uid", type=int, help="Export only this user / import only an archive this user exported")
+    parser.add_argument("--chunk-rows", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.command == "genkey":
+        print(generate_key())
+        return
+
+    key = os.getenv("TOTP_BACKUP_KEY")
+    if not key:
+        parser.error("TOTP_BACKUP_KEY is not set; create one with 'genkey'")
+
+    from authshield_server import db_pool
+
+    if args.command == "export":
+        out = open(args.path, "wb") if args.path else sys.stdout.buffer
+        try:
+            for chunk in export_archive(db_pool.connection, key, args.uid, args.chunk_rows):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+    else:
+        source = open(args.path, "rb") if args.path else sys.stdin.buffer
+        try:
+            count = import_archive(source, key, db_pool.connection, args.uid, args.chunk_rows)
+        finally:
+            if source is not sys.stdin.buffer:
+                source.close()
+        logger.info("Import finished: %s rows", count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import hmac
+import os
+import time
+
+from alphanumeric_totp import generate_batch
+from key_cache import BulkKeys, KeyCache
+
+# Codes are keyed to 45-second windows: window_start is passed straight to
+# generate_otp() as the counter, matching what generate_totp() has always stored.
+WINDOW_SECONDS = 45
+
+# Decoded, pre-keyed secrets shared by every route and the scheduler tick
+key_cache = KeyCache(
+    max_bytes=int(os.getenv("TOTP_KEY_CACHE_BYTES", str(4 * 1024 * 1024))),
+    ttl=float(os.getenv("TOTP_KEY_CACHE_TTL", "3600")),
+)
+
+# The scheduler tick's own keys, so bulk passes do not flush key_cache
+tick_keys = BulkKeys()
+
+
+def window_bounds(now=None):
+    """
+    Return the current window as (window_start, time_until_next)
+
+    Args:
+        now (float): Unix timestamp to evaluate (default: current time)
+    """
+    current_time = int(time.time() if now is None else now)
+    window_start = current_time - (current_time % WINDOW_SECONDS)
+    return window_start, WINDOW_SECONDS - (current_time % WINDOW_SECONDS)
+
+
+def code_for_window(totp_secret, window_start):
+    """Derive the code for a window start directly from the stored secret"""
+    return generate_batch([(totp_secret, window_start)], keys=key_cache)[0]
+
+
+def codes_for_window(totp_secrets, window_start):
+    """Derive the codes of many secrets for one window in a single batch"""
+    return generate_batch([(totp_secret, window_start) for totp_secret in totp_secrets], keys=key_cache)
+
+
+def codes_for_tick(totp_secrets, window_start):
+    """Derive the codes of every scheduled secret for one window, keyed outside key_cache"""
+    return generate_batch(
+        [(totp_secret, window_start) for totp_secret in totp_secrets], keys=tick_keys.next_pass()
+    )
+
+
+def lookahead_codes(totp_secrets, window_start, windows):
+    """
+    Derive the codes of many secrets for several consecutive windows in a single batch
+
+    Returns:
+        list: One list per secret holding its codes for window_start and the
+            windows - 1 windows after it, in order
+    """
+    counters = [window_start + offset * WINDOW_SECONDS for offset in range(windows)]
+    codes = generate_batch(
+        [(totp_secret, counter) for totp_secret in totp_secrets for counter in counters], keys=key_cache
+    )
+    return [codes[index:index + windows] for index in range(0, len(codes), windows)]
+
+
+def match_window(totp_secret, code, window_start, drift=1):
+    """
+    Find the window a submitted code belongs to, within +/- drift windows
+
+    Every candidate is derived in one batch from the same pre-keyed secret,
+    and compared in constant time.
+
+    Returns:
+        int: The matching window_start, or None
+    """
+    candidates = [window_start + offset * WINDOW_SECONDS for offset in range(-drift, drift + 1)]
+    codes = generate_batch([(totp_secret, counter) for counter in candidates], keys=key_cache)
+    submitted = str(code).strip().upper().encode("utf-8")
+    matched = None
+    for counter, expected in zip(candidates, codes):
+        # No early exit, so timing does not reveal which offset matched
+        if hmac.compare_digest(expected.encode("utf-8"), submitted):
+            matched = counter
+    return matched
+
+
+def current_code(totp_secret, now=None):
+    """
+    Compute the code for the current window on read
+
+    Returns:
+        tuple: (code, window_start, time_until_next)
+    """
+    window_start, time_until_next = window_bounds(now)
+    return code_for_window(totp_secret, window_start), window_start, time_until_next
@@ -0,0 +1,171 @@
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class TotpScheduler:
+    def __init__(self, tick, interval=30, leases=None):
+        """
+        Process-wide scheduler that advances every enrolled secret in one batched tick
+
+        Instead of one BackgroundScheduler (and thread pool) per enrolled account,
+        a single job fires on each interval boundary and hands the whole set of
+        active secrets to `tick` at once.
+
+        With `leases`, several processes can run the scheduler against the same
+        database: every tick reloads the enrolled secrets (scans may have landed
+        on another node) and advances only those in shards this node owns.
+
+        Args:
+            tick (callable): Called with a list of (user_uuid, totp_secret) pairs
+            interval (int): Tick period in seconds; ticks are aligned to multiples of it
+            leases (ShardLeases): Optional shard ownership for multi-node deployments
+        """
+        self._tick = tick
+        self.interval = interval
+        self.leases = leases
+        self._load_rows = None
+        self._secrets = {}
+        self._lock = threading.Lock()
+        self._scheduler = None
+        self._started = False
+        self._listeners = []
+
+        self.tick_lag = Histogram("totp_tick_lag_seconds", "How late each tick fired after its window boundary")
+        self.tick_time = Histogram("totp_tick_seconds", "Time spent computing and writing back a tick")
+
+    def add(self, user_uuid, totp_secret):
+        """Enroll or re-enroll a secret; re-scans replace the existing entry"""
+        with self._lock:
+            self._secrets[user_uuid] = totp_secret
+        logger.info("Scheduled TOTP generation for user: %s", user_uuid)
+
+    def remove(self, user_uuid):
+        """Stop advancing a secret, e.g. after the account is unenrolled"""
+        with self._lock:
+            removed = self._secrets.pop(user_uuid, None) is not None
+        if removed:
+            logger.info("Removed TOTP generation for user: %s", user_uuid)
+        return removed
+
+    def load(self, rows):
+        """Replace the schedule with (user_uuid, totp_secret) rows, e.g. from user_totp"""
+        with self._lock:
+            self._secrets = {user_uuid: secret for user_uuid, secret in rows}
+        logger.info("Loaded %s TOTP secrets into the scheduler", len(self._secrets))
+
+    def add_listener(self, listener):
+        """Register a callable run after every tick, even when no secrets are enrolled"""
+        self._listeners.append(listener)
+
+    def active_count(self):
+        with self._lock:
+            return len(self._secrets)
+
+    def job_count(self):
+        """Jobs registered with the underlying scheduler; 1 while running"""
+        scheduler = self._scheduler
+        return len(scheduler.get_jobs()) if scheduler is not None else 0
+
+    def start(self, load_rows=None):
+        """
+        Start the shared tick job once per process
+
+        Args:
+            load_rows (callable): Optional callable returning the (user_uuid,
+                totp_secret) rows to rebuild the schedule from. Called with no
+                arguments, or with leases with the set of owned shards, in which
+                case it should return only rows in those shards
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self._load_rows = load_rows
+
+        if self.leases is not None:
+            self._renew_leases()
+        elif load_rows is not None:
+            try:
+                self.load(load_rows())
+            except Exception as e:
+                logger.error("Failed to rebuild TOTP schedule: %s", e)
+
+        # Imported here: processes that never serve a request never need APScheduler
+        from apscheduler.schedulers.background import BackgroundScheduler
+
+        # First tick on the next interval boundary so codes roll with the window
+        now = time.time()
+        first_tick = now - (now % self.interval) + self.interval
+        self._scheduler = BackgroundScheduler(
+            job_defaults={"coalesce": True, "max_instances": 1, "misfire_grace_time": self.interval}
+        )
+        self._scheduler.add_job(
+            self.run_tick,
+            "interval",
+            seconds=self.interval,
+            start_date=datetime.fromtimestamp(first_tick, timezone.utc),
+            id="totp_tick",
+            replace_existing=True,
+        )
+        if self.leases is not None:
+            self._scheduler.add_job(
+                self._renew_leases,
+                "interval",
+                seconds=self.leases.renew_interval,
+                id="lease_renewal",
+                replace_existing=True,
+            )
+        self._scheduler.start()
+        logger.info("TOTP scheduler started with a %ss tick", self.interval)
+
+    def run_tick(self):
+        """Advance every active secret in a single batch, then notify listeners"""
+        started = time.time()
+        self.tick_lag.observe(started % self.interval)
+        if self.leases is not None and self._load_rows is not None:
+            # Only the owned shards are loaded, so adding nodes shrinks each node's work
+            owned = self.leases.owned
+            try:
+                self.load(self._load_rows(owned) if owned else [])
+            except Exception as e:
+                logger.error("Failed to reload TOTP secrets: %s", e)
+        with self._lock:
+            batch = list(self._secrets.items())
+        if self.leases is not None:
+            batch = [(user_uuid, secret) for user_uuid, secret in batch if self.leases.owns(user_uuid)]
+        if batch:
+            try:
+                self._tick(batch)
+            except Exception as e:
+                logger.error("TOTP scheduler tick failed: %s", e)
+        self.tick_time.observe(time.time() - started)
+
+        for listener in self._listeners:
+            try:
+                listener()
+            except Exception as e:
+                logger.error("TOTP scheduler listener failed: %s", e)
+
+    def _renew_leases(self):
+        try:
+            self.leases.renew()
+        except Exception as e:
+            logger.error("Shard lease renewal failed: %s", e)
+
+    def shutdown(self):
+        with self._lock:
+            scheduler, self._scheduler = self._scheduler, None
+            self._started = False
+        if scheduler is not None:
+            scheduler.shutdown(wait=False)
+            if self.leases is not None:
+                try:
+                    self.leases.release_all()
+                except Exception as e:
+                    logger.warning("Could not release shard leases: %s", e)
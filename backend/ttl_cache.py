@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None, sizeof=None, clock=time.monotonic):
+        """
+        Thread-safe LRU cache with optional time-to-live and memory cap
+
+        Args:
+            max_entries (int): Evict least recently used entries beyond this count
+            max_bytes (int): Evict least recently used entries beyond this estimated size
+            ttl (float): Default lifetime of an entry in seconds (None: no expiry)
+            sizeof (callable): Estimates the size in bytes of a value, used with max_bytes
+            clock (callable): Monotonic time source
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof or (lambda value: 0)
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        """Return the cached value, refreshing its LRU position, or default"""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at, size = entry
+            if expires_at is not None and expires_at <= self._clock():
+                del self._entries[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=_MISSING):
+        """
+        Store a value
+
+        Args:
+            ttl (float): Lifetime for this entry, overriding the cache default
+        """
+        ttl = self.ttl if ttl is _MISSING else ttl
+        expires_at = None if ttl is None else self._clock() + ttl
+        size = self._sizeof(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[key] = (value, expires_at, size)
+            self._bytes += size
+            self._evict()
+
+    def add(self, key, value, ttl=_MISSING):
+        """
+        Store a value only if the key is absent or expired, atomically
+
+        Returns:
+            bool: True if stored, False if a live entry already existed
+        """
+        ttl = self.ttl if ttl is _MISSING else ttl
+        now = self._clock()
+        size = self._sizeof(value)
+        with self._lock:
+            old = self._entries.get(key, _MISSING)
+            if old is not _MISSING:
+                if old[1] is None or old[1] > now:
+                    return False
+                del self._entries[key]
+                self._bytes -= old[2]
+                self.expirations += 1
+            self._entries[key] = (value, None if ttl is None else now + ttl, size)
+            self._bytes += size
+            self._evict()
+            return True
+
+    def _evict(self):
+        while self._entries and (
+            (self.max_entries is not None and len(self._entries) > self.max_entries)
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            _, (_, _, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def pop(self, key):
+        """Invalidate a single entry; returns True if it was cached"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return False
+            self._bytes -= entry[2]
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        """Return hit/miss counters and current occupancy"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
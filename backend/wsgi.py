@@ -0,0 +1,63 @@
+"""
+App factory for pre-fork WSGI servers.
+
+    gunicorn --preload -w 4 -b 0.0.0.0:5000 'wsgi:create_app()'
+
+With --preload the master runs create_app() once and the workers are forked
+from it, so the app module, its light imports and whatever WSGI_PRELOAD lists
+are loaded once and shared copy-on-write instead of once per worker. Heavy
+dependencies used by only some routes (requests, APScheduler, cryptography,
+OpenCV, pyzbar, mysql.connector) are imported on first use, so a worker that
+never serves those routes never pays for them. No connection or thread made
+in the master is used by a worker: the pool connects lazily, the scheduler
+starts on each worker's first request, and the log listener restarts after
+fork. The shared SQLite stores (TOTP_CODE_CACHE_PATH, RATE_LIMIT_STORE_PATH)
+create their tables in the master on a connection they close again, and a
+worker drops any store connection it inherits (see shared_sqlite.py).
+
+    WSGI_PRELOAD=requests,apscheduler.schedulers.background   # share these too
+"""
+import gc
+import importlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def preload(modules):
+    """
+    Import modules in the master so forked workers share them
+
+    Args:
+        modules (iterable): Dotted module names; ones that fail to import are skipped
+    """
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning("Could not preload %s: %s", name, e)
+
+
+def create_app(preload_modules=None):
+    """
+    Build the Flask app, preloading shared read-only state
+
+    Args:
+        preload_modules (list): Modules to import before fork
+            (default: comma-separated WSGI_PRELOAD, empty if unset)
+
+    Returns:
+        flask.Flask: The AuthShield app
+    """
+    from authshield_server import app
+
+    if preload_modules is None:
+        preload_modules = [name.strip() for name in os.getenv("WSGI_PRELOAD", "").split(",") if name.strip()]
+    preload(preload_modules)
+
+    # Everything allocated so far is long-lived; moving it out of the collector's
+    # generations keeps gc passes in the workers from touching (and so copying) it
+    gc.collect()
+    gc.freeze()
+    return app
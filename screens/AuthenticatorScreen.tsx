@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef, useCallback } from "react";
 import {
   View,
   Text,
@@ -35,6 +35,13 @@ type TotpCode = {
   timeRemaining: number;
 };
 
+type CodesResponse = {
+  window_start: number;
+  window_end: number;
+  timeRemaining: number;
+  codes: Array<{ id: string; account: string; code: string; next_code: string }>;
+};
+
 const AuthenticatorScreen: React.FC = () => {
   const navigation = useNavigation<AuthenticatorScreenNavigationProp>();
   const [modalVisible, setModalVisible] = useState(false);
@@ -48,7 +55,9 @@ const AuthenticatorScreen: React.FC = () => {
   const [setupKey, setSetupKey] = useState("");
   const [recoveryCodes, setRecoveryCodes] = useState<string[]>([]);
 
-  const [allIntervales,setAllIntervals] = useState<any[]>([]);
+  // Local time (seconds) at which the current code window ends
+  const windowEnd = useRef<number>(0);
+  const refreshTimer = useRef<ReturnType<typeof setTimeout> | null>(null);
 
   useEffect(() => {
     setFacing((current) => "back");
@@ -72,64 +81,57 @@ const AuthenticatorScreen: React.FC = () => {
 
   useEffect(() => {
     const interval = setInterval(() => {
-      setTotpCodes((prevCodes) => {
-        const updatedCodes = prevCodes.map((code) => ({
-          ...code,
-          timeRemaining: 30 - Math.floor((Date.now() / 1000) % 30),
-        }));
-        return updatedCodes;
-      });
-    }, 1000); // Set timer to update only once every second
+      const timeRemaining = Math.max(
+        0,
+        Math.ceil(windowEnd.current - Date.now() / 1000)
+      );
+      setTotpCodes((prevCodes) =>
+        prevCodes.map((code) => ({ ...code, timeRemaining }))
+      );
+    }, 1000); // Local countdown only, no network traffic
 
     return () => clearInterval(interval); // Cleanup on unmount
   }, []);
 
-  useEffect(()=>{
-    return ()=>{
-      try{
-        allIntervales.forEach(clearInterval);
-      }catch(e){
-
-      }
-    }
-  },[])
-
-  useEffect(() => {
-    const fetchTotpsAfterLogin = async () => {
-      try {
-        const response = await axios.get<{ 
-          totp_enabled: boolean; 
-          totp_data: Array<{ id: string; account: string; code: string; timeRemaining: number }>}>
-          ("http://13.203.127.173:5000/get-totp-data", {
+  // Fetch every account's code in one request, then sleep until the window rolls over
+  const refreshCodes = useCallback(async () => {
+    if (refreshTimer.current) clearTimeout(refreshTimer.current);
+    let nextRefresh = 5;
+    try {
+      const response = await axios.get<CodesResponse>(
+        "http://13.203.127.173:5000/get-codes",
+        {
           headers: {
             "Content-Type": "application/json",
             Accept: "application/json",
           },
-        });
-  
-        console.log(response.data)
-        if (response.data.totp_enabled) {
-          const totpList: TotpCode[] = response.data.totp_data.map((totp) => ({
-            id: totp.id,  
-            account: totp.account,
-            code: totp.code || "", 
-            timeRemaining: totp.timeRemaining || 30, 
-          }));
-
-          setTotpCodes(totpList);
-          for (const code of totpList) {
-            await getCode(code); // Fetch the current TOTP code
-            await makeInterval(code); // Start updating the code periodically
-          }
+          timeout: 10000,
         }
-      } catch (error) {
-        console.error("Error fetching TOTP data after login:", error);
-      }
-    };
-  
-    // Fetch TOTP codes after login
-    fetchTotpsAfterLogin();
+      );
+      const { codes, timeRemaining } = response.data;
+      windowEnd.current = Date.now() / 1000 + timeRemaining;
+      setTotpCodes(
+        codes.map((totp) => ({
+          id: totp.id,
+          account: totp.account,
+          code: totp.code,
+          timeRemaining,
+        }))
+      );
+      nextRefresh = timeRemaining;
+    } catch (error) {
+      console.error("Error fetching TOTP codes:", error);
+    }
+    refreshTimer.current = setTimeout(refreshCodes, nextRefresh * 1000);
   }, []);
+
+  useEffect(() => {
+    // Fetch TOTP codes after login
+    refreshCodes();
+    return () => {
+      if (refreshTimer.current) clearTimeout(refreshTimer.current);
+    };
+  }, [refreshCodes]);
   
 
   const renderCodeItem = ({ item }: { item: TotpCode }) => (
@@ -146,56 +148,6 @@ const AuthenticatorScreen: React.FC = () => {
   );
 
 
-  const getCode = async (code:TotpCode) => {
-    try {
-      console.log(code.account)
-      const response = await axios.post(
-        "http://13.203.127.173:5000/get-updated-totp",  // Call the new endpoint
-        {
-          account: code.account, // Send only the UUID
-        },
-        {
-          headers: {
-            "Content-Type": "application/json",
-            Accept: "application/json",
-          },
-          timeout: 30000,  // You can adjust this if necessary
-        }
-      );
-     console.log(response.data);
-     
-      let f = false;
-      for(const totp of totpCodes){
-        if(totp.account == code.account){
-          f = true;
-          break;
-        }
-      }
-      
-      if(f){
-        setTotpCodes((prev)=>{
-          return prev.map((eachCode)=>{
-            return (eachCode.account == code.account && (!eachCode.code || eachCode.code == code.code))?{...eachCode,"code":response.data.code}:eachCode
-          })
-        })
-      }else{
-        setTotpCodes([...totpCodes,{...response.data,"account":code.account}]);
-      }
-
-    } catch (error) {
-      
-      console.error("Error updating TOTP:", error);
-    }
-  }
-  async function makeInterval(code:TotpCode){
-    await getCode(code);
-    const newInterval = setInterval(async ()=>{
-      console.log("Called")
-      await getCode(code);
-    }, 1000); // Trigger after timeRemaining
-    setAllIntervals([...allIntervales,newInterval]);
-  }
-
   const handleBarCodeScanned = async ({ data }: { data: string }) => {
     setScanned(true);
   
@@ -236,16 +188,8 @@ const AuthenticatorScreen: React.FC = () => {
           console.log("Success:", response.data.message);
   
           console.log(response.data);
-          // Extract relevant data from the backend response
-          const { message, uid, account, code, timeRemaining } = response.data;
-  
-          // Add the new account and TOTP code to the state
-          setTotpCodes((prevCodes) => [
-            ...prevCodes,
-            { id: uid, account, code, timeRemaining },
-          ]);
-          await getCode({ id: uid, account, code, timeRemaining });
-          await makeInterval({ id: uid, account, code, timeRemaining });
+          // Reload all codes so the new account joins the shared refresh cycle
+          await refreshCodes();
 
         } else {
           console.error("No message in the server response.");